@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark: frames/sec of the on-box person detector on this machine's CPU
+
+Usage: python3 bench_local_detector.py [image.jpg] [frames]
+
+The model is taken from LOCAL_DNN_MODEL / LOCAL_DNN_CONFIG / LOCAL_DNN_PERSON_CLASS,
+the same variables server.py uses. Without an image a synthetic 640x480 frame is used.
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from local_detector import LocalPersonDetector
+
+MODEL = os.environ.get('LOCAL_DNN_MODEL', 'models/MobileNetSSD_deploy.caffemodel')
+CONFIG = os.environ.get('LOCAL_DNN_CONFIG', 'models/MobileNetSSD_deploy.prototxt')
+PERSON_CLASS = int(os.environ.get('LOCAL_DNN_PERSON_CLASS', '15'))
+
+def load_frame(path):
+    if path:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"❌ Could not read {path}")
+            sys.exit(1)
+        return image
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+
+if __name__ == "__main__":
+    image_path = sys.argv[1] if len(sys.argv) > 1 else None
+    frame_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    detector = LocalPersonDetector(MODEL, CONFIG or None, person_class_id=PERSON_CLASS)
+    if not detector.available():
+        print(f"❌ Model not found: {MODEL} (config: {CONFIG})")
+        sys.exit(1)
+
+    image = load_frame(image_path)
+    ok, encoded = cv2.imencode('.jpg', image)
+    jpeg_bytes = encoded.tobytes()
+    print(f"=== Local detector benchmark: {os.path.basename(MODEL)}, {image.shape[1]}x{image.shape[0]}, {frame_count} frames ===\n")
+
+    start = time.perf_counter()
+    detector.load()
+    print(f"Model load:     {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    # Warm-up pass so the first-inference allocation cost isn't counted
+    detections = detector.detect(image)
+
+    start = time.perf_counter()
+    for _ in range(frame_count):
+        detector.detect(image)
+    inference = time.perf_counter() - start
+    print(f"Inference only: {frame_count / inference:8.1f} frames/s  ({inference / frame_count * 1000:.1f} ms/frame)")
+
+    # What a detection check pays: JPEG decode + inference
+    start = time.perf_counter()
+    for _ in range(frame_count):
+        detector.detect(cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR))
+    total = time.perf_counter() - start
+    print(f"Decode + infer: {frame_count / total:8.1f} frames/s  ({total / frame_count * 1000:.1f} ms/frame)")
+
+    print(f"\nPersons in frame: {len(detections)}" +
+          "".join(f"\n  {confidence:.2f} at {box}" for confidence, box in detections))
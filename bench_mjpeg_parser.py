@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: incremental MJPEGParser vs. the old bytes re-scanning loop
+
+Usage: python3 bench_mjpeg_parser.py [frame_kb] [frames] [chunk_size]
+"""
+
+import sys
+import time
+
+from mjpeg_parser import MJPEGParser
+
+BOUNDARY = '123456789000000000000987654321'
+
+def build_stream(frame_size, frame_count):
+    payload = b'\xff\xd8' + bytes(i % 251 for i in range(frame_size)) + b'\xff\xd9'
+    part = (b'--' + BOUNDARY.encode() + b'\r\n' +
+            b'Content-Type: image/jpeg\r\n' +
+            b'Content-Length: ' + str(len(payload)).encode() + b'\r\n\r\n' +
+            payload + b'\r\n')
+    return part * frame_count
+
+def legacy_parse(stream, chunk_size):
+    """The frame loop stream_proxy.generate() used before MJPEGParser"""
+    frames = 0
+    buffer = b''
+    boundary = BOUNDARY
+    for i in range(0, len(stream), chunk_size):
+        buffer += stream[i:i + chunk_size]
+        while True:
+            start_boundary = buffer.find(b'--' + boundary.encode())
+            if start_boundary == -1:
+                break
+            end_boundary_marker = buffer.find(b'\r\n', start_boundary)
+            if end_boundary_marker == -1:
+                break
+            start_image = buffer.find(b'\r\n\r\n', end_boundary_marker)
+            if start_image == -1:
+                break
+            next_boundary = buffer.find(b'--' + boundary.encode(), start_image + 4)
+            if next_boundary == -1:
+                break
+            image_data = buffer[start_image + 4 : next_boundary]
+            if image_data:
+                frames += 1
+            buffer = buffer[next_boundary:]
+    return frames
+
+def parser_parse(stream, chunk_size):
+    parser = MJPEGParser(BOUNDARY)
+    frames = 0
+    for i in range(0, len(stream), chunk_size):
+        frames += len(parser.feed(stream[i:i + chunk_size]))
+    return frames
+
+def run(name, func, stream, chunk_size):
+    start = time.perf_counter()
+    frames = func(stream, chunk_size)
+    duration = time.perf_counter() - start
+    mb = len(stream) / (1024 * 1024)
+    print(f"{name:<14} {frames:>5} frames in {duration:7.3f}s  "
+          f"{frames / duration:9.1f} frames/s  {mb / duration:8.1f} MB/s")
+    return duration
+
+if __name__ == "__main__":
+    frame_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    frame_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+
+    stream = build_stream(frame_kb * 1024, frame_count)
+    print(f"=== MJPEG parser benchmark: {frame_count} x {frame_kb} KB frames, {chunk_size} B chunks ===\n")
+    legacy = run("legacy", legacy_parse, stream, chunk_size)
+    incremental = run("MJPEGParser", parser_parse, stream, chunk_size)
+    print(f"\nSpeedup: {legacy / incremental:.1f}x")
@@ -0,0 +1,93 @@
+"""
+Perceptual-hash cache of person detection results.
+
+Frames are keyed per camera by a difference hash (dHash, computed by the caller),
+and a new frame reuses the closest cached result whose hash is within max_distance
+bits. The cache only answers forced checks of an unchanged scene that already has a
+person in it (see cache_allowed()), so it only ever needs to hold positive results:
+a departure changes the scene, and changed frames always go to the model.
+"""
+
+import collections
+import threading
+import time
+
+DEFAULT_MAX_DISTANCE = 2  # Hamming distance in bits
+DEFAULT_TTL = 300         # Seconds a cached result stays valid
+DEFAULT_SIZE = 32         # Cached results per camera (least recently used are evicted)
+
+# Motion gate reason for checks forced because a person is present
+PERSON_PRESENT_REASON = "person present"
+
+
+def cache_allowed(gate_reason, change_ratio, change_threshold):
+    """
+    True if a check may be answered from the cache.
+
+    Only checks the motion gate forced because a person is present, on a frame that did not
+    change, qualify. Frames that changed, periodic re-checks and checks of an empty scene
+    always go to the model.
+    """
+    return gate_reason == PERSON_PRESENT_REASON and change_ratio < change_threshold
+
+
+class DetectionResultCache:
+    """Per-camera LRU of (is_present, response_text) keyed by perceptual hash, with TTL."""
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, ttl=DEFAULT_TTL, size=DEFAULT_SIZE):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = {}  # camera_id -> OrderedDict(dhash -> {'is_present', 'response_text', 'timestamp'})
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, camera_id, dhash, now=None):
+        """Return the closest cached result within max_distance, or None."""
+        now = time.time() if now is None else now
+        with self.lock:
+            entries = self.entries.get(camera_id)
+            if entries:
+                for key in [k for k, v in entries.items() if now - v['timestamp'] > self.ttl]:
+                    del entries[key]
+                best_key, best_distance = None, None
+                for key in entries:
+                    distance = bin(key ^ dhash).count('1')
+                    if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                        best_key, best_distance = key, distance
+                if best_key is not None:
+                    entries.move_to_end(best_key)
+                    self.hits += 1
+                    return dict(entries[best_key], distance=best_distance)
+            self.misses += 1
+            return None
+
+    def store(self, camera_id, dhash, is_present, response_text, now=None):
+        """Cache a model answer. Negative answers are not kept (see the module docstring)."""
+        if not is_present:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            entries = self.entries.setdefault(camera_id, collections.OrderedDict())
+            entries[dhash] = {'is_present': is_present, 'response_text': response_text, 'timestamp': now}
+            entries.move_to_end(dhash)
+            while len(entries) > self.size:
+                entries.popitem(last=False)
+
+    def invalidate(self, camera_id=None):
+        with self.lock:
+            if camera_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(camera_id, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'entries': {camera_id: len(entries) for camera_id, entries in self.entries.items()}
+            }
@@ -0,0 +1,387 @@
+"""
+SQLite index of saved person-detection images.
+
+The server records every image it saves (camera, time, file name, AI response) so
+the gallery can query one camera's detections without listing and parsing the
+whole detected_persons directory. The database runs in WAL mode so the detection
+threads can write while gallery requests read.
+
+Images are stored in per-camera, per-day shards (detected_persons/<camera_id>/<YYYYMMDD>/)
+so no single directory grows without bound; rel_path records where each file lives.
+Rows from before sharding have no rel_path and sit directly in detected_persons until
+compact() moves them.
+
+Rebuild the index from the files on disk with:
+
+    python3 detection_store.py reindex [--db detections.db] [--dir detected_persons]
+
+and move images left in the flat directory into their shards with "compact".
+"""
+
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import threading
+
+DEFAULT_DB_FILE = 'detections.db'
+DEFAULT_IMAGE_DIR = 'detected_persons'
+DEFAULT_PAGE_SIZE = 50
+
+# <camera_id>_<YYYYMMDD>_<HHMMSS>_<uuid>.jpg
+FILENAME_PATTERN = re.compile(r'^(?P<camera_id>.+)_(?P<date>\d{8})_(?P<time>\d{6})_(?P<unique_id>[0-9a-fA-F-]+)\.jpg$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    camera_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    filename TEXT NOT NULL UNIQUE,
+    response_text TEXT,
+    file_size INTEGER,
+    rel_path TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_detections_camera_time ON detections (camera_id, timestamp);
+"""
+
+
+def parse_detection_filename(filename):
+    """Return (camera_id, datetime) for a saved detection image name, or None if it doesn't match."""
+    match = FILENAME_PATTERN.match(filename)
+    if not match:
+        return None
+    try:
+        timestamp = datetime.datetime.strptime(f"{match.group('date')}_{match.group('time')}", "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+    return match.group('camera_id'), timestamp
+
+
+def shard_path(camera_id, timestamp, filename):
+    """Relative path ('<camera_id>/<YYYYMMDD>/<filename>') an image is stored under."""
+    if not isinstance(timestamp, datetime.datetime):
+        timestamp = datetime.datetime.fromtimestamp(timestamp)
+    return f"{camera_id}/{timestamp.strftime('%Y%m%d')}/{filename}"
+
+
+def image_rel_path(row):
+    """Path of a row's image relative to the image directory."""
+    return row.get('rel_path') or row['filename']
+
+
+def response_rel_path(rel_path):
+    """The AI response saved next to an image."""
+    return rel_path[:-4] + '.txt'
+
+
+def encode_cursor(row):
+    """Opaque pagination cursor pointing just past this row (newest-first order)."""
+    return f"{row['timestamp']!r}:{row['id']}"
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) from a cursor, or None if it is malformed."""
+    try:
+        timestamp, row_id = cursor.rsplit(':', 1)
+        return float(timestamp), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class DetectionStore:
+    """Thread-safe access to the detections table (one connection per thread)."""
+
+    def __init__(self, db_path=DEFAULT_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(detections)')}
+            if 'rel_path' not in columns:
+                conn.execute('ALTER TABLE detections ADD COLUMN rel_path TEXT')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, camera_id, timestamp, filename, response_text, file_size=None, rel_path=None):
+        """Record a saved image. timestamp is a datetime or Unix time."""
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = timestamp.timestamp()
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO detections (camera_id, timestamp, filename, response_text, file_size, rel_path) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (camera_id, timestamp, filename, response_text, file_size, rel_path))
+
+    def get(self, filename):
+        row = self._connection().execute('SELECT * FROM detections WHERE filename = ?', (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, camera_id, limit=None):
+        """A camera's detections, newest first, as dicts."""
+        query = 'SELECT * FROM detections WHERE camera_id = ? ORDER BY timestamp DESC, id DESC'
+        params = [camera_id]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [dict(row) for row in self._connection().execute(query, params)]
+
+    def query(self, camera_id=None, cursor=None, since=None, until=None, text=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        One page of detections, newest first.
+
+        Args:
+            camera_id: Only this camera (None for all cameras).
+            cursor: Continue after the row this cursor (from encode_cursor) points to.
+            since, until: Unix time range, inclusive.
+            text: Case-insensitive substring of the AI response.
+            limit: Page size.
+
+        Returns:
+            list: Rows as dicts; pass encode_cursor(rows[-1]) to get the next page.
+        """
+        where, params = self._where(camera_id, since, until, text)
+        position = decode_cursor(cursor) if cursor else None
+        if position is not None:
+            where.append('(timestamp < ? OR (timestamp = ? AND id < ?))')
+            params.extend([position[0], position[0], position[1]])
+
+        query = 'SELECT * FROM detections'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self._connection().execute(query, params)]
+
+    @staticmethod
+    def _where(camera_id=None, since=None, until=None, text=None):
+        """WHERE clauses and parameters for the query()/count() filters."""
+        clauses = []
+        params = []
+        if camera_id is not None:
+            clauses.append('camera_id = ?')
+            params.append(camera_id)
+        if since is not None:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('timestamp <= ?')
+            params.append(until)
+        if text:
+            clauses.append("response_text LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(text)}%")
+        return clauses, params
+
+    def iter_query(self, batch_size=500, limit=None, **filters):
+        """Yield matching rows newest first, reading the table in keyset-paginated batches."""
+        cursor = filters.pop('cursor', None)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            rows = self.query(cursor=cursor, limit=size, **filters)
+            for row in rows:
+                yield row
+            if len(rows) < size:
+                return
+            cursor = encode_cursor(rows[-1])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def count(self, camera_id=None, since=None, until=None, text=None):
+        """Number of detections matching the same filters as query()."""
+        where, params = self._where(camera_id, since, until, text)
+        query = 'SELECT COUNT(*) FROM detections'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        return self._connection().execute(query, params).fetchone()[0]
+
+    def delete(self, filename):
+        with self._connection() as conn:
+            return conn.execute('DELETE FROM detections WHERE filename = ?', (filename,)).rowcount
+
+    def delete_many(self, filenames):
+        with self._connection() as conn:
+            return conn.executemany('DELETE FROM detections WHERE filename = ?', [(name,) for name in filenames]).rowcount
+
+    def delete_camera(self, camera_id):
+        with self._connection() as conn:
+            return conn.execute('DELETE FROM detections WHERE camera_id = ?', (camera_id,)).rowcount
+
+    def usage(self, camera_id=None):
+        """Per-camera image count, bytes and time span: {camera_id: {...}}."""
+        query = 'SELECT camera_id, COUNT(*), COALESCE(SUM(file_size), 0), MIN(timestamp), MAX(timestamp) FROM detections'
+        params = []
+        if camera_id is not None:
+            query += ' WHERE camera_id = ?'
+            params.append(camera_id)
+        rows = self._connection().execute(query + ' GROUP BY camera_id', params)
+        return {camera_id: {'count': count, 'bytes': total_bytes, 'oldest': oldest, 'newest': newest}
+                for camera_id, count, total_bytes, oldest, newest in rows}
+
+    def oldest(self, camera_id, limit=DEFAULT_PAGE_SIZE):
+        """A camera's detections, oldest first."""
+        return [dict(row) for row in self._connection().execute(
+            'SELECT * FROM detections WHERE camera_id = ? ORDER BY timestamp, id LIMIT ?', (camera_id, limit))]
+
+    def expired(self, camera_id, max_age=None, max_count=None, max_bytes=None, now=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        The oldest detections of a camera that fall outside the retention policy.
+
+        Args:
+            max_age: Seconds to keep images for (None/0 for no age limit).
+            max_count: Images to keep per camera (None/0 for no limit).
+            max_bytes: Bytes to keep per camera (None/0 for no limit).
+            limit: Return at most this many rows (one deletion batch).
+
+        Returns:
+            list: Rows as dicts, oldest first.
+        """
+        usage = self.usage(camera_id).get(camera_id)
+        if not usage:
+            return []
+        cutoff = (now if now is not None else datetime.datetime.now().timestamp()) - max_age if max_age else None
+        count, total_bytes = usage['count'], usage['bytes']
+
+        expired = []
+        for row in self.oldest(camera_id, limit):
+            if not ((cutoff is not None and row['timestamp'] < cutoff) or
+                    (max_count and count > max_count) or
+                    (max_bytes and total_bytes > max_bytes)):
+                # Everything after this row is newer and the camera is within its limits
+                break
+            expired.append(row)
+            count -= 1
+            total_bytes -= row['file_size'] or 0
+        return expired
+
+    def unsharded(self, limit=DEFAULT_PAGE_SIZE):
+        """Rows whose image still sits directly in the image directory."""
+        return [dict(row) for row in self._connection().execute(
+            "SELECT * FROM detections WHERE rel_path IS NULL OR instr(rel_path, '/') = 0 ORDER BY id LIMIT ?",
+            (limit,))]
+
+    def compact(self, image_dir=DEFAULT_IMAGE_DIR, limit=DEFAULT_PAGE_SIZE):
+        """
+        Move up to limit unsharded images (and their response files) into their
+        <camera_id>/<YYYYMMDD> shard. Rows whose image no longer exists are dropped.
+
+        Returns:
+            Tuple: (moved, dropped) - (filename, old_rel_path, new_rel_path) for each image
+            moved, and the number of rows dropped.
+        """
+        moved = []
+        gone = []
+        for row in self.unsharded(limit):
+            old_rel_path = image_rel_path(row)
+            new_rel_path = shard_path(row['camera_id'], row['timestamp'], row['filename'])
+            source = os.path.join(image_dir, old_rel_path)
+            target = os.path.join(image_dir, new_rel_path)
+            if os.path.exists(source):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(source, target)
+                try:
+                    os.replace(os.path.join(image_dir, response_rel_path(old_rel_path)),
+                               os.path.join(image_dir, response_rel_path(new_rel_path)))
+                except FileNotFoundError:
+                    pass
+            elif not os.path.exists(target):
+                # Image is gone; drop the row so it doesn't stay at the head of unsharded()
+                gone.append(row['filename'])
+                continue
+            moved.append((row['filename'], old_rel_path, new_rel_path))
+
+        with self._connection() as conn:
+            conn.executemany('UPDATE detections SET rel_path = ? WHERE filename = ?',
+                             [(new_rel_path, filename) for filename, _, new_rel_path in moved])
+            conn.executemany('DELETE FROM detections WHERE filename = ?', [(name,) for name in gone])
+        return moved, len(gone)
+
+    def reindex(self, image_dir=DEFAULT_IMAGE_DIR, skip_dirs=('thumbnails',)):
+        """
+        Bring the index in line with the images on disk: add files that are missing,
+        drop rows whose image is gone and fix the path of images that moved.
+        Both the flat directory and the camera/day shards are scanned; directories
+        listed in skip_dirs (thumbnails) are not.
+
+        Returns:
+            Tuple: (added, removed)
+        """
+        # Read the index before walking the directory: rows the server adds during the walk are
+        # then neither seen as stale nor overwritten
+        conn = self._connection()
+        indexed = {row[0]: row[1] or row[0] for row in conn.execute('SELECT filename, rel_path FROM detections')}
+
+        on_disk = {}
+        for root, dirs, files in os.walk(image_dir):
+            if root == image_dir:
+                dirs[:] = [name for name in dirs if name not in skip_dirs]
+            for name in files:
+                parsed = parse_detection_filename(name)
+                if parsed is None:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    file_size = os.path.getsize(path)
+                except OSError:
+                    continue
+                rel_path = os.path.relpath(path, image_dir).replace(os.sep, '/')
+                on_disk[name] = (parsed, file_size, rel_path)
+
+        missing = [name for name in on_disk if name not in indexed]
+        # Confirm the file is really gone (it may have been saved or moved while walking)
+        stale = [name for name, rel_path in indexed.items()
+                 if name not in on_disk and not os.path.exists(os.path.join(image_dir, rel_path))]
+        moved = [(on_disk[name][2], name) for name, rel_path in indexed.items()
+                 if name in on_disk and on_disk[name][2] != rel_path]
+
+        rows = []
+        for name in missing:
+            (camera_id, timestamp), file_size, rel_path = on_disk[name]
+            response_text = None
+            response_path = os.path.join(image_dir, response_rel_path(rel_path))
+            try:
+                with open(response_path, 'r', encoding='utf-8') as f:
+                    response_text = f.read().strip()
+            except OSError:
+                pass
+            rows.append((camera_id, timestamp.timestamp(), name, response_text, file_size, rel_path))
+
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO detections (camera_id, timestamp, filename, response_text, file_size, rel_path) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.executemany('DELETE FROM detections WHERE filename = ?', [(name,) for name in stale])
+            conn.executemany('UPDATE detections SET rel_path = ? WHERE filename = ?', moved)
+        return len(rows), len(stale)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the detection image index')
+    parser.add_argument('command', choices=['reindex', 'compact'])
+    parser.add_argument('--db', default=os.environ.get('DETECTION_DB_FILE', DEFAULT_DB_FILE))
+    parser.add_argument('--dir', default=DEFAULT_IMAGE_DIR)
+    args = parser.parse_args()
+
+    store = DetectionStore(args.db)
+    added, removed = store.reindex(args.dir)
+    print(f"✅ Reindexed {args.dir}: {added} added, {removed} removed, {store.count()} detections indexed")
+    if args.command == 'compact':
+        total = 0
+        while True:
+            moved, dropped = store.compact(args.dir, limit=500)
+            if not moved and not dropped:
+                break
+            total += len(moved)
+        print(f"✅ Moved {total} images into camera/day directories")
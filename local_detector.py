@@ -0,0 +1,120 @@
+"""
+On-box person detector running on the CPU through OpenCV's DNN module.
+
+Any SSD-style detection network OpenCV can read works (MobileNet-SSD Caffe,
+TensorFlow or ONNX SSD exports): the network is loaded once, on first use, and
+reused for every frame. Outputs are the usual [1, 1, N, 7] detection rows of
+(batch, class, confidence, x1, y1, x2, y2) with coordinates normalised to 0..1.
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# MobileNet-SSD (Caffe, PASCAL VOC classes): class 15 is "person"
+DEFAULT_PERSON_CLASS_ID = 15
+DEFAULT_INPUT_SIZE = 300
+DEFAULT_SCALE = 1 / 127.5
+DEFAULT_MEAN = 127.5
+
+
+class LocalPersonDetector:
+    """Loads the network lazily and returns person boxes for a BGR image."""
+
+    def __init__(self, model_path, config_path=None, person_class_id=DEFAULT_PERSON_CLASS_ID,
+                 input_size=DEFAULT_INPUT_SIZE, scale=DEFAULT_SCALE, mean=DEFAULT_MEAN, swap_rb=False):
+        self.model_path = model_path
+        self.config_path = config_path
+        self.person_class_id = person_class_id
+        self.input_size = input_size
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+        self.net = None
+        self.load_error = None
+        # cv2.dnn.Net is not thread-safe; one forward pass at a time
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.total_time = 0.0
+
+    def available(self):
+        """True if the model files exist and (if already tried) loaded successfully."""
+        if self.load_error is not None:
+            return False
+        if not self.model_path or not os.path.exists(self.model_path):
+            return False
+        return not self.config_path or os.path.exists(self.config_path)
+
+    def load(self):
+        """Read the network once. Returns True when it is ready."""
+        with self.lock:
+            if self.net is not None:
+                return True
+            if self.load_error is not None:
+                return False
+            try:
+                net = cv2.dnn.readNet(self.model_path, self.config_path or '')
+                net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+                net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+                self.net = net
+                return True
+            except cv2.error as e:
+                self.load_error = str(e)
+                return False
+
+    def detect(self, image, min_confidence=0.2):
+        """
+        Run the network on a BGR image.
+
+        Returns:
+            list: (confidence, (x1, y1, x2, y2)) person boxes in pixels, highest confidence first.
+        """
+        if not self.load():
+            raise RuntimeError(f"Local detector model could not be loaded: {self.load_error}")
+
+        height, width = image.shape[:2]
+        size = (self.input_size, self.input_size)
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, size), self.scale, size,
+                                     (self.mean, self.mean, self.mean), swapRB=self.swap_rb)
+        start_time = time.time()
+        with self.lock:
+            self.net.setInput(blob)
+            output = self.net.forward()
+            self.frames += 1
+            self.total_time += time.time() - start_time
+
+        detections = []
+        for row in output.reshape(-1, 7):
+            confidence = float(row[2])
+            if int(row[1]) != self.person_class_id or confidence < min_confidence:
+                continue
+            x1, y1, x2, y2 = (np.clip(row[3:7], 0.0, 1.0) * [width, height, width, height]).astype(int)
+            if x2 > x1 and y2 > y1:
+                detections.append((confidence, (int(x1), int(y1), int(x2), int(y2))))
+        detections.sort(key=lambda detection: detection[0], reverse=True)
+        return detections
+
+    def stats(self):
+        with self.lock:
+            return {
+                'model': os.path.basename(self.model_path) if self.model_path else None,
+                'loaded': self.net is not None,
+                'load_error': self.load_error,
+                'frames': self.frames,
+                'avg_ms': round(self.total_time / self.frames * 1000, 1) if self.frames else None,
+                'fps': round(self.frames / self.total_time, 1) if self.total_time else None
+            }
+
+
+def draw_detections(image, detections, threshold, color=(0, 255, 0)):
+    """Draw boxes at or above the threshold onto the image (in place)."""
+    for confidence, (x1, y1, x2, y2) in detections:
+        if confidence < threshold:
+            continue
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(image, f"person {confidence:.2f}", (x1, max(15, y1 - 5)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+    return image
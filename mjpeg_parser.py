@@ -0,0 +1,163 @@
+"""
+Incremental parser for MJPEG (multipart/x-mixed-replace) camera streams.
+
+Chunks are appended to a single bytearray and scanned once: the parser remembers
+where it stopped searching, honours Content-Length when the part headers carry
+it, and only compacts the buffer once the consumed prefix outweighs the rest.
+"""
+
+CRLF = b'\r\n'
+HEADER_END = b'\r\n\r\n'
+
+# Parser states
+STATE_BOUNDARY = 0
+STATE_HEADERS = 1
+STATE_BODY = 2
+
+# Give up on a frame and resynchronise if this much data arrives without completing it
+DEFAULT_MAX_FRAME_SIZE = 8 * 1024 * 1024
+
+
+def parse_boundary(content_type):
+    """Extract the multipart boundary from a Content-Type header, or None if absent."""
+    if not content_type or 'multipart/x-mixed-replace' not in content_type.lower():
+        return None
+    for part in content_type.split(';'):
+        part = part.strip()
+        if part.lower().startswith('boundary='):
+            boundary = part.split('=', 1)[1].strip().strip('"')
+            return boundary or None
+    return None
+
+
+class MJPEGParser:
+    """Feed raw stream chunks with feed(); complete JPEG frames are returned as bytes."""
+
+    def __init__(self, boundary, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        if isinstance(boundary, str):
+            boundary = boundary.encode()
+        self.marker = b'--' + boundary
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._pos = 0            # Start of data not yet consumed
+        self._scan = 0           # Offset the next search resumes from
+        self._state = STATE_BOUNDARY
+        self._header_start = 0
+        self._body_start = 0
+        self._content_length = None
+        self.frames_parsed = 0
+        self.resyncs = 0
+
+    def feed(self, chunk):
+        """Append a chunk and return the list of frames it completed."""
+        if chunk:
+            self._buffer += chunk
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        self._check_frame_size()
+        self._compact()
+        return frames
+
+    def iter_frames(self, chunks):
+        """Yield frames from an iterable of chunks (e.g. response.iter_content())."""
+        for chunk in chunks:
+            for frame in self.feed(chunk):
+                yield frame
+
+    def _next_frame(self):
+        buf = self._buffer
+
+        if self._state == STATE_BOUNDARY:
+            idx = buf.find(self.marker, self._scan)
+            if idx == -1:
+                # Keep enough bytes to match a marker split across chunks
+                self._scan = max(self._pos, len(buf) - len(self.marker) + 1)
+                self._pos = self._scan
+                return None
+            line_end = buf.find(CRLF, idx + len(self.marker))
+            if line_end == -1:
+                self._pos = self._scan = idx
+                return None
+            self._pos = idx
+            self._header_start = self._scan = line_end + 2
+            self._state = STATE_HEADERS
+
+        if self._state == STATE_HEADERS:
+            if buf[self._header_start:self._header_start + 2] == CRLF:
+                # Part without headers
+                headers_end = self._header_start
+                self._body_start = self._header_start + 2
+            else:
+                headers_end = buf.find(HEADER_END, max(self._scan, self._header_start))
+                if headers_end == -1:
+                    if len(buf) - self._header_start >= 2:
+                        self._scan = max(self._header_start, len(buf) - len(HEADER_END) + 1)
+                    return None
+                self._body_start = headers_end + 4
+            self._content_length = self._parse_content_length(buf[self._header_start:headers_end])
+            self._scan = self._body_start
+            self._state = STATE_BODY
+
+        if self._state == STATE_BODY:
+            if self._content_length is not None:
+                frame_end = self._body_start + self._content_length
+                if len(buf) < frame_end:
+                    return None
+                frame = bytes(memoryview(buf)[self._body_start:frame_end])
+                self._pos = self._scan = frame_end
+            else:
+                idx = buf.find(self.marker, self._scan)
+                if idx == -1:
+                    self._scan = max(self._body_start, len(buf) - len(self.marker) + 1)
+                    return None
+                frame_end = idx
+                if frame_end - 2 >= self._body_start and buf[frame_end - 2:frame_end] == CRLF:
+                    frame_end -= 2
+                frame = bytes(memoryview(buf)[self._body_start:frame_end])
+                self._pos = self._scan = idx
+            self._state = STATE_BOUNDARY
+            self.frames_parsed += 1
+            return frame
+
+        return None
+
+    @staticmethod
+    def _parse_content_length(header_block):
+        for line in bytes(header_block).split(CRLF):
+            name, sep, value = line.partition(b':')
+            if sep and name.strip().lower() == b'content-length':
+                try:
+                    length = int(value.strip())
+                except ValueError:
+                    return None
+                return length if length >= 0 else None
+        return None
+
+    def _check_frame_size(self):
+        """Drop a runaway frame (corrupt stream / lost boundary) and wait for the next marker."""
+        if len(self._buffer) - self._pos <= self.max_frame_size:
+            return
+        self.resyncs += 1
+        self._state = STATE_BOUNDARY
+        self._content_length = None
+        self._pos = self._scan = max(self._pos, len(self._buffer) - len(self.marker) + 1)
+
+    def _compact(self):
+        """Discard consumed bytes once they make up at least half of the buffer."""
+        pos = self._pos
+        if pos == 0 or pos < len(self._buffer) // 2:
+            return
+        del self._buffer[:pos]
+        self._pos = 0
+        self._scan -= pos
+        self._header_start -= pos
+        self._body_start -= pos
+
+    @property
+    def buffered(self):
+        """Number of bytes held that do not belong to a completed frame yet."""
+        return len(self._buffer) - self._pos
@@ -1,4 +1,4 @@
-from flask import Flask, request, render_template, redirect, url_for, session, flash, Response, send_file
+from flask import Flask, request, render_template, redirect, url_for, session, flash, Response, send_file, stream_with_context
 import os
 import requests
 import time
@@ -15,6 +15,13 @@ import fcntl
 import sys
 import re
 import json
+import collections
+import urllib.parse
+import queue
+import shutil
+import subprocess
+import struct
+import stat
 
 # Optional psutil import for process monitoring
 try:
@@ -25,17 +32,26 @@ except ImportError:
     print("Warning: psutil not available. Process monitoring features will be limited.")
 
 from werkzeug.security import generate_password_hash, check_password_hash
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import cv2
 import numpy as np
 from google import genai
 from google.genai import types
+from mjpeg_parser import MJPEGParser, parse_boundary
+from local_detector import LocalPersonDetector, draw_detections
+from detection_store import DetectionStore, decode_cursor, encode_cursor, image_rel_path, response_rel_path, shard_path
+from detection_cache import DetectionResultCache, cache_allowed, DEFAULT_MAX_DISTANCE, DEFAULT_TTL, DEFAULT_SIZE
 
 app = Flask(__name__)
 # Use a strong random secret key
 app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 # Set session to expire after the longer duration to let our custom logic handle timeouts
 app.permanent_session_lifetime = datetime.timedelta(days=30)  # Use the longer duration
+# Let a fronting web server (Apache mod_xsendfile, lighttpd) send saved images itself
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
 
 # Configure logging for person detection
 logging.basicConfig(level=logging.INFO)
@@ -91,21 +107,175 @@ MAX_FAILED_ATTEMPTS = 5
 # Lockout duration in seconds (10 minutes)
 LOCKOUT_DURATION = 600
 
-# Directory for saving person detection images
+# Directory for saving person detection images (one subdirectory per camera and day: <camera_id>/<YYYYMMDD>/)
 PERSON_IMAGE_DIR = 'detected_persons'
+# SQLite index of the saved images (see detection_store.py)
+DETECTION_DB_FILE = os.environ.get('DETECTION_DB_FILE', 'detections.db')
+GALLERY_PAGE_SIZE = 50  # Detections per gallery page
+# Downscaled copies of the saved images for the gallery grid, stored under <dir>/<size name>/<image path>
+THUMBNAIL_DIR = os.path.join(PERSON_IMAGE_DIR, 'thumbnails')
+THUMBNAIL_SIZES = {'small': 320, 'medium': 640}  # Name -> width in pixels
+THUMBNAIL_JPEG_QUALITY = 75
+DETECTION_IMAGE_MAX_AGE = 365 * 24 * 3600  # Saved images never change (unique names), so browsers may cache them
+API_DETECTIONS_MAX_LIMIT = 10000  # Most detections one /api/detections request returns
+
+# Retention of saved detection images (0 disables a limit; the oldest images go first)
+RETENTION_MAX_AGE_DAYS = float(os.environ.get('RETENTION_MAX_AGE_DAYS', '0'))
+RETENTION_MAX_MB_PER_CAMERA = float(os.environ.get('RETENTION_MAX_MB_PER_CAMERA', '0'))
+RETENTION_MAX_IMAGES_PER_CAMERA = int(os.environ.get('RETENTION_MAX_IMAGES_PER_CAMERA', '0'))
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', '600'))  # Seconds between retention passes
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '200'))  # Images deleted or moved per batch
+RETENTION_BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', '0.2'))  # Pause between batches so disk I/O doesn't starve detection
 
 # AI Model Configuration
-AI_MODEL_TYPE = os.environ.get('AI_MODEL_TYPE', 'gemini')  # 'gemini' or 'local_gemma3'
+AI_MODEL_TYPE = os.environ.get('AI_MODEL_TYPE', 'gemini')  # 'gemini', 'local_gemma3' or 'local_dnn'
 LOCAL_GEMMA3_URL = os.environ.get('LOCAL_GEMMA3_URL', 'https://geospotx.com')  # Your local Gemma3 server URL
+# True once the Gemma3 server was chosen explicitly (env var, or selected/edited on the AI config page);
+# only then is it used as a failover target for another model
+LOCAL_GEMMA3_CONFIGURED = 'LOCAL_GEMMA3_URL' in os.environ
 LOCAL_GEMMA3_API_KEY = os.environ.get('LOCAL_GEMMA3_API_KEY', '')  # API key if required
+LOCAL_GEMMA3_CONNECT_TIMEOUT = float(os.environ.get('LOCAL_GEMMA3_CONNECT_TIMEOUT', '5'))  # Fail fast when the server is down
+GEMINI_MODEL_NAME = os.environ.get('GEMINI_MODEL_NAME', 'gemini-2.0-flash')  # Gemini model used for detection
+
+# On-box CPU person detector (OpenCV DNN, SSD-style model such as MobileNet-SSD)
+LOCAL_DNN_MODEL = os.environ.get('LOCAL_DNN_MODEL', 'models/MobileNetSSD_deploy.caffemodel')
+LOCAL_DNN_CONFIG = os.environ.get('LOCAL_DNN_CONFIG', 'models/MobileNetSSD_deploy.prototxt')  # Empty for single-file models (ONNX)
+LOCAL_DNN_PERSON_CLASS = int(os.environ.get('LOCAL_DNN_PERSON_CLASS', '15'))  # 15 for VOC MobileNet-SSD, 1 for COCO SSD exports
+LOCAL_DNN_CONFIDENCE = float(os.environ.get('LOCAL_DNN_CONFIDENCE', '0.5'))  # Score that counts as a person
+# How the local detector is used in front of Gemini/Gemma3:
+#   'off'       - not used (unless it is the selected model)
+#   'prefilter' - below ESCALATE_MIN the frame is "no person" without asking the LLM, at or above
+#                 ESCALATE_MAX it is a person; only scores in between are escalated
+#   'cascade'   - the detector decides presence; only positive frames go to the LLM, cropped to the
+#                 detected persons, for the [age=#: activity] description
+LOCAL_DNN_STAGES = ('off', 'prefilter', 'cascade')
+
+def parse_local_dnn_stage(stage, legacy_prefilter=False):
+    """
+    Validate a LOCAL_DNN_STAGE value, falling back to 'off'. Settings from before the stages
+    existed only had an on/off prefilter flag (LOCAL_DNN_PREFILTER / local_dnn_prefilter).
+    """
+    if stage is None:
+        return 'prefilter' if legacy_prefilter else 'off'
+    stage = str(stage).lower()
+    if stage not in LOCAL_DNN_STAGES:
+        print(f"Unknown local detector stage '{stage}', using 'off' (expected one of {', '.join(LOCAL_DNN_STAGES)})")
+        return 'off'
+    return stage
+
+LOCAL_DNN_STAGE = parse_local_dnn_stage(os.environ.get('LOCAL_DNN_STAGE'),
+                                        os.environ.get('LOCAL_DNN_PREFILTER', 'false').lower() == 'true')
+LOCAL_DNN_ESCALATE_MIN = float(os.environ.get('LOCAL_DNN_ESCALATE_MIN', '0.2'))
+LOCAL_DNN_ESCALATE_MAX = float(os.environ.get('LOCAL_DNN_ESCALATE_MAX', '0.8'))
+CASCADE_CROP_PADDING = float(os.environ.get('CASCADE_CROP_PADDING', '0.25'))  # Context kept around the persons, as a fraction of the box size
 
 # Configuration file for persistent settings
 CONFIG_FILE = 'ai_config.json'
 CAMERA_SETTINGS_FILE = 'camera_settings.json'
 
+# --- Pooled HTTP sessions ---
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '10'))  # Keep-alive connections kept per host
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', '2'))  # Retries for failed connects / idempotent requests
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', '0.3'))  # Backoff factor between retries (seconds)
+
+class HTTPSessionPool:
+    """
+    One keep-alive requests.Session per host (scheme://host:port), so camera and AI
+    calls reuse TCP/TLS connections instead of opening a new one per request.
+    Also keeps per-host timing metrics.
+    """
+
+    def __init__(self, pool_maxsize=HTTP_POOL_MAXSIZE, retries=HTTP_RETRIES, backoff=HTTP_RETRY_BACKOFF):
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff = backoff
+        self.sessions = {}
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def host_key(url):
+        parsed = urllib.parse.urlsplit(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _make_session(self, retry):
+        if retry:
+            # POST is not retried: an AI request may already have been processed. Read timeouts are
+            # not retried either, so a request never takes much longer than its own timeout.
+            max_retries = Retry(total=self.retries, read=False, backoff_factor=self.backoff,
+                                status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']),
+                                raise_on_status=False)
+        else:
+            max_retries = Retry(total=0, read=False, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=max_retries)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session_for(self, url, retry=True):
+        key = (self.host_key(url), retry)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self._make_session(retry)
+                self.sessions[key] = session
+            return session
+
+    def _record(self, host, duration, error=False):
+        with self.lock:
+            metrics = self.metrics.setdefault(host, {
+                'requests': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0, 'last_time': None
+            })
+            metrics['requests'] += 1
+            if error:
+                metrics['errors'] += 1
+            metrics['total_time'] += duration
+            metrics['max_time'] = max(metrics['max_time'], duration)
+            metrics['last_time'] = duration
+
+    def request(self, method, url, retry=True, **kwargs):
+        """Like requests.request(); pass retry=False for probes that must fail fast."""
+        host = self.host_key(url)
+        start_time = time.time()
+        try:
+            resp = self.session_for(url, retry).request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self._record(host, time.time() - start_time, error=True)
+            raise
+        # For stream=True this is the time to the response headers
+        self._record(host, time.time() - start_time, error=resp.status_code >= 500)
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            hosts = {}
+            for host, metrics in self.metrics.items():
+                hosts[host] = {
+                    'requests': metrics['requests'],
+                    'errors': metrics['errors'],
+                    'avg_ms': round(metrics['total_time'] / metrics['requests'] * 1000, 1) if metrics['requests'] else None,
+                    'max_ms': round(metrics['max_time'] * 1000, 1),
+                    'last_ms': round(metrics['last_time'] * 1000, 1) if metrics['last_time'] is not None else None
+                }
+            return {
+                'pool_maxsize': self.pool_maxsize,
+                'retries': self.retries,
+                'sessions': len(self.sessions),
+                'hosts': hosts
+            }
+
+http_pool = HTTPSessionPool()
+
 def load_ai_config():
     """Load AI configuration from file"""
-    global AI_MODEL_TYPE, LOCAL_GEMMA3_URL, LOCAL_GEMMA3_API_KEY
+    global AI_MODEL_TYPE, LOCAL_GEMMA3_URL, LOCAL_GEMMA3_API_KEY, GEMINI_MODEL_NAME, LOCAL_DNN_STAGE, LOCAL_GEMMA3_CONFIGURED
     
     try:
         if os.path.exists(CONFIG_FILE):
@@ -114,7 +284,12 @@ def load_ai_config():
                 AI_MODEL_TYPE = config.get('ai_model_type', AI_MODEL_TYPE)
                 LOCAL_GEMMA3_URL = config.get('local_gemma3_url', LOCAL_GEMMA3_URL)
                 LOCAL_GEMMA3_API_KEY = config.get('local_gemma3_api_key', LOCAL_GEMMA3_API_KEY)
-                print(f"Loaded AI configuration: Model={AI_MODEL_TYPE}, URL={LOCAL_GEMMA3_URL}")
+                GEMINI_MODEL_NAME = config.get('gemini_model_name', GEMINI_MODEL_NAME)
+                if 'local_dnn_stage' in config or 'local_dnn_prefilter' in config:
+                    LOCAL_DNN_STAGE = parse_local_dnn_stage(config.get('local_dnn_stage'), config.get('local_dnn_prefilter') is True)
+                LOCAL_GEMMA3_CONFIGURED = (LOCAL_GEMMA3_CONFIGURED or config.get('local_gemma3_configured', False)
+                                           or AI_MODEL_TYPE == 'local_gemma3')
+                print(f"Loaded AI configuration: Model={AI_MODEL_TYPE}, URL={LOCAL_GEMMA3_URL}, Gemini model={GEMINI_MODEL_NAME}")
         else:
             print(f"AI config file not found, using defaults: Model={AI_MODEL_TYPE}")
     except Exception as e:
@@ -126,7 +301,10 @@ def save_ai_config():
         config = {
             'ai_model_type': AI_MODEL_TYPE,
             'local_gemma3_url': LOCAL_GEMMA3_URL,
-            'local_gemma3_api_key': LOCAL_GEMMA3_API_KEY
+            'local_gemma3_api_key': LOCAL_GEMMA3_API_KEY,
+            'gemini_model_name': GEMINI_MODEL_NAME,
+            'local_dnn_stage': LOCAL_DNN_STAGE,
+            'local_gemma3_configured': LOCAL_GEMMA3_CONFIGURED
         }
         with open(CONFIG_FILE, 'w') as f:
             json.dump(config, f, indent=2)
@@ -163,7 +341,7 @@ def save_camera_settings():
     except Exception as e:
         print(f"Error saving camera settings: {e}")
 
-def reapply_camera_controls(camera_id, capture_port):
+def reapply_camera_controls(camera_id, control_url):
     """Reapply saved camera control settings when camera reconnects"""
     global camera_control_settings
     
@@ -175,9 +353,8 @@ def reapply_camera_controls(camera_id, capture_port):
     
     for var, val in settings.items():
         try:
-            control_url = f"http://localhost:{capture_port}/control"
             params = {'var': var, 'val': val}
-            resp = requests.get(control_url, params=params, timeout=2)
+            resp = http_pool.get(control_url, params=params, timeout=2)
             
             if resp.status_code == 200:
                 print(f"Reapplied {var}={val} for {camera_id}")
@@ -188,53 +365,35 @@ def reapply_camera_controls(camera_id, capture_port):
 
 def apply_initial_camera_settings():
     """Apply saved camera settings to all currently connected cameras on startup"""
-    global cameras
-    cameras = scan_for_cameras()
-    
     print("Applying initial camera settings...")
-    for camera_id, camera_config in cameras.items():
-        capture_port = camera_config.get('capture_port', 0)
-        
-        if capture_port > 0 and is_port_open('localhost', capture_port):
-            print(f"Camera {camera_id} is connected, applying saved settings...")
-            reapply_camera_controls(camera_id, capture_port)
-            last_camera_connection_state[camera_id] = True
+    for camera_id, camera_config in camera_registry.cameras().items():
+        print(f"Camera {camera_id} is connected, applying saved settings...")
+        reapply_camera_controls(camera_id, camera_config['control_url'])
     
     print("Initial camera settings applied")
 
 def monitor_camera_reconnections():
-    """Background thread to monitor camera reconnections and reapply settings"""
-    global cameras, camera_control_settings, last_camera_connection_state
-    
+    """Background thread that owns the camera registry: rescans cameras and reapplies settings on reconnection"""
     time.sleep(5)  # Wait for initial startup
     apply_initial_camera_settings()  # Apply settings on first run
     
     while True:
         try:
-            cameras = scan_for_cameras()
+            reconnected = camera_registry.refresh()
             
-            for camera_id, camera_config in cameras.items():
-                capture_port = camera_config.get('capture_port', 0)
-                
-                if capture_port > 0:
-                    was_connected = last_camera_connection_state.get(camera_id, False)
-                    is_connected = is_port_open('localhost', capture_port)
-                    
-                    # If camera transitioned from offline to online, reapply settings
-                    if is_connected and not was_connected:
-                        print(f"Background monitor detected camera {camera_id} reconnection")
-                        reapply_camera_controls(camera_id, capture_port)
-                    
-                    last_camera_connection_state[camera_id] = is_connected
+            # If camera transitioned from offline to online, reapply settings
+            for camera_id in reconnected:
+                print(f"Background monitor detected camera {camera_id} reconnection")
+                reapply_camera_controls(camera_id, camera_registry.get(camera_id)['control_url'])
             
-            time.sleep(10)  # Check every 10 seconds
+            # Check every 10 seconds, or sooner if a handler asked for a rescan
+            camera_registry.wait_for_refresh_request(10)
             
         except Exception as e:
             print(f"Error in camera reconnection monitor: {e}")
             time.sleep(30)  # Wait longer on error
 
 # Global variables - must be declared before loading settings
-cameras = {}
 active_streams = {}
 active_connections = {}
 
@@ -243,9 +402,6 @@ camera_settings = {}
 camera_control_settings = {}
 ALLOWED_ROTATIONS = {'none', '180', '90_left', '90_right'}
 
-# Track camera connection state to detect reconnections
-last_camera_connection_state = {}
-
 # State for person detection
 # Stores {'camera_id': {'person_present': bool, 'last_detection': timestamp, 'first_detection': timestamp, 'detection_count': int}}
 person_detection_state = {}
@@ -368,67 +524,213 @@ base_cameras = {
 }
 
 # Dynamic camera detection
+CAMERA_PROBE_TIMEOUT = 1    # Seconds per TCP connect / HTTP probe
+# A probe is a TCP connect plus an HTTP GET with its own connect and read timeouts
+CAMERA_PROBE_MAX_DURATION = 3 * CAMERA_PROBE_TIMEOUT
+CAMERA_SCAN_MIN_DEADLINE = 3  # Seconds a scan may take at least; see camera_scan_deadline()
+# Probes run concurrently; the default is enough to run every probe of the default port-pair
+# range (10001-10099: 50 cameras x stream + capture) in one round, so a scan takes about one
+# probe duration. Probes mostly wait on sockets, so idle threads are cheap.
+CAMERA_SCAN_WORKERS = int(os.environ.get('CAMERA_SCAN_WORKERS', '100'))
+
+camera_probe_executor = ThreadPoolExecutor(max_workers=CAMERA_SCAN_WORKERS, thread_name_prefix='camera-probe')
+
+# --- Camera inventory ---
+# camera_inventory.json declares cameras on any host/port/path and which discovery plugins run.
+# It is re-read whenever it changes. Without the file, the localhost port-pair scan is used.
+# See camera_inventory.example.json for the format.
+CAMERA_INVENTORY_FILE = os.environ.get('CAMERA_INVENTORY_FILE', 'camera_inventory.json')
+DEFAULT_CAMERA_INVENTORY = {
+    'cameras': {},
+    'discovery': {
+        'port_pairs': {'host': 'localhost', 'first_port': 10001, 'last_port': 10099}
+    }
+}
+
+camera_inventory = DEFAULT_CAMERA_INVENTORY
+camera_inventory_mtime = None
+
+# name -> function(options) returning {camera_id: camera entry}; entries use the same keys as the inventory
+camera_discovery_plugins = {}
+
+def register_discovery_plugin(name):
+    """Decorator registering a camera discovery plugin under the given inventory name."""
+    def decorator(func):
+        camera_discovery_plugins[name] = func
+        return func
+    return decorator
+
+@register_discovery_plugin('port_pairs')
+def discover_port_pairs(options):
+    """Candidate cameras on stream ports first_port, first_port+2, ... with capture on stream_port+1."""
+    host = options.get('host', 'localhost')
+    first_port = int(options.get('first_port', 10001))
+    last_port = int(options.get('last_port', 10099))
+    prefix = options.get('id_prefix', 'camera')
+    candidates = {}
+    for stream_port in range(first_port, last_port + 1, 2):
+        number = (stream_port - first_port) // 2 + 1
+        candidates[f"{prefix}{number}"] = {
+            'name': f"Camera {number}",
+            'host': host,
+            'stream_port': stream_port,
+            'capture_port': stream_port + 1
+        }
+    return candidates
+
+def load_camera_inventory():
+    """(Re)load the inventory file if it changed since the last call. Returns the current inventory."""
+    global camera_inventory, camera_inventory_mtime
+    try:
+        mtime = os.path.getmtime(CAMERA_INVENTORY_FILE)
+    except OSError:
+        if camera_inventory_mtime is not None:
+            print(f"Camera inventory {CAMERA_INVENTORY_FILE} removed, using default port scan")
+        camera_inventory = DEFAULT_CAMERA_INVENTORY
+        camera_inventory_mtime = None
+        return camera_inventory
+
+    if mtime == camera_inventory_mtime:
+        return camera_inventory
+
+    try:
+        with open(CAMERA_INVENTORY_FILE, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("the file must contain a JSON object")
+        cameras = data.get('cameras') or {}
+        discovery = data.get('discovery') or {}
+        if not isinstance(cameras, dict) or not isinstance(discovery, dict):
+            raise ValueError("'cameras' and 'discovery' must be objects keyed by camera id / source name")
+        camera_inventory = {
+            'cameras': cameras,
+            'discovery': discovery
+        }
+        camera_inventory_mtime = mtime
+        print(f"Loaded camera inventory: {len(camera_inventory['cameras'])} cameras, "
+              f"discovery plugins: {list(camera_inventory['discovery'].keys())}")
+    except Exception as e:
+        # Keep the previous inventory so a half-written file doesn't drop every camera
+        print(f"Error loading camera inventory {CAMERA_INVENTORY_FILE}: {e}, keeping previous inventory")
+    return camera_inventory
+
+def build_camera_config(camera_id, entry):
+    """
+    Normalise an inventory/plugin entry into the camera config used by the rest of the server.
+
+    Raises ValueError/TypeError for a malformed entry.
+    """
+    if not isinstance(entry, dict):
+        raise TypeError(f"expected an object, got {type(entry).__name__}")
+    host = entry.get('host', 'localhost')
+    stream_port = int(entry.get('stream_port', 0))
+    capture_port = int(entry.get('capture_port', 0))
+    capture_url = entry.get('capture_url') or f"http://{host}:{capture_port}{entry.get('capture_path', '/capture')}"
+    # /control and /status live next to /capture on the camera firmware
+    parsed = urllib.parse.urlparse(capture_url)
+    capture_base = f"{parsed.scheme}://{parsed.netloc}"
+    return {
+        'name': entry.get('name', camera_id),
+        'host': host,
+        'stream_port': stream_port,
+        'capture_port': capture_port,
+        'stream_url': entry.get('stream_url') or f"http://{host}:{stream_port}{entry.get('stream_path', '/stream')}",
+        'capture_url': capture_url,
+        'control_url': entry.get('control_url') or f"{capture_base}/control",
+        'status_url': entry.get('status_url') or f"{capture_base}/status"
+    }
+
+def probe_camera_url(url):
+    """Return True if the URL's port is open and a GET answers with a 2xx status."""
+    parsed = urllib.parse.urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    if not is_port_open(parsed.hostname, port, timeout=CAMERA_PROBE_TIMEOUT):
+        return False
+    try:
+        resp = http_pool.get(url, timeout=CAMERA_PROBE_TIMEOUT, stream=True, retry=False)
+        responsive = 200 <= resp.status_code < 300
+        if responsive:
+            print(f"Found responsive endpoint {url}")
+        else:
+            print(f"Endpoint {url} returned status {resp.status_code}")
+        resp.close()
+        return responsive
+    except requests.exceptions.RequestException as e:
+        print(f"Could not connect to {url} for potential camera: {e}")
+        return False
+
+def camera_scan_deadline(probe_count):
+    """
+    Seconds a scan of probe_count probes may take: enough for every probe to run to its own
+    timeout on the CAMERA_SCAN_WORKERS pool, so only probes that really time out count as
+    unresponsive.
+    """
+    rounds = -(-probe_count // CAMERA_SCAN_WORKERS)  # ceil
+    return max(CAMERA_SCAN_MIN_DEADLINE, rounds * CAMERA_PROBE_MAX_DURATION + 1)
+
 def scan_for_cameras():
-    """Scan for available cameras on ports starting from 10001 in steps of 2."""
-    available_cameras = {}
-    # Scan base ports 10001, 10003, ... up to 10099
-    for stream_port in range(10001, 10100, 2):
-        capture_port = stream_port + 1
-        host = 'localhost'
-
-        # Check if stream port is open and has /stream
-        stream_url = f"http://{host}:{stream_port}/stream"
-        stream_responsive = False
-        if is_port_open(host, stream_port):
-            try:
-                resp_stream = requests.get(stream_url, timeout=1, stream=True)
-                if resp_stream.status_code >= 200 and resp_stream.status_code < 300:
-                    stream_responsive = True
-                    print(f"Found responsive /stream endpoint on port {stream_port}")
-                else:
-                    print(f"/stream endpoint on port {stream_port} returned status {resp_stream.status_code}")
-                resp_stream.close()
-            except requests.exceptions.RequestException as e:
-                print(f"Could not connect to /stream for potential camera on port {stream_port}: {e}")
-        
-        # Check if capture port is open and has /capture
-        capture_url = f"http://{host}:{capture_port}/capture"
-        capture_responsive = False
-        if is_port_open(host, capture_port):
-            try:
-                # Use HEAD request for efficiency if only checking existence
-                resp_capture = requests.get(capture_url, timeout=1, stream=True)
-                if resp_capture.status_code >= 200 and resp_capture.status_code < 300:
-                    capture_responsive = True
-                    print(f"Found responsive /capture endpoint on port {capture_port}")
-                else:
-                     print(f"/capture endpoint on port {capture_port} returned status {resp_capture.status_code}")
-                resp_capture.close()
-            except requests.exceptions.RequestException as e:
-                print(f"Could not connect to /capture for potential camera on port {capture_port}: {e}")
+    """Probe every inventory and discovered camera concurrently and return the ones whose stream and capture both answer."""
+    inventory = load_camera_inventory()
+
+    candidates = {}
+    def add_candidate(camera_id, entry, source):
+        try:
+            candidates[camera_id] = build_camera_config(camera_id, entry)
+        except Exception as e:
+            # One bad entry must not stop discovery of the other cameras
+            print(f"Skipping camera {camera_id} from {source}: invalid entry ({e})")
+
+    for source_name, options in inventory['discovery'].items():
+        options = options or {}
+        if not isinstance(options, dict):
+            print(f"Skipping camera discovery source {source_name}: options must be an object")
+            continue
+        if not options.get('enabled', True):
+            continue
+        # A source can name its plugin explicitly, so one plugin can scan several hosts
+        plugin_name = options.get('plugin', source_name)
+        plugin = camera_discovery_plugins.get(plugin_name)
+        if plugin is None:
+            print(f"Unknown camera discovery plugin: {plugin_name}")
+            continue
+        try:
+            for camera_id, entry in plugin(options).items():
+                add_candidate(camera_id, entry, f"discovery source {source_name}")
+        except Exception as e:
+            print(f"Camera discovery source {source_name} ({plugin_name}) failed: {e}")
+    # Declared cameras take precedence over discovered ones with the same id
+    for camera_id, entry in inventory['cameras'].items():
+        add_candidate(camera_id, entry, CAMERA_INVENTORY_FILE)
+
+    futures = {}
+    for camera_id, camera_config in candidates.items():
+        futures[(camera_id, 'stream')] = camera_probe_executor.submit(probe_camera_url, camera_config['stream_url'])
+        futures[(camera_id, 'capture')] = camera_probe_executor.submit(probe_camera_url, camera_config['capture_url'])
+
+    deadline = camera_scan_deadline(len(futures))
+    done, not_done = wait(futures.values(), timeout=deadline)
+    if not_done:
+        # Probes still queued would only delay the next scan
+        cancelled = sum(1 for future in not_done if future.cancel())
+        print(f"Camera scan deadline reached, {len(not_done)} probes did not finish in {deadline}s ({cancelled} cancelled)")
+
+    def responsive(key):
+        future = futures[key]
+        return future in done and future.exception() is None and future.result()
 
+    available_cameras = {}
+    for camera_id, camera_config in candidates.items():
         # If both endpoints are responsive, add the camera
-        if stream_responsive and capture_responsive:
-            camera_id = f"camera{(stream_port - 10001) // 2 + 1}" # camera1, camera2, etc.
-            available_cameras[camera_id] = {
-                "name": f"Camera {(stream_port - 10001) // 2 + 1}",
-                "stream_url": stream_url,
-                "capture_url": capture_url,
-                "stream_port": stream_port,
-                "capture_port": capture_port
-            }
-            print(f"Successfully added camera {camera_id} (Stream: {stream_port}, Capture: {capture_port})")
+        if responsive((camera_id, 'stream')) and responsive((camera_id, 'capture')):
+            available_cameras[camera_id] = camera_config
+            print(f"Successfully added camera {camera_id} (Stream: {camera_config['stream_url']}, Capture: {camera_config['capture_url']})")
 
             # Merge any stored runtime settings (e.g., rotation) for this camera
-            print(f"DEBUG: Checking if {camera_id} in camera_settings: {camera_id in camera_settings}")
             if camera_id in camera_settings:
-                print(f"DEBUG: Merging settings for {camera_id}: {camera_settings[camera_id]}")
                 try:
-                    available_cameras[camera_id].update(camera_settings[camera_id])
-                    print(f"DEBUG: After merge, {camera_id} config: {available_cameras[camera_id]}")
+                    camera_config.update(camera_settings[camera_id])
                 except Exception as e:
                     print(f"DEBUG: Error merging settings: {e}")
-                    pass
 
     return available_cameras
 
@@ -448,8 +750,91 @@ def is_port_open(host, port, timeout=1):
     finally:
         s.close()
 
+class CameraRegistry:
+    """
+    Thread-safe, versioned view of the discovered cameras.
+
+    Only monitor_camera_reconnections() scans; request handlers read the current snapshot.
+    Snapshots are replaced, never mutated, so readers need no lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._cameras = {}           # camera_id -> config dict of currently connected cameras
+        self._connection_state = {}  # camera_id -> bool for every camera seen so far
+        self.version = 0
+        self.last_refresh = None
+        self.last_refresh_started = None
+        self._refresh_requested = threading.Event()
+        self._refreshed = threading.Condition(self.lock)
+
+    def cameras(self):
+        """Current snapshot of connected cameras. Treat as read-only."""
+        return self._cameras
+
+    def get(self, camera_id):
+        """Config for a connected camera, or None."""
+        return self._cameras.get(camera_id)
+
+    def is_connected(self, camera_id):
+        return self._connection_state.get(camera_id, False)
+
+    def is_known(self, camera_id):
+        """True if the camera has been seen since startup, even if it is offline now."""
+        return camera_id in self._connection_state
+
+    def refresh(self):
+        """Rescan cameras and publish a new snapshot. Returns the ids of cameras that (re)connected."""
+        # Clear before scanning: a request arriving during the scan stays set and triggers another one
+        self._refresh_requested.clear()
+        started = time.time()
+        found = scan_for_cameras()
+        with self.lock:
+            reconnected = [camera_id for camera_id in found if not self._connection_state.get(camera_id, False)]
+            for camera_id in self._connection_state:
+                if camera_id not in found:
+                    if self._connection_state[camera_id]:
+                        print(f"Camera {camera_id} disconnected")
+                    self._connection_state[camera_id] = False
+            for camera_id, camera_config in found.items():
+                camera_config['is_connected'] = True
+                self._connection_state[camera_id] = True
+            if found != self._cameras:
+                self.version += 1
+            self._cameras = found
+            self.last_refresh = time.time()
+            self.last_refresh_started = started
+            self._refreshed.notify_all()
+        return reconnected
+
+    def update_settings(self, camera_id, settings):
+        """Merge runtime settings (e.g. rotation) into a camera's entry without waiting for a rescan."""
+        with self.lock:
+            if camera_id not in self._cameras:
+                return
+            cameras = dict(self._cameras)
+            cameras[camera_id] = dict(cameras[camera_id], **settings)
+            self._cameras = cameras
+            self.version += 1
+
+    def request_refresh(self):
+        """Ask the background monitor to rescan now (e.g. a handler saw an unknown camera id)."""
+        self._refresh_requested.set()
+
+    def wait_for_refresh_request(self, timeout):
+        """Wait until a rescan is requested or timeout passes; refresh() clears the request."""
+        self._refresh_requested.wait(timeout)
+
+    def wait_for_refresh(self, since, timeout):
+        """Block until a rescan that started at or after `since` has been published. Returns False on timeout."""
+        with self._refreshed:
+            return self._refreshed.wait_for(
+                lambda: self.last_refresh_started is not None and self.last_refresh_started >= since, timeout)
+
+camera_registry = CameraRegistry()
+
 # Initial camera scan (must be after load_camera_settings and all function definitions)
-cameras = scan_for_cameras()
+camera_registry.refresh()
 
 # Clean up stale connections
 def cleanup_connections():
@@ -489,9 +874,801 @@ camera_monitor_thread = threading.Thread(target=monitor_camera_reconnections, da
 camera_monitor_thread.start()
 
 # FPS calculation variables
-frame_times = {} # Dictionary to store last frame time per camera stream
 FPS_ROLLING_AVG_COUNT = 10 # Number of frames to average FPS over
 
+# --- JPEG rotation ---
+# jpegtran (libjpeg-turbo) rotates in the DCT domain, so rotated frames keep their original
+# quality and skip the decode/encode round trip. It only works losslessly when the image is a
+# whole number of MCUs; other frames fall back to pixel rotation with OpenCV.
+# Each jpegtran call forks and execs a process (a few milliseconds plus process churn), which
+# is fine for snapshots and detection frames but not for every frame of a live stream, so
+# stream hubs rotate with OpenCV (rotate_jpeg(..., lossless=False)).
+JPEGTRAN_PATH = shutil.which('jpegtran')
+JPEGTRAN_ROTATIONS = {'180': '180', '90_right': '90', '90_left': '270'}
+CV2_ROTATIONS = {
+    '180': cv2.ROTATE_180,
+    '90_right': cv2.ROTATE_90_CLOCKWISE,
+    '90_left': cv2.ROTATE_90_COUNTERCLOCKWISE
+}
+# Count of frames rotated per method, for diagnostics
+jpeg_rotation_stats = {'lossless': 0, 'pixel': 0, 'failed': 0}
+jpeg_rotation_stats_lock = threading.Lock()  # rotate_jpeg runs on request, hub and detection threads
+
+def count_rotation(method):
+    with jpeg_rotation_stats_lock:
+        jpeg_rotation_stats[method] += 1
+
+if not JPEGTRAN_PATH:
+    print("Warning: jpegtran not found. JPEG rotation will decode and re-encode frames.")
+
+def get_jpeg_geometry(image_bytes):
+    """Read (width, height, mcu_width, mcu_height) from a JPEG's SOF header, or None if not found."""
+    data = image_bytes
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # Markers without a length field
+            i += 2
+            continue
+        if marker == 0xDA:  # Start of scan - no SOF before the image data
+            return None
+        segment_length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if i + 10 > len(data):
+                return None
+            height, width, components = struct.unpack('>HHB', data[i + 5:i + 10])
+            max_h = max_v = 1
+            for c in range(components):
+                offset = i + 10 + c * 3 + 1
+                if offset >= len(data):
+                    return None
+                sampling = data[offset]
+                max_h = max(max_h, sampling >> 4)
+                max_v = max(max_v, sampling & 0x0F)
+            return width, height, 8 * max_h, 8 * max_v
+        i += 2 + segment_length
+    return None
+
+def is_mcu_aligned(image_bytes):
+    """True if both image dimensions are whole multiples of the MCU size."""
+    geometry = get_jpeg_geometry(image_bytes)
+    if geometry is None:
+        return False
+    width, height, mcu_width, mcu_height = geometry
+    return width % mcu_width == 0 and height % mcu_height == 0
+
+def rotate_jpeg(image_bytes, rotation, lossless=True):
+    """
+    Rotate a JPEG by one of ALLOWED_ROTATIONS.
+
+    With lossless, uses a jpegtran transform when available and the frame is MCU-aligned;
+    otherwise decodes, rotates and re-encodes with OpenCV.
+
+    Returns:
+        bytes: The rotated JPEG (the input unchanged for 'none' or if rotation fails).
+    """
+    if rotation not in JPEGTRAN_ROTATIONS:
+        return image_bytes
+
+    if lossless and JPEGTRAN_PATH and is_mcu_aligned(image_bytes):
+        try:
+            result = subprocess.run(
+                [JPEGTRAN_PATH, '-perfect', '-copy', 'none', '-rotate', JPEGTRAN_ROTATIONS[rotation]],
+                input=bytes(image_bytes), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=5
+            )
+            if result.returncode == 0 and result.stdout:
+                count_rotation('lossless')
+                return result.stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"jpegtran rotation failed, falling back to pixel rotation: {e}")
+
+    try:
+        np_arr = np.frombuffer(image_bytes, np.uint8)
+        image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        if image is not None:
+            image = cv2.rotate(image, CV2_ROTATIONS[rotation])
+            ret, buffer = cv2.imencode('.jpg', image)
+            if ret:
+                count_rotation('pixel')
+                return buffer.tobytes()
+    except Exception as e:
+        print(f"Pixel rotation failed: {e}")
+
+    count_rotation('failed')
+    return image_bytes
+
+def resize_jpeg(image_bytes, width, quality=None):
+    """
+    Downscale a JPEG to the given width, keeping the aspect ratio (re-encoded at quality if given).
+
+    Large reductions use libjpeg's reduced-size decoding so the full frame is never decoded.
+
+    Returns:
+        bytes: The resized JPEG (the input unchanged if it is already narrow enough or decoding fails).
+    """
+    geometry = get_jpeg_geometry(image_bytes)
+    if geometry is not None and geometry[0] <= width:
+        return image_bytes
+
+    decode_flag = cv2.IMREAD_COLOR
+    if geometry is not None:
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if geometry[0] // factor >= width:
+                decode_flag = flag
+                break
+
+    try:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), decode_flag)
+        if image is None:
+            return image_bytes
+        height = max(1, int(round(image.shape[0] * width / image.shape[1])))
+        if image.shape[1] > width:
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality else []
+        ret, buffer = cv2.imencode('.jpg', image, params)
+        if ret:
+            return buffer.tobytes()
+    except Exception as e:
+        print(f"JPEG resize failed: {e}")
+    return image_bytes
+
+# --- Detection regions ---
+# Per-camera polygons stored in camera_settings.json as 'regions': {'include': [...], 'exclude': [...]}.
+# Each polygon is a list of [x, y] points as fractions of the (rotated) frame. Pixels outside the include
+# polygons (when there are any) or inside an exclude polygon are ignored by the motion gate and blacked
+# out in the image sent to the AI.
+REGION_MAX_POLYGONS = 16
+REGION_MAX_POINTS = 64
+
+region_mask_cache = {}  # (camera_id, width, height) -> (regions key, mask)
+region_mask_lock = threading.Lock()
+
+def parse_regions(value):
+    """
+    Validate a regions setting.
+
+    Returns:
+        dict: {'include': [...], 'exclude': [...]}, or None if there are no polygons.
+
+    Raises:
+        ValueError: If the value is malformed.
+    """
+    if not value:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError("regions must be an object with 'include' and/or 'exclude' polygon lists")
+    regions = {}
+    for kind in ('include', 'exclude'):
+        polygons = value.get(kind) or []
+        if not isinstance(polygons, list) or len(polygons) > REGION_MAX_POLYGONS:
+            raise ValueError(f"'{kind}' must be a list of at most {REGION_MAX_POLYGONS} polygons")
+        parsed = []
+        for polygon in polygons:
+            if not isinstance(polygon, list) or not 3 <= len(polygon) <= REGION_MAX_POINTS:
+                raise ValueError(f"each polygon needs 3 to {REGION_MAX_POINTS} points")
+            points = []
+            for point in polygon:
+                try:
+                    x, y = float(point[0]), float(point[1])
+                except (TypeError, ValueError, IndexError, KeyError):
+                    raise ValueError("points must be [x, y] pairs")
+                if not (0 <= x <= 1 and 0 <= y <= 1):
+                    raise ValueError("point coordinates must be fractions between 0 and 1")
+                points.append([round(x, 4), round(y, 4)])
+            parsed.append(points)
+        regions[kind] = parsed
+    if not regions['include'] and not regions['exclude']:
+        return None
+    return regions
+
+def get_camera_regions(camera_id):
+    """The camera's validated regions, or None."""
+    try:
+        return parse_regions(camera_settings.get(camera_id, {}).get('regions'))
+    except ValueError as e:
+        print(f"Ignoring invalid detection regions for {camera_id}: {e}")
+        return None
+
+def get_region_mask(camera_id, width, height):
+    """uint8 mask (255 = analysed, 0 = ignored) for a frame of this size, or None if the camera has no regions."""
+    regions = get_camera_regions(camera_id)
+    if regions is None:
+        return None
+    key = json.dumps(regions, sort_keys=True)
+    with region_mask_lock:
+        cached = region_mask_cache.get((camera_id, width, height))
+        if cached and cached[0] == key:
+            return cached[1]
+
+    mask = build_region_mask(regions, width, height)
+    with region_mask_lock:
+        region_mask_cache[(camera_id, width, height)] = (key, mask)
+    return mask
+
+def build_region_mask(regions, width, height):
+    scale = np.array([width, height], dtype=np.float32)
+    def to_pixels(polygons):
+        return [np.round(np.array(polygon, dtype=np.float32) * scale).astype(np.int32) for polygon in polygons]
+
+    if regions['include']:
+        mask = np.zeros((height, width), np.uint8)
+        cv2.fillPoly(mask, to_pixels(regions['include']), 255)
+    else:
+        mask = np.full((height, width), 255, np.uint8)
+    if regions['exclude']:
+        cv2.fillPoly(mask, to_pixels(regions['exclude']), 0)
+    return mask
+
+# Resolution used to check whether a camera's regions leave anything to analyse
+REGION_CHECK_SIZE = (160, 120)
+
+def regions_cover_frame(regions):
+    """True if the regions leave no pixel of the frame to analyse (everything excluded)."""
+    return not np.count_nonzero(build_region_mask(regions, *REGION_CHECK_SIZE))
+
+def clear_region_masks(camera_id):
+    with region_mask_lock:
+        for key in [key for key in region_mask_cache if key[0] == camera_id]:
+            del region_mask_cache[key]
+
+# --- AI image preprocessing ---
+# Frames are cropped, downscaled and re-encoded once before inference; the cameras send UXGA at high quality
+AI_IMAGE_MAX_EDGE = int(os.environ.get('AI_IMAGE_MAX_EDGE', '1024'))  # Longest side sent to the AI in pixels; 0 keeps full size
+AI_JPEG_QUALITY = int(os.environ.get('AI_JPEG_QUALITY', '80'))  # Re-encode quality; 0 keeps the camera's encoding
+
+ai_preprocess_stats = {'frames': 0, 'bytes_in': 0, 'bytes_out': 0, 'failed': 0, 'cameras': {}}
+ai_preprocess_stats_lock = threading.Lock()  # Detection workers update the stats concurrently
+
+def record_ai_preprocess(camera_id, bytes_in, bytes_out):
+    with ai_preprocess_stats_lock:
+        camera_stats = ai_preprocess_stats['cameras'].setdefault(camera_id, {'frames': 0, 'bytes_in': 0, 'bytes_out': 0})
+        for stats in (ai_preprocess_stats, camera_stats):
+            stats['frames'] += 1
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+
+def record_ai_preprocess_failure():
+    with ai_preprocess_stats_lock:
+        ai_preprocess_stats['failed'] += 1
+
+def parse_ai_crop(value):
+    """Validate an ai_crop setting: [x1, y1, x2, y2] as fractions of the frame. Returns a list or None."""
+    if not value:
+        return None
+    try:
+        x1, y1, x2, y2 = (float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+    if not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+        return None
+    return [x1, y1, x2, y2]
+
+def preprocess_for_ai(camera_id, image_bytes):
+    """
+    Mask the camera's detection regions, apply its ai_crop, downscale to AI_IMAGE_MAX_EDGE
+    and re-encode at AI_JPEG_QUALITY.
+
+    Returns:
+        bytes: The JPEG to send to the AI (the input unchanged if there is nothing to do or it fails).
+    """
+    crop = parse_ai_crop(camera_settings.get(camera_id, {}).get('ai_crop'))
+    regions = get_camera_regions(camera_id)
+    geometry = get_jpeg_geometry(image_bytes)
+    if geometry is not None:
+        crop_width, crop_height = geometry[0], geometry[1]
+        if crop:
+            crop_width = int(crop_width * (crop[2] - crop[0]))
+            crop_height = int(crop_height * (crop[3] - crop[1]))
+        long_edge = max(crop_width, crop_height)
+    else:
+        long_edge = None
+    needs_resize = AI_IMAGE_MAX_EDGE > 0 and (long_edge is None or long_edge > AI_IMAGE_MAX_EDGE)
+    if not crop and not regions and not needs_resize and AI_JPEG_QUALITY <= 0:
+        return image_bytes
+
+    # Crops are fractional, so a reduced-size decode works for them too
+    decode_flag = cv2.IMREAD_COLOR
+    if needs_resize and long_edge is not None:
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if long_edge // factor >= AI_IMAGE_MAX_EDGE:
+                decode_flag = flag
+                break
+
+    try:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), decode_flag)
+        if image is None:
+            record_ai_preprocess_failure()
+            return image_bytes
+        height, width = image.shape[:2]
+        x1, y1, x2, y2 = 0, 0, width, height
+        if crop:
+            x1, y1, x2, y2 = int(crop[0] * width), int(crop[1] * height), int(crop[2] * width), int(crop[3] * height)
+        if regions:
+            mask = get_region_mask(camera_id, width, height)
+            image = cv2.bitwise_and(image, image, mask=mask)
+            # Nothing outside the analysed area needs to be sent
+            mask_x, mask_y, mask_width, mask_height = cv2.boundingRect(mask)
+            if mask_width and mask_height:
+                x1, y1 = max(x1, mask_x), max(y1, mask_y)
+                x2, y2 = min(x2, mask_x + mask_width), min(y2, mask_y + mask_height)
+        if x2 > x1 and y2 > y1 and (x1, y1, x2, y2) != (0, 0, width, height):
+            image = image[y1:y2, x1:x2]
+        height, width = image.shape[:2]
+        if AI_IMAGE_MAX_EDGE > 0 and max(height, width) > AI_IMAGE_MAX_EDGE:
+            scale = AI_IMAGE_MAX_EDGE / max(height, width)
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, AI_JPEG_QUALITY] if AI_JPEG_QUALITY > 0 else []
+        ret, buffer = cv2.imencode('.jpg', image, params)
+        if not ret:
+            record_ai_preprocess_failure()
+            return image_bytes
+        processed = buffer.tobytes()
+        if not crop and not regions and not needs_resize and len(processed) >= len(image_bytes):
+            # Re-quantizing alone didn't help
+            processed = image_bytes
+    except Exception as e:
+        record_ai_preprocess_failure()
+        person_logger.error(f"AI image preprocessing failed for {camera_id}: {e}")
+        return image_bytes
+
+    record_ai_preprocess(camera_id, len(image_bytes), len(processed))
+    person_logger.debug(f"Preprocessed {camera_id} frame for AI: {len(image_bytes)} -> {len(processed)} bytes")
+    return processed
+
+def get_ai_preprocess_stats():
+    with ai_preprocess_stats_lock:
+        failed = ai_preprocess_stats['failed']
+        snapshot = [('total', dict(ai_preprocess_stats))] + [(name, dict(stats)) for name, stats in ai_preprocess_stats['cameras'].items()]
+    result = {
+        'max_edge': AI_IMAGE_MAX_EDGE,
+        'jpeg_quality': AI_JPEG_QUALITY,
+        'failed': failed,
+        'cameras': {}
+    }
+    for name, stats in snapshot:
+        entry = {
+            'frames': stats['frames'],
+            'bytes_in': stats['bytes_in'],
+            'bytes_out': stats['bytes_out'],
+            'avg_bytes_out': stats['bytes_out'] // stats['frames'] if stats['frames'] else None,
+            'reduction': round(1 - stats['bytes_out'] / stats['bytes_in'], 3) if stats['bytes_in'] else None
+        }
+        if name == 'total':
+            result.update(entry)
+        else:
+            result['cameras'][name] = entry
+    return result
+
+# --- Snapshot cache ---
+# Latest rotated JPEG per camera, fed by the stream hubs, detection captures and /snapshot itself.
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', '2'))  # Seconds a cached snapshot is served as fresh
+SNAPSHOT_CAPTURE_WAIT = 10  # Seconds a request waits for another request's capture of the same camera
+
+class SnapshotCache:
+    """Per-camera latest-frame cache with single-flight captures."""
+
+    def __init__(self):
+        self.entries = {}   # camera_id -> {'image': bytes, 'etag': str, 'timestamp': float}
+        self.inflight = {}  # camera_id -> threading.Event set when the running capture finishes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, camera_id, image_bytes):
+        entry = {
+            'image': image_bytes,
+            'etag': hashlib.md5(image_bytes).hexdigest(),
+            'timestamp': time.time()
+        }
+        with self.lock:
+            self.entries[camera_id] = entry
+        return entry
+
+    def get(self, camera_id, max_age):
+        """Return the cached entry if it is younger than max_age seconds, else None."""
+        with self.lock:
+            entry = self.entries.get(camera_id)
+        if entry and time.time() - entry['timestamp'] <= max_age:
+            return entry
+        return None
+
+    def get_or_capture(self, camera_id, capture_fn, max_age):
+        """
+        Return a fresh cached frame, or run capture_fn() to get one.
+
+        Only one capture per camera runs at a time; concurrent callers wait for it and share the result.
+        capture_fn returns JPEG bytes or None and may raise.
+        """
+        entry = self.get(camera_id, max_age)
+        if entry:
+            self._count(True)
+            return entry
+
+        with self.lock:
+            event = self.inflight.get(camera_id)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self.inflight[camera_id] = event
+
+        if not leader:
+            event.wait(timeout=SNAPSHOT_CAPTURE_WAIT)
+            entry = self.get(camera_id, max_age + SNAPSHOT_CAPTURE_WAIT)
+            # Only a frame actually served counts as a hit; a failed or timed-out capture doesn't
+            self._count(entry is not None)
+            return entry
+
+        self._count(False)
+        try:
+            image_bytes = capture_fn()
+            return self.put(camera_id, image_bytes) if image_bytes else None
+        finally:
+            with self.lock:
+                self.inflight.pop(camera_id, None)
+            event.set()
+
+snapshot_cache = SnapshotCache()
+
+# --- Shared MJPEG stream fan-out ---
+# One upstream connection per camera; each frame is processed once and the encoded
+# part is handed to every subscribed client through a bounded queue.
+
+STREAM_BOUNDARY = 'frame'  # Boundary used for the MJPEG stream we serve to clients
+STREAM_SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('STREAM_SUBSCRIBER_QUEUE_SIZE', '2'))  # Frames buffered per client
+STREAM_MIN_WIDTH = 80     # Smallest width accepted for ?width=
+STREAM_MAX_FPS = 30       # Largest value accepted for ?fps=
+STREAM_HUB_IDLE_TIMEOUT = 10  # Seconds to keep the upstream connection open after the last client leaves
+# Burn the FPS counter into the video. Off by default so unrotated streams are forwarded without
+# re-encoding; FPS is reported in the X-Stream-FPS part header and /stream/<camera_id>/stats instead.
+STREAM_FPS_OVERLAY = os.environ.get('STREAM_FPS_OVERLAY', 'false').lower() == 'true'
+
+class StreamSubscriber:
+    """A single client attached to a CameraStreamHub, with its own frame-rate and size limits."""
+
+    def __init__(self, hub, username, max_fps=None, width=None):
+        self.hub = hub
+        self.username = username
+        self.max_fps = max_fps
+        self.width = width
+        self.queue = queue.Queue(maxsize=STREAM_SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+        self.created = time.time()
+        self.last_accepted = 0
+        self.delivered_frames = 0
+        self.dropped_frames = 0   # Frames discarded because the client fell behind
+        self.skipped_frames = 0   # Frames skipped to honour max_fps
+        self.stats_lock = threading.Lock()  # Counters are updated by the hub thread and the client's generator
+
+    def wants_frame(self, now):
+        """Apply the client's ?fps= limit; returns False if this frame should be skipped."""
+        if self.max_fps and now - self.last_accepted < 1.0 / self.max_fps:
+            with self.stats_lock:
+                self.skipped_frames += 1
+            return False
+        self.last_accepted = now
+        return True
+
+    def push(self, part):
+        """Queue an encoded MJPEG part. A client that fell behind skips straight to the latest frame."""
+        try:
+            self.queue.put_nowait(part)
+            return
+        except queue.Full:
+            pass
+        # Drop everything still queued so latency stays bounded
+        dropped = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                break
+        try:
+            self.queue.put_nowait(part)
+        except queue.Full:
+            dropped += 1
+        with self.stats_lock:
+            self.dropped_frames += dropped
+
+    def parts(self):
+        """Yield encoded MJPEG parts until the subscriber or the hub is closed."""
+        while not self.closed:
+            try:
+                part = self.queue.get(timeout=1)
+            except queue.Empty:
+                if not self.hub.running:
+                    break
+                continue
+            if part is None:  # Hub lost its upstream connection
+                break
+            with self.stats_lock:
+                self.delivered_frames += 1
+            yield part
+
+    def stats(self):
+        with self.stats_lock:
+            delivered, dropped, skipped = self.delivered_frames, self.dropped_frames, self.skipped_frames
+        return {
+            'username': self.username,
+            'max_fps': self.max_fps,
+            'width': self.width,
+            'connected_for': round(time.time() - self.created, 1),
+            'delivered_frames': delivered,
+            'dropped_frames': dropped,
+            'skipped_frames': skipped,
+            'queued_frames': self.queue.qsize()
+        }
+
+    def close(self):
+        """Detach from the hub. Safe to call more than once."""
+        if self.closed:
+            return
+        self.closed = True
+        self.hub.unsubscribe(self)
+
+class CameraStreamHub:
+    """Holds the single upstream MJPEG connection for a camera and fans frames out to subscribers."""
+
+    def __init__(self, camera_id, stream_url):
+        self.camera_id = camera_id
+        self.stream_url = stream_url
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.stopped = False  # Set once the hub has been replaced, e.g. after the stream URL changed
+        self.thread = None
+        self.connected = threading.Event()
+        self.last_error = None
+        self.fps_samples = []
+        self.last_frame_time = None
+        self.current_fps = None
+        self.frames_processed = 0
+        self.mode = None  # 'passthrough', 'rotate' or 'transcode'
+
+    def subscribe(self, username, max_fps=None, width=None):
+        subscriber = StreamSubscriber(self, username, max_fps=max_fps, width=width)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if not self.running and not self.stopped:
+                self.running = True
+                self.connected.clear()
+                self.last_error = None
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        print(f"Stream hub {self.camera_id}: {subscriber.username} subscribed ({len(self.subscribers)} viewers)")
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            remaining = len(self.subscribers)
+        print(f"Stream hub {self.camera_id}: {subscriber.username} unsubscribed ({remaining} viewers)")
+
+    def stop(self):
+        """Close the upstream connection for good and disconnect the current viewers."""
+        with self.lock:
+            self.stopped = True
+            self.running = False
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.push(None)
+        print(f"Stream hub {self.camera_id}: stopped ({self.stream_url})")
+
+    def wait_until_connected(self, timeout):
+        """Wait for the upstream connection; returns False if it failed or timed out."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.connected.wait(timeout=0.1):
+                return True
+            if not self.running:
+                return False
+        return self.connected.is_set()
+
+    def _broadcast(self, frame_bytes):
+        """Send a processed frame to every subscriber, downscaling once per requested width."""
+        now = time.time()
+        with self.lock:
+            subscribers = [s for s in self.subscribers if s.wants_frame(now)]
+        parts = {}
+        for subscriber in subscribers:
+            width = subscriber.width
+            if width not in parts:
+                scaled = resize_jpeg(frame_bytes, width) if width else frame_bytes
+                parts[width] = self._build_part(scaled)
+            subscriber.push(parts[width])
+
+    def _update_fps(self):
+        """Update the rolling FPS average and return it (None until two frames were seen)."""
+        current_time = time.time()
+        if self.last_frame_time is not None:
+            time_diff = current_time - self.last_frame_time
+            if time_diff > 0:
+                # Use rolling average
+                self.fps_samples.append(1.0 / time_diff)
+                if len(self.fps_samples) > FPS_ROLLING_AVG_COUNT:
+                    self.fps_samples.pop(0)
+                self.current_fps = sum(self.fps_samples) / len(self.fps_samples)
+        self.last_frame_time = current_time
+        return self.current_fps
+
+    def _build_part(self, frame_bytes):
+        """Wrap JPEG bytes in a multipart section; FPS travels in the X-Stream-FPS part header."""
+        fps_header = b''
+        if self.current_fps is not None:
+            fps_header = b'X-Stream-FPS: ' + f"{self.current_fps:.1f}".encode() + b'\r\n'
+        return (b'--' + STREAM_BOUNDARY.encode() + b'\r\n' +
+                b'Content-Type: image/jpeg\r\n' +
+                b'Content-Length: ' + str(len(frame_bytes)).encode() + b'\r\n' +
+                fps_header + b'\r\n' +
+                frame_bytes + b'\r\n')
+
+    def _process_frame(self, image_data):
+        """Turn an upstream JPEG into the JPEG served to clients. Returns None on failure."""
+        fps = self._update_fps()
+        rotation = camera_settings.get(self.camera_id, {}).get('rotation', 'none')
+
+        # Passthrough: forward the camera's JPEG byte-for-byte, no decode/encode
+        if rotation == 'none' and not STREAM_FPS_OVERLAY:
+            self.mode = 'passthrough'
+            return image_data
+
+        # Rotation only: in-process OpenCV rotation, spawning jpegtran per frame costs more
+        if not STREAM_FPS_OVERLAY:
+            self.mode = 'rotate'
+            return rotate_jpeg(image_data, rotation, lossless=False)
+
+        self.mode = 'transcode'
+        np_arr = np.frombuffer(image_data, np.uint8)
+        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        if frame is None:
+            print(f"Frame decoding failed for {self.camera_id}")
+            return None
+
+        # Apply per-camera rotation if configured
+        if rotation in CV2_ROTATIONS:
+            frame = cv2.rotate(frame, CV2_ROTATIONS[rotation])
+
+        # Add FPS overlay
+        fps_text = f"FPS: {fps:.1f}" if fps is not None else "FPS: N/A"
+        cv2.putText(frame, fps_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2, cv2.LINE_AA)
+
+        ret, buffer_encoded = cv2.imencode('.jpg', frame)
+        if not ret:
+            return None
+        return buffer_encoded.tobytes()
+
+    def stats(self):
+        """Runtime statistics for the /stream/<camera_id>/stats endpoint."""
+        with self.lock:
+            viewers = len(self.subscribers)
+            clients = [s.stats() for s in self.subscribers]
+            frames_processed = self.frames_processed
+        return {
+            'camera_id': self.camera_id,
+            'running': self.running,
+            'connected': self.connected.is_set(),
+            'mode': self.mode,
+            'fps': round(self.current_fps, 1) if self.current_fps is not None else None,
+            'viewers': viewers,
+            'frames_processed': frames_processed,
+            'last_error': self.last_error,
+            'clients': clients
+        }
+
+    def _should_stop(self, idle_since):
+        """Stop once the hub was stopped or nobody has been watching for STREAM_HUB_IDLE_TIMEOUT seconds."""
+        with self.lock:
+            if self.stopped:
+                return True, idle_since
+            if self.subscribers:
+                return False, None
+            if idle_since is None:
+                return False, time.time()
+            if time.time() - idle_since < STREAM_HUB_IDLE_TIMEOUT:
+                return False, idle_since
+            self.running = False
+            return True, idle_since
+
+    def _run(self):
+        resp = None
+        try:
+            resp = http_pool.get(self.stream_url, stream=True, timeout=10)
+            if resp.status_code != 200:
+                self.last_error = f"HTTP {resp.status_code}"
+                print(f"Camera {self.camera_id} (stream URL: {self.stream_url}) returned status {resp.status_code}")
+                return
+
+            # Get the boundary string for MJPEG
+            boundary = parse_boundary(resp.headers.get('content-type', ''))
+            if not boundary:
+                self.last_error = "missing MJPEG boundary"
+                print(f"Could not find boundary for MJPEG stream: {self.camera_id}")
+                return
+
+            self.connected.set()
+            print(f"Stream hub {self.camera_id}: upstream connected to {self.stream_url}")
+
+            parser = MJPEGParser(boundary)
+            idle_since = None
+            for chunk in resp.iter_content(chunk_size=4096):
+                stop, idle_since = self._should_stop(idle_since)
+                if stop:
+                    if not self.stopped:
+                        print(f"Stream hub {self.camera_id}: no viewers for {STREAM_HUB_IDLE_TIMEOUT}s, closing upstream")
+                    break
+                if not chunk:
+                    continue
+
+                for image_data in parser.feed(chunk):
+                    if not image_data or idle_since is not None:
+                        continue
+                    try:
+                        frame_bytes = self._process_frame(image_data)
+                        if frame_bytes is not None:
+                            with self.lock:
+                                self.frames_processed += 1
+                            self._broadcast(frame_bytes)
+                            if self.mode != 'transcode':  # Skip frames with the FPS overlay burned in
+                                snapshot_cache.put(self.camera_id, frame_bytes)
+                    except Exception as decode_error:
+                        print(f"Error processing frame for {self.camera_id}: {decode_error}")
+
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Stream hub error for {self.camera_id}: {e}")
+        finally:
+            if resp is not None:
+                try:
+                    resp.close()
+                except Exception as close_error:
+                    print(f"Error closing upstream stream for {self.camera_id}: {close_error}")
+            with self.lock:
+                # A new subscriber may already have restarted the hub with a fresh thread
+                if self.thread is threading.current_thread():
+                    self.running = False
+                    subscribers = list(self.subscribers)
+                else:
+                    subscribers = []
+            # Wake up any remaining clients so their generators finish
+            for subscriber in subscribers:
+                subscriber.push(None)
+            self.fps_samples = []
+            self.last_frame_time = None
+            self.current_fps = None
+            print(f"Stream hub {self.camera_id}: upstream closed")
+
+# camera_id -> CameraStreamHub
+stream_hubs = {}
+stream_hubs_lock = threading.Lock()
+
+def get_stream_hub(camera_id, stream_url):
+    """Get or create the shared stream hub for a camera, replacing it if the stream URL changed."""
+    with stream_hubs_lock:
+        hub = stream_hubs.get(camera_id)
+        if hub is not None and hub.stream_url == stream_url:
+            return hub
+        old_hub = hub
+        hub = CameraStreamHub(camera_id, stream_url)
+        stream_hubs[camera_id] = hub
+    if old_hub is not None:
+        # Otherwise the old upstream reader keeps running for as long as it has viewers
+        old_hub.stop()
+    return hub
+
 @app.before_request
 def log_request_info():
     """Log the origin IP and path for every request."""
@@ -501,36 +1678,13 @@ def log_request_info():
 @app.route('/')
 @login_required
 def home():
-    # Trigger a fresh camera scan
-    global cameras, last_camera_connection_state
-    print(f"DEBUG: Before scan, camera_settings = {camera_settings}")
-    cameras = scan_for_cameras()
-
-    print("cameras", cameras)
-    
-    # Update camera connection status based on stream port
-    for camera_id, camera_config in cameras.items():
-        stream_port = camera_config.get('stream_port', 0)
-        was_connected = last_camera_connection_state.get(camera_id, False)
-        camera_config['is_connected'] = is_port_open('localhost', stream_port)
-        is_now_connected = camera_config['is_connected']
-        
-        # Ensure runtime settings like rotation are present in the camera config for UI convenience
-        if camera_id in camera_settings:
-            try:
-                camera_config.update(camera_settings[camera_id])
-            except Exception:
-                pass
-        
-        # Reapply camera control settings when camera transitions from offline to online
-        if is_now_connected and not was_connected:
-            print(f"Camera {camera_id} reconnected, reapplying saved controls...")
-            capture_port = camera_config.get('capture_port', 0)
-            if capture_port > 0 and is_port_open('localhost', capture_port):
-                reapply_camera_controls(camera_id, capture_port)
-        
-        # Update last known state
-        last_camera_connection_state[camera_id] = is_now_connected
+    # "Refresh Cameras" asks the background monitor to rescan now (it also reapplies settings
+    # to cameras that came back) and waits briefly for the new list
+    if request.args.get('refresh'):
+        requested_at = time.time()
+        camera_registry.request_refresh()
+        camera_registry.wait_for_refresh(requested_at, timeout=10)
+    cameras = camera_registry.cameras()
     
     return render_template(
         'dashboard.html',
@@ -543,73 +1697,32 @@ def home():
 @app.route('/snapshot/<camera_id>')
 @login_required
 def camera_snapshot(camera_id):
-    global cameras
-    # Verify camera exists
-    if camera_id not in cameras:
-        # Attempt to rescan if camera is not found, it might be a new one.
-        # To keep it simple, we'll try to find a stream port that would match the ID.
-        # e.g., camera1 -> stream_port 10001, camera2 -> stream_port 10003
-        try:
-            camera_num = int(camera_id.replace('camera', ''))
-            potential_stream_port = 10001 + (camera_num - 1) * 2
-            potential_capture_port = potential_stream_port + 1
-
-            # Check if corresponding stream and capture ports are open
-            if is_port_open('localhost', potential_stream_port) and is_port_open('localhost', potential_capture_port):
-                print(f"Potential new camera {camera_id} detected by ports, rescanning...")
-                cameras = scan_for_cameras() # Rescan to populate details
-            else:
-                print(f"Ports for {camera_id} not found, redirecting to placeholder.")
-                return redirect(url_for('placeholder_image'))
-
-        except ValueError:
-            # Invalid camera_id format
-            print(f"Invalid camera_id format for snapshot: {camera_id}")
-            return redirect(url_for('placeholder_image'))
-        
-        # Check again after scan
-        if camera_id not in cameras:
-            print(f"Camera {camera_id} not found after rescan, redirecting to placeholder.")
-            return redirect(url_for('placeholder_image'))
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
+        # It might be a camera that just came online; let the monitor pick it up
+        print(f"Camera {camera_id} not found, redirecting to placeholder.")
+        camera_registry.request_refresh()
+        return redirect(url_for('placeholder_image'))
     
-    camera_config = cameras[camera_id]
     if 'capture_url' not in camera_config:
         print(f"Capture URL not configured for {camera_id}")
         return redirect(url_for('placeholder_image'))
 
-    try:
-        capture_url = camera_config['capture_url']
+    capture_url = camera_config['capture_url']
+
+    def capture():
         # Make a GET request to the capture URL
-        resp = requests.get(capture_url, timeout=5) # Increased timeout slightly for capture
-        
-        if resp.status_code == 200:
-            content_type = resp.headers.get('content-type', 'image/jpeg') # Default to jpeg
-            # Apply per-camera rotation to snapshot if configured
-            image_bytes = resp.content
-            try:
-                np_arr = np.frombuffer(image_bytes, np.uint8)
-                image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-                if image is not None:
-                    rotation = camera_settings.get(camera_id, {}).get('rotation', 'none')
-                    if rotation == '180':
-                        image = cv2.rotate(image, cv2.ROTATE_180)
-                    elif rotation == '90_right':
-                        image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
-                    elif rotation == '90_left':
-                        image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-
-                    ret, buffer = cv2.imencode('.jpg', image)
-                    if ret:
-                        image_bytes = buffer.tobytes()
-                        content_type = 'image/jpeg'
-            except Exception:
-                pass
-
-            return Response(image_bytes, content_type=content_type)
-        else:
+        resp = http_pool.get(capture_url, timeout=5) # Increased timeout slightly for capture
+        if resp.status_code != 200:
             print(f"Error {resp.status_code} getting snapshot from {capture_url} for {camera_id}")
-            return redirect(url_for('placeholder_image'))
-            
+            return None
+        # Apply per-camera rotation to snapshot if configured
+        rotation = camera_settings.get(camera_id, {}).get('rotation', 'none')
+        return rotate_jpeg(resp.content, rotation)
+
+    try:
+        # Concurrent requests for the same camera share one capture; recent frames are reused
+        entry = snapshot_cache.get_or_capture(camera_id, capture, SNAPSHOT_MAX_AGE)
     except requests.exceptions.Timeout:
         print(f"Timeout getting snapshot for {camera_id} from {capture_url}")
         return redirect(url_for('placeholder_image'))
@@ -617,6 +1730,14 @@ def camera_snapshot(camera_id):
         print(f"Error getting snapshot for {camera_id}: {e}")
         return redirect(url_for('placeholder_image'))
 
+    if entry is None:
+        return redirect(url_for('placeholder_image'))
+
+    response = Response(entry['image'], content_type='image/jpeg')
+    response.set_etag(entry['etag'])
+    response.headers['Cache-Control'] = f'private, max-age={int(SNAPSHOT_MAX_AGE)}'
+    return response.make_conditional(request)
+
 @app.route('/cameras')
 def camera_list():
     if 'username' not in session:
@@ -628,16 +1749,11 @@ def camera_list():
 @app.route('/camera/<camera_id>')
 @login_required
 def view_camera(camera_id):
-    global cameras
-    if camera_id not in cameras:
-        # Optional: attempt a rescan if camera not found, similar to snapshot endpoint
-        # For simplicity, we'll rely on the dashboard's scan for now.
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
         return "Camera not found. <a href='/'>Back to Dashboard</a>", 404
         
-    camera_config = cameras[camera_id]
-    stream_port = camera_config.get('stream_port', 0)
-    # is_connected status here refers to the stream port for the live view page
-    is_connected = is_port_open('localhost', stream_port)
+    is_connected = camera_registry.is_connected(camera_id)
     
     # Pass the entire camera_config to the template for flexibility
     return f'''
@@ -907,6 +2023,21 @@ def view_camera(camera_id):
             // Check camera status periodically
             setInterval(checkCameraConnection, 10000);
             
+            // FPS is reported out-of-band so frames can be passed through untouched
+            function updateFps() {{
+                if (!streamActive) return;
+                fetch('/stream/{camera_id}/stats')
+                .then(response => response.json())
+                .then(data => {{
+                    const fpsIndicator = document.getElementById('fps-indicator');
+                    if (fpsIndicator) {{
+                        fpsIndicator.textContent = data.fps !== null ? 'FPS: ' + data.fps.toFixed(1) : 'FPS: N/A';
+                    }}
+                }})
+                .catch(err => console.error('Error fetching stream stats:', err));
+            }}
+            setInterval(updateFps, 2000);
+            
             function handleImageError(img) {{
                 img.src = '/placeholder?t=' + new Date().getTime();
                 const statusIndicator = document.getElementById('status-indicator');
@@ -928,6 +2059,7 @@ def view_camera(camera_id):
             <span id="status-indicator" class="status-indicator {is_connected and 'status-connected' or 'status-disconnected'}">
                 {is_connected and 'Connected' or 'Offline'}
             </span>
+            <span id="fps-indicator" class="status-indicator">FPS: N/A</span>
         </h1>
         
         <div class="stream-container">
@@ -992,32 +2124,15 @@ def stop_stream(camera_id):
 @app.route('/stream/<camera_id>')
 @login_required
 def stream_proxy(camera_id):
-    global cameras, active_streams, frame_times
+    global active_streams
     # Verify camera exists
-    if camera_id not in cameras:
-        # Attempt to rescan, similar to snapshot logic
-        try:
-            camera_num = int(camera_id.replace('camera', ''))
-            potential_stream_port = 10001 + (camera_num - 1) * 2
-            potential_capture_port = potential_stream_port + 1
-            if is_port_open('localhost', potential_stream_port) and is_port_open('localhost', potential_capture_port):
-                cameras = scan_for_cameras()
-        except ValueError:
-            pass # Invalid ID format, will be caught below
-        
-        # Check again after scan
-        if camera_id not in cameras:
-            return "Camera not found. <a href='/'>Back to Dashboard</a>", 404
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
+        camera_registry.request_refresh()
+        return "Camera not found. <a href='/'>Back to Dashboard</a>", 404
     
-    camera_config = cameras[camera_id]
-    if 'stream_url' not in camera_config or 'stream_port' not in camera_config:
-        print(f"Stream URL or Port not configured for {camera_id}")
-        return redirect(url_for('placeholder_image'))
-
-    # Make sure the camera's stream port is connected before trying to stream
-    stream_port = camera_config['stream_port']
-    if not is_port_open('localhost', stream_port):
-        print(f"Stream port {stream_port} for {camera_id} is not open.")
+    if 'stream_url' not in camera_config:
+        print(f"Stream URL not configured for {camera_id}")
         return redirect(url_for('placeholder_image'))
     
     # Track this stream for the current user
@@ -1025,189 +2140,68 @@ def stream_proxy(camera_id):
         active_streams[camera_id] = {}
     active_streams[camera_id][session['username']] = time.time()
     
-    # Initialize FPS tracking for this stream instance
+    # Optional per-client downsampling: /stream/<camera_id>?fps=5&width=640
+    max_fps = request.args.get('fps', type=float)
+    if max_fps is not None and max_fps <= 0:
+        max_fps = None
+    elif max_fps is not None:
+        max_fps = min(max_fps, STREAM_MAX_FPS)
+    width = request.args.get('width', type=int)
+    if width is not None:
+        width = max(width, STREAM_MIN_WIDTH) if width > 0 else None
+
+    stream_url = camera_config['stream_url']
     conn_id = f"{camera_id}_{session['username']}_{time.time()}"
-    frame_times[conn_id] = {'times': [], 'last_time': time.time()}
-    
-    try:
-        stream_url = camera_config['stream_url']
-        resp = requests.get(stream_url, stream=True, timeout=10) # Increased timeout
-        
-        if resp.status_code == 200:
-            # Get the boundary string for MJPEG
-            content_type = resp.headers.get('content-type', '')
-            boundary = None
-            if 'multipart/x-mixed-replace' in content_type:
-                parts = content_type.split(';')
-                for part in parts:
-                    if 'boundary=' in part:
-                        boundary = part.split('=')[1].strip()
-                        break
-            
-            if not boundary:
-                print(f"Could not find boundary for MJPEG stream: {camera_id}")
-                # Fallback or attempt to stream raw if not MJPEG? For now, redirect.
-                return redirect(url_for('placeholder_image'))
-
-            # Track the connection for cleanup
-            active_connections[conn_id] = {
-                'camera_id': camera_id,
-                'username': session['username'],
-                'response': resp,
-                'created': time.time(),
-                'last_access': time.time()
-            }
-            
-            def generate():
-                global frame_times
-                buffer = b''
-                last_frame_time = time.time()
-                
-                try:
-                    for chunk in resp.iter_content(chunk_size=4096): # Process in smaller chunks
-                        # Update last access time
-                        if conn_id in active_connections:
-                            active_connections[conn_id]['last_access'] = time.time()
-                        else: # Connection closed by cleanup or stop_stream
-                           break 
-
-                        if not chunk:
-                            continue
 
-                        buffer += chunk
-                        
-                        # Check if connection should be closed externally
-                        if conn_id not in active_connections:
-                            print(f"Connection {conn_id} terminated externally.")
-                            break
-
-                        # Process buffer looking for frames
-                        while True:
-                            # Find the start of the boundary
-                            start_boundary = buffer.find(b'--' + boundary.encode())
-                            if start_boundary == -1:
-                                break # Need more data
-
-                            # Find the end of the boundary marker (start of headers)
-                            end_boundary_marker = buffer.find(b'\r\n', start_boundary)
-                            if end_boundary_marker == -1:
-                                break # Need more data
-
-                            # Find the start of the image data (after headers)
-                            start_image = buffer.find(b'\r\n\r\n', end_boundary_marker)
-                            if start_image == -1:
-                                break # Need more data
-                                
-                            # We now have the headers between end_boundary_marker+2 and start_image
-                            # header_part = buffer[end_boundary_marker+2:start_image]
-
-                            # Find the start of the *next* boundary to get the end of the current image
-                            next_boundary = buffer.find(b'--' + boundary.encode(), start_image + 4)
-                            if next_boundary == -1:
-                                break # Need more data for the complete frame
-
-                            # Extract the image data
-                            image_data = buffer[start_image + 4 : next_boundary]
-                            
-                            # Process the frame if it's not empty
-                            if image_data:
-                                try:
-                                    # Decode frame
-                                    np_arr = np.frombuffer(image_data, np.uint8)
-                                    frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-                                    if frame is not None:
-                                        # Apply per-camera rotation if configured
-                                        try:
-                                            rotation = camera_settings.get(camera_id, {}).get('rotation', 'none')
-                                            if rotation == '180':
-                                                frame = cv2.rotate(frame, cv2.ROTATE_180)
-                                            elif rotation == '90_right':
-                                                frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-                                            elif rotation == '90_left':
-                                                frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
-                                        except Exception:
-                                            pass
-
-                                        # Calculate FPS
-                                        current_time = time.time()
-                                        time_diff = current_time - frame_times[conn_id]['last_time']
-                                        frame_times[conn_id]['last_time'] = current_time
-                                        
-                                        if time_diff > 0:
-                                            fps = 1.0 / time_diff
-                                            # Use rolling average
-                                            frame_times[conn_id]['times'].append(fps)
-                                            if len(frame_times[conn_id]['times']) > FPS_ROLLING_AVG_COUNT:
-                                                frame_times[conn_id]['times'].pop(0)
-                                            avg_fps = sum(frame_times[conn_id]['times']) / len(frame_times[conn_id]['times'])
-                                            fps_text = f"FPS: {avg_fps:.1f}"
-                                        else:
-                                            fps_text = "FPS: N/A"
-
-                                        # Add FPS overlay
-                                        cv2.putText(frame, fps_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2, cv2.LINE_AA)
-
-                                        # Re-encode frame
-                                        ret, buffer_encoded = cv2.imencode('.jpg', frame)
-                                        if ret:
-                                            frame_bytes = buffer_encoded.tobytes()
-                                            
-                                            # Yield the MJPEG part
-                                            yield (b'--' + boundary.encode() + b'\r\n' +
-                                                   b'Content-Type: image/jpeg\r\n' +
-                                                   b'Content-Length: ' + str(len(frame_bytes)).encode() + b'\r\n\r\n' +
-                                                   frame_bytes + b'\r\n')
-                                    else:
-                                         print(f"Frame decoding failed for {camera_id}")
-
-                                except Exception as decode_error:
-                                    print(f"Error processing frame for {camera_id}: {decode_error}")
-                                    # Optionally yield the original data if processing fails?
-                                    # yield (b'--' + boundary.encode() + b'\r\n' +
-                                    #       b'Content-Type: image/jpeg\r\n' + # Assuming it's jpeg
-                                    #       b'Content-Length: ' + str(len(image_data)).encode() + b'\r\n\r\n' +
-                                    #       image_data + b'\r\n')
-                            
-                            # Remove the processed part from the buffer
-                            buffer = buffer[next_boundary:]
+    # Attach to the shared upstream connection for this camera (started on first subscriber)
+    hub = get_stream_hub(camera_id, stream_url)
+    subscriber = hub.subscribe(session['username'], max_fps=max_fps, width=width)
 
-                except Exception as e:
-                    print(f"Stream error for {camera_id} ({conn_id}): {e}")
-                finally:
-                    # Cleanup FPS tracking for this specific connection
-                    if conn_id in frame_times:
-                        del frame_times[conn_id]
-                        
-                    # Cleanup connection from active_connections when stream ends naturally
-                    if conn_id in active_connections:
-                        try:
-                            response_obj = active_connections[conn_id]['response']
-                            if hasattr(response_obj, 'close') and callable(response_obj.close):
-                                response_obj.close()
-                        except Exception as close_error:
-                            print(f"Error closing stream connection during cleanup {conn_id}: {close_error}")
-                        
-                        del active_connections[conn_id]
-                        print(f"Stream ended for {conn_id}")
-            
-            # Return the response with the generator
-            return Response(generate(), content_type=f'multipart/x-mixed-replace; boundary={boundary}')
-        else:
-            # If camera returns an error, serve the placeholder
-            print(f"Camera {camera_id} (stream URL: {stream_url}) returned status {resp.status_code}")
-            return redirect(url_for('placeholder_image'))
-            
-    except requests.exceptions.Timeout:
-        print(f"Timeout connecting to camera stream {camera_id}: {stream_url}")
-        return redirect(url_for('placeholder_image'))
-    except Exception as e:
-        print(f"Error connecting to camera stream {camera_id} ({stream_url}): {e}")
-        # Clean up FPS state if connection failed early
-        if conn_id in frame_times:
-            del frame_times[conn_id]
+    if not hub.wait_until_connected(timeout=10):
+        print(f"Could not connect to camera stream {camera_id} ({stream_url}): {hub.last_error}")
+        subscriber.close()
         return redirect(url_for('placeholder_image'))
 
+    # Track the connection for cleanup (stop_stream / cleanup_connections call close())
+    active_connections[conn_id] = {
+        'camera_id': camera_id,
+        'username': session['username'],
+        'response': subscriber,
+        'created': time.time(),
+        'last_access': time.time()
+    }
+
+    def generate():
+        try:
+            for part in subscriber.parts():
+                # Update last access time
+                if conn_id in active_connections:
+                    active_connections[conn_id]['last_access'] = time.time()
+                else: # Connection closed by cleanup or stop_stream
+                    print(f"Connection {conn_id} terminated externally.")
+                    break
+                yield part
+        except Exception as e:
+            print(f"Stream error for {camera_id} ({conn_id}): {e}")
+        finally:
+            subscriber.close()
+            if conn_id in active_connections:
+                del active_connections[conn_id]
+                print(f"Stream ended for {conn_id}")
+
+    return Response(generate(), content_type=f'multipart/x-mixed-replace; boundary={STREAM_BOUNDARY}')
+
+@app.route('/stream/<camera_id>/stats')
+@login_required
+def stream_stats(camera_id):
+    """Report FPS and viewer count for a camera's shared stream"""
+    with stream_hubs_lock:
+        hub = stream_hubs.get(camera_id)
+    if hub is None:
+        return {'camera_id': camera_id, 'running': False, 'connected': False, 'mode': None,
+                'fps': None, 'viewers': 0, 'frames_processed': 0, 'last_error': None, 'clients': []}
+    return hub.stats()
+
 @app.route('/placeholder')
 @login_required
 def placeholder_image():
@@ -1329,72 +2323,28 @@ def test_placeholder():
 @app.route('/camera-details')
 @login_required
 def camera_details():
-    # Trigger a fresh camera scan
-    global cameras
-    cameras = scan_for_cameras()
-    
-    # Update camera connection status based on stream port
-    for camera_id, camera_config in cameras.items():
-        stream_port = camera_config.get('stream_port', 0)
-        camera_config['is_connected'] = is_port_open('localhost', stream_port)
-    
-    return render_template('camera_details.html', cameras=cameras)
+    return render_template('camera_details.html', cameras=camera_registry.cameras())
 
 @app.route('/check-camera/<camera_id>')
 @login_required
 def check_camera(camera_id):
     """API endpoint to check if a camera's stream port is connected"""
-    global cameras # Ensure we are using the latest scanned cameras
-
-    # It's possible the camera list is stale, or this camera ID is new.
-    # A quick check if the camera_id exists, if not, a rescan might be needed
-    # or the ID is simply invalid. For this check, if not immediately found,
-    # we report as disconnected. The main dashboard scan will pick up new cameras.
-    if camera_id not in cameras:
-        # To be more robust, we could try a targeted check like in stream_proxy/snapshot
-        # but for a simple status check, if it's not in the current list, report disconnected.
-        return {"connected": False}
-        
-    camera_config = cameras[camera_id]
-    stream_port = camera_config.get('stream_port', 0)
-    
-    if stream_port == 0:
-        # Invalid configuration for this camera_id if stream_port is missing
-        return {"connected": False}
-        
-    is_connected = is_port_open('localhost', stream_port)
-    
-    # Optionally, update the 'is_connected' status in the global cameras dict
-    # This might be useful if other parts rely on this, but can also lead to frequent updates.
-    # cameras[camera_id]['is_connected'] = is_connected 
-
-    return {"connected": is_connected}
+    # Connection state is kept current by the background camera monitor
+    return {"connected": camera_registry.is_connected(camera_id)}
 
 @app.route('/camera/<camera_id>/status')
 @login_required
 def camera_status(camera_id):
     """Get camera status parameters via /status endpoint"""
-    global cameras
-    
     # Verify camera exists
-    if camera_id not in cameras:
-        cameras = scan_for_cameras()
-        if camera_id not in cameras:
-            return {"error": "Camera not found"}, 404
-    
-    camera_config = cameras[camera_id]
-    capture_port = camera_config.get('capture_port', 0)
-    
-    if capture_port == 0:
-        return {"error": "Capture port not configured"}, 500
-    
-    # Check if camera is connected
-    if not is_port_open('localhost', capture_port):
-        return {"error": "Camera offline"}, 503
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
+        if camera_registry.is_known(camera_id):
+            return {"error": "Camera offline"}, 503
+        return {"error": "Camera not found"}, 404
     
     try:
-        status_url = f"http://localhost:{capture_port}/status"
-        resp = requests.get(status_url, timeout=5)
+        resp = http_pool.get(camera_config['status_url'], timeout=5)
         
         if resp.status_code == 200:
             return resp.json()
@@ -1408,23 +2358,14 @@ def camera_status(camera_id):
 @login_required
 def camera_control(camera_id):
     """Control camera parameters via /control endpoint"""
-    global cameras, camera_control_settings
+    global camera_control_settings
     
     # Verify camera exists
-    if camera_id not in cameras:
-        cameras = scan_for_cameras()
-        if camera_id not in cameras:
-            return {"error": "Camera not found"}, 404
-    
-    camera_config = cameras[camera_id]
-    capture_port = camera_config.get('capture_port', 0)
-    
-    if capture_port == 0:
-        return {"error": "Capture port not configured"}, 500
-    
-    # Check if camera is connected
-    if not is_port_open('localhost', capture_port):
-        return {"error": "Camera offline"}, 503
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
+        if camera_registry.is_known(camera_id):
+            return {"error": "Camera offline"}, 503
+        return {"error": "Camera not found"}, 404
     
     # Get control parameters from request
     if request.is_json:
@@ -1438,9 +2379,8 @@ def camera_control(camera_id):
         return {"error": "Missing 'var' or 'val' parameter"}, 400
     
     try:
-        control_url = f"http://localhost:{capture_port}/control"
         params = {'var': var, 'val': val}
-        resp = requests.get(control_url, params=params, timeout=5)
+        resp = http_pool.get(camera_config['control_url'], params=params, timeout=5)
         
         if resp.status_code == 200:
             # Save this setting to be reapplied on reconnection
@@ -1460,26 +2400,21 @@ def camera_control(camera_id):
 @login_required
 def camera_controls(camera_id):
     """Display camera control panel"""
-    global cameras
-    
     # Verify camera exists
-    if camera_id not in cameras:
-        cameras = scan_for_cameras()
-        if camera_id not in cameras:
-            flash(f"Camera {camera_id} not found.")
-            return redirect(url_for('home'))
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
+        flash(f"Camera {camera_id} not found.")
+        return redirect(url_for('home'))
     
-    camera_config = cameras[camera_id]
-    capture_port = camera_config.get('capture_port', 0)
-    is_connected = is_port_open('localhost', capture_port) if capture_port > 0 else False
+    is_connected = camera_registry.is_connected(camera_id)
     
     # Ensure rotation setting default exists for UI
     if camera_id not in camera_settings:
         camera_settings[camera_id] = {'rotation': 'none'}
     
     # Reapply saved camera control settings when camera is connected
-    if is_connected and capture_port > 0:
-        reapply_camera_controls(camera_id, capture_port)
+    if is_connected:
+        reapply_camera_controls(camera_id, camera_config['control_url'])
 
     return render_template('camera_controls.html',
                          camera_id=camera_id,
@@ -1492,12 +2427,10 @@ def camera_controls(camera_id):
 @login_required
 def camera_rotation(camera_id):
     """Get or set per-camera rotation setting for streamed frames."""
-    global cameras, camera_settings
+    global camera_settings
     # Ensure camera exists (for UX; rotation is local, but tie to known cameras)
-    if camera_id not in cameras:
-        cameras = scan_for_cameras()
-        if camera_id not in cameras:
-            return {"error": "Camera not found"}, 404
+    if camera_registry.get(camera_id) is None:
+        return {"error": "Camera not found"}, 404
 
     if request.method == 'GET':
         current = camera_settings.get(camera_id, {}).get('rotation', 'none')
@@ -1519,27 +2452,90 @@ def camera_rotation(camera_id):
     # Save camera settings to persist rotation
     save_camera_settings()
 
-    # Reflect into cameras dict for templates if present
-    if camera_id in cameras:
-        try:
-            cameras[camera_id]['rotation'] = rotation
-        except Exception:
-            pass
+    # Reflect into the camera registry for templates
+    camera_registry.update_settings(camera_id, {'rotation': rotation})
 
     return {"success": True, "rotation": rotation}
 
-@app.errorhandler(404)
-def page_not_found(e):
-    if 'username' in session:
-        return render_template('404.html'), 404
-    else:
-        return redirect(url_for('login'))
+@app.route('/camera/<camera_id>/regions', methods=['GET', 'POST'])
+@login_required
+def camera_regions(camera_id):
+    """Get or set the camera's detection regions (include/exclude polygons, [x, y] as fractions of the frame)."""
+    global camera_settings
+    if camera_registry.get(camera_id) is None:
+        return {"error": "Camera not found"}, 404
 
-# --- Person Detection Logic ---
+    if request.method == 'GET':
+        regions = get_camera_regions(camera_id) or {'include': [], 'exclude': []}
+        return {"regions": regions}
 
-def detect_persons_local_gemma3(image_bytes):
-    """
-    Uses local Gemma3 model via OpenWebUI API to detect persons in an image.
+    if not request.is_json or not isinstance(request.json, dict):
+        return {"error": "Expected a JSON object"}, 400
+    value = request.json.get('regions', request.json)
+    try:
+        regions = parse_regions(value)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if regions and regions_cover_frame(regions):
+        return {"error": "These regions leave no part of the frame to analyse"}, 400
+
+    if camera_id not in camera_settings:
+        camera_settings[camera_id] = {}
+    if regions:
+        camera_settings[camera_id]['regions'] = regions
+    else:
+        camera_settings[camera_id].pop('regions', None)
+    save_camera_settings()
+    clear_region_masks(camera_id)
+
+    # Cached answers were for the unmasked frame
+    detection_cache.invalidate(camera_id)
+    person_logger.info(f"Detection regions for {camera_id} updated by {session['username']}: "
+                       f"{len(regions['include']) if regions else 0} include, {len(regions['exclude']) if regions else 0} exclude")
+
+    return {"success": True, "regions": regions or {'include': [], 'exclude': []}}
+
+@app.route('/camera/<camera_id>/ai-crop', methods=['GET', 'POST'])
+@login_required
+def camera_ai_crop(camera_id):
+    """Get or set the region of the frame sent to the AI, as [x1, y1, x2, y2] fractions (null for the whole frame)."""
+    global camera_settings
+    if camera_registry.get(camera_id) is None:
+        return {"error": "Camera not found"}, 404
+
+    if request.method == 'GET':
+        return {"ai_crop": parse_ai_crop(camera_settings.get(camera_id, {}).get('ai_crop'))}
+
+    value = request.json.get('ai_crop') if request.is_json and isinstance(request.json, dict) else None
+    crop = parse_ai_crop(value)
+    if value and crop is None:
+        return {"error": "ai_crop must be [x1, y1, x2, y2] with 0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1"}, 400
+
+    if camera_id not in camera_settings:
+        camera_settings[camera_id] = {}
+    if crop:
+        camera_settings[camera_id]['ai_crop'] = crop
+    else:
+        camera_settings[camera_id].pop('ai_crop', None)
+    save_camera_settings()
+
+    # Cached answers were for the old framing
+    detection_cache.invalidate(camera_id)
+
+    return {"success": True, "ai_crop": crop}
+
+@app.errorhandler(404)
+def page_not_found(e):
+    if 'username' in session:
+        return render_template('404.html'), 404
+    else:
+        return redirect(url_for('login'))
+
+# --- Person Detection Logic ---
+
+def detect_persons_local_gemma3(image_bytes):
+    """
+    Uses local Gemma3 model via OpenWebUI API to detect persons in an image.
 
     Args:
         image_bytes: The image data as bytes.
@@ -1550,10 +2546,6 @@ def detect_persons_local_gemma3(image_bytes):
     # Import urllib3 to suppress SSL warnings
     import urllib3
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    
-    # Save image_bytes to a file
-    with open('image.jpg', 'wb') as f:
-        f.write(image_bytes)
 
     if not LOCAL_GEMMA3_URL:
         print("ERROR: LOCAL_GEMMA3_URL environment variable not set. Cannot perform person detection.")
@@ -1604,7 +2596,7 @@ def detect_persons_local_gemma3(image_bytes):
         # WARNING: verify=False disables SSL certificate validation
         # This is a temporary workaround for expired certificates
         # For production use, ensure the SSL certificate is valid
-        resp = requests.post(api_url, json=payload, headers=headers, timeout=30, verify=False)
+        resp = http_pool.post(api_url, json=payload, headers=headers, timeout=(LOCAL_GEMMA3_CONNECT_TIMEOUT, 30), verify=False)
         
         if resp.status_code == 200:
             response_data = resp.json()
@@ -1697,6 +2689,21 @@ def detect_persons_local_gemma3(image_bytes):
         
         return False, image_bytes, error_message
 
+# Gemini clients are reused across detections so the HTTP connection stays warm
+gemini_clients = {}
+gemini_clients_lock = threading.Lock()
+
+def get_gemini_client(api_key):
+    """Return the shared genai.Client for this API key, creating it on first use"""
+    with gemini_clients_lock:
+        client = gemini_clients.get(api_key)
+        if client is None:
+            # Drop clients for keys that have been rotated out
+            gemini_clients.clear()
+            client = genai.Client(api_key=api_key)
+            gemini_clients[api_key] = client
+        return client
+
 def detect_persons_google_ai(image_bytes):
     """
     Uses Google AI Vision API to detect persons in an image.
@@ -1707,11 +2714,6 @@ def detect_persons_google_ai(image_bytes):
     Returns:
         Tuple: (is_person_detected: bool, annotated_image_bytes: bytes, response_text: str)
     """
-
-    # save image_bytes to a file
-    with open('image.jpg', 'wb') as f:
-        f.write(image_bytes)
-
     api_key = os.environ.get('GEMINI_API_KEY') # Updated to GEMINI_API_KEY
     
     if not api_key:
@@ -1719,24 +2721,18 @@ def detect_persons_google_ai(image_bytes):
         return False, image_bytes, "ERROR: GEMINI_API_KEY not set"
 
     try:
-        client = genai.Client(
-            api_key=api_key,
-        )
-
-        #model_name = 'gemini-2.5-flash-preview-05-20'
-        #model_name = 'gemma-3-27b-it'
-        model_name = 'gemini-2.0-flash'
+        client = get_gemini_client(api_key)
 
-
-        file = client.files.upload(file='image.jpg')
+        # Send the frame inline instead of uploading it through the Files API first
+        image_part = types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg')
         response = client.models.generate_content(
-            model=model_name,
+            model=GEMINI_MODEL_NAME,
             contents=["Look carefully at this image."
                       "Is there a human person clearly and unambiguously visible?"
                       "Only answer 'yes' if you are highly confident (90%+ certain) that there is a human being present."
                       "If there is any doubt, unclear shapes, shadows, or objects that might be mistaken for a person, answer 'no'."
                       "Answer with 'yes' or 'no'."
-                      "if yes respond for each person with [age=#: what is the person doing?] for example [age=25: walking] [age=50: sitting on the couch]", file]
+                      "if yes respond for each person with [age=#: what is the person doing?] for example [age=25: walking] [age=50: sitting on the couch]", image_part]
         )
         person_logger.info(f"Gemini AI response for person detection: {response.text}")
         
@@ -1822,22 +2818,1141 @@ def detect_persons_google_ai(image_bytes):
         
         return False, image_bytes, error_message
 
-def detect_persons(image_bytes):
+local_person_detector = LocalPersonDetector(LOCAL_DNN_MODEL, LOCAL_DNN_CONFIG or None,
+                                            person_class_id=LOCAL_DNN_PERSON_CLASS)
+
+def run_local_detector(image_bytes):
+    """
+    Decode a JPEG and run the on-box detector on it.
+
+    Returns:
+        Tuple: (image, detections) with image as a BGR array and detections as
+        (confidence, box) pairs, best first. image is None if decoding failed.
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None, []
+    return image, local_person_detector.detect(image, min_confidence=min(LOCAL_DNN_ESCALATE_MIN, LOCAL_DNN_CONFIDENCE))
+
+def local_detection_result(image, detections, image_bytes):
+    """Build the (is_present, annotated_image_bytes, response_text) tuple for a local detector verdict."""
+    persons = [d for d in detections if d[0] >= LOCAL_DNN_CONFIDENCE]
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cv2.putText(image, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
+    draw_detections(image, detections, LOCAL_DNN_CONFIDENCE)
+    if persons:
+        response_text = "yes " + " ".join(f"[person {confidence:.2f}: box {x1},{y1},{x2},{y2}]"
+                                          for confidence, (x1, y1, x2, y2) in persons)
+    else:
+        best = detections[0][0] if detections else 0.0
+        response_text = f"no (local detector, best score {best:.2f})"
+    ret, buffer = cv2.imencode('.jpg', image)
+    return bool(persons), buffer.tobytes() if ret else image_bytes, response_text
+
+def detect_persons_local_dnn(image_bytes):
+    """
+    Uses the on-box OpenCV DNN detector to find persons in an image.
+
+    Args:
+        image_bytes: The image data as bytes.
+
+    Returns:
+        Tuple: (is_person_detected: bool, annotated_image_bytes: bytes, response_text: str)
+    """
+    if not local_person_detector.available():
+        return False, image_bytes, f"ERROR: local detector model not found ({LOCAL_DNN_MODEL})"
+    try:
+        image, detections = run_local_detector(image_bytes)
+        if image is None:
+            return False, image_bytes, "ERROR: Failed to decode image"
+        result = local_detection_result(image, detections, image_bytes)
+        person_logger.info(f"Local detector response for person detection: {result[2]}")
+        return result
+    except Exception as e:
+        person_logger.error(f"Error during local DNN person detection: {e}")
+        return False, image_bytes, f"ERROR: local detector failed: {e}"
+
+CASCADE_CAPTION_PROMPT = (
+    "This image was cropped around {count} person(s) found by a person detector. "
+    "For each person respond with [age=#: what is the person doing?], "
+    "for example [age=25: walking] [age=50: sitting on the couch]."
+)
+
+def crop_to_detections(image, boxes, padding=CASCADE_CROP_PADDING):
+    """Crop a BGR image to the union of the boxes plus padding. Returns the crop as JPEG bytes."""
+    height, width = image.shape[:2]
+    x1 = min(box[0] for box in boxes)
+    y1 = min(box[1] for box in boxes)
+    x2 = max(box[2] for box in boxes)
+    y2 = max(box[3] for box in boxes)
+    pad_x = int((x2 - x1) * padding)
+    pad_y = int((y2 - y1) * padding)
+    x1, y1 = max(0, x1 - pad_x), max(0, y1 - pad_y)
+    x2, y2 = min(width, x2 + pad_x), min(height, y2 + pad_y)
+    ret, buffer = cv2.imencode('.jpg', image[y1:y2, x1:x2])
+    return buffer.tobytes() if ret else None
+
+def cascade_detection(image_bytes, image, detections):
+    """
+    Cascade: the local detector decided presence; for positive frames ask the LLM to
+    describe the persons using only the cropped region. Returns a detection tuple.
+    """
+    persons = [d for d in detections if d[0] >= LOCAL_DNN_CONFIDENCE]
+    crop_bytes = crop_to_detections(image, [box for _, box in persons]) if persons else None
+    # Annotate after cropping so the boxes don't end up in the LLM's input
+    is_present, annotated_image_bytes, response_text = local_detection_result(image, detections, image_bytes)
+    if not persons:
+        person_logger.info(f"🔎 Cascade: no person found locally ({response_text})")
+        return is_present, annotated_image_bytes, response_text
+
+    if crop_bytes is None:
+        return is_present, annotated_image_bytes, response_text
+    person_logger.info(f"🔎 Cascade: {len(persons)} person(s) found locally, asking the AI model to describe "
+                       f"a {len(crop_bytes) // 1024} KB crop (full frame {len(image_bytes) // 1024} KB)")
+    try:
+        caption = inference_client.query([crop_bytes], CASCADE_CAPTION_PROMPT.format(count=len(persons))).strip()
+    except Exception as e:
+        # Presence is already decided; keep the local result without a description
+        person_logger.error(f"Cascade caption failed, keeping the local detector result: {e}")
+        return is_present, annotated_image_bytes, response_text
+    person_logger.info(f"Cascade caption: {caption}")
+    return True, annotated_image_bytes, f"yes {caption}"
+
+def run_local_stage(image_bytes):
+    """
+    Local detector stage in front of the LLM backends (see LOCAL_DNN_STAGE). Returns a final
+    detection tuple, or None when the frame should go to the LLM as usual.
+    """
+    if LOCAL_DNN_STAGE not in ('prefilter', 'cascade') or AI_MODEL_TYPE == 'local_dnn':
+        return None
+    if not local_person_detector.available():
+        return None
+    try:
+        image, detections = run_local_detector(image_bytes)
+    except Exception as e:
+        person_logger.error(f"Local detector stage failed, using the AI model alone: {e}")
+        return None
+    if image is None:
+        return None
+    if LOCAL_DNN_STAGE == 'cascade':
+        return cascade_detection(image_bytes, image, detections)
+
+    best = detections[0][0] if detections else 0.0
+    if LOCAL_DNN_ESCALATE_MIN <= best < LOCAL_DNN_ESCALATE_MAX:
+        person_logger.info(f"🔎 Local detector unsure (best score {best:.2f}), escalating to the AI model")
+        return None
+    result = local_detection_result(image, detections, image_bytes)
+    person_logger.info(f"🔎 Local detector settled the frame without the AI model: {result[2]}")
+    return result
+
+# --- Detection result cache ---
+# While a person is present every check goes to the model, even when nothing moved.
+# For those checks a frame whose 256-bit difference hash (dHash) is within
+# DETECTION_CACHE_MAX_DISTANCE bits of a recent positive answer reuses that answer.
+# Changed frames, periodic re-checks and empty scenes always go to the model (see
+# detection_cache.cache_allowed()).
+DETECTION_CACHE_ENABLED = os.environ.get('DETECTION_CACHE_ENABLED', 'true').lower() == 'true'
+DETECTION_CACHE_HASH_SIZE = 16  # 17x16 grayscale thumbnail -> 256-bit hash
+DETECTION_CACHE_MAX_DISTANCE = int(os.environ.get('DETECTION_CACHE_MAX_DISTANCE', DEFAULT_MAX_DISTANCE))  # Hamming distance in bits
+DETECTION_CACHE_TTL = float(os.environ.get('DETECTION_CACHE_TTL', DEFAULT_TTL))  # Seconds a cached result stays valid
+
+# Response texts the backends return when no answer was obtained; these are never cached
+DETECTION_ERROR_PREFIXES = ('ERROR:', 'HTTP ', 'Local Gemma3 Error', 'Gemini AI Error', 'No response from')
+
+def compute_dhash(image_bytes, hash_size=DETECTION_CACHE_HASH_SIZE):
+    """Difference hash of a JPEG: sign of horizontal gradients on a (hash_size+1) x hash_size grayscale thumbnail."""
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+detection_cache = DetectionResultCache(DETECTION_CACHE_MAX_DISTANCE, DETECTION_CACHE_TTL, DEFAULT_SIZE)
+
+def detection_cache_allowed(context):
+    """True if a detection check may reuse a cached result (person present, unchanged scene)."""
+    return DETECTION_CACHE_ENABLED and cache_allowed(context['gate_reason'], context['change_ratio'], MOTION_CHANGE_THRESHOLD)
+
+def lookup_cached_detection(camera_id, image_bytes):
+    """
+    Hash a frame and look it up in the result cache.
+
+    Returns:
+        Tuple: (dhash or None, cached (is_present, annotated_image_bytes, response_text) or None)
+    """
+    dhash = compute_dhash(image_bytes)
+    if dhash is None:
+        return None, None
+    cached = detection_cache.lookup(camera_id, dhash)
+    if not cached:
+        return dhash, None
+    person_logger.info(f"♻️ Reusing cached detection for {camera_id} (hash distance {cached['distance']})")
+    return dhash, (cached['is_present'], annotate_timestamp(image_bytes), cached['response_text'])
+
+def remember_detection(camera_id, image_bytes, result, dhash=None):
+    """Cache a positive model answer for the frame; the hash is only computed when needed."""
+    if not DETECTION_CACHE_ENABLED or not result[0] or is_detection_error(result[2]):
+        return
+    if dhash is None:
+        dhash = compute_dhash(image_bytes)
+    if dhash is not None:
+        detection_cache.store(camera_id, dhash, result[0], result[2])
+
+def annotate_timestamp(image_bytes):
+    """Stamp the current time on a JPEG the way the AI backends do. Returns the input if it can't be decoded."""
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return image_bytes
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cv2.putText(image, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
+    ret, buffer = cv2.imencode('.jpg', image)
+    return buffer.tobytes() if ret else image_bytes
+
+def detect_persons(image_bytes, camera_id=None, use_cache=False):
     """
     Unified person detection function that chooses between Gemini and local Gemma3 based on configuration.
     
+    With use_cache, results for near-identical frames from the camera are served from the
+    perceptual-hash cache instead of calling the model again (see detection_cache_allowed()).
+    
     Args:
         image_bytes: The image data as bytes.
+        camera_id: Camera the frame came from.
+        use_cache: Allow a cached result for this frame.
         
     Returns:
         Tuple: (is_person_detected: bool, annotated_image_bytes: bytes, response_text: str)
     """
-    if AI_MODEL_TYPE == 'local_gemma3':
-        person_logger.info("Using Local Gemma3 for person detection")
-        return detect_persons_local_gemma3(image_bytes)
+    dhash = None
+    if use_cache and camera_id:
+        dhash, cached = lookup_cached_detection(camera_id, image_bytes)
+        if cached:
+            return cached
+
+    result = run_detection_backend(image_bytes)
+    if camera_id:
+        remember_detection(camera_id, image_bytes, result, dhash)
+    return result
+
+def run_detection_backend(image_bytes):
+    """Send a single frame to the AI backends through the inference client (no caching)."""
+    result = run_local_stage(image_bytes)
+    if result is not None:
+        return result
+    return inference_client.detect(image_bytes)
+
+def is_detection_error(response_text):
+    """True if a backend response text reports a failure rather than an answer."""
+    return not response_text or response_text.startswith(DETECTION_ERROR_PREFIXES)
+
+# --- Batched multi-camera detection ---
+DETECTION_BATCH_SIZE = int(os.environ.get('DETECTION_BATCH_SIZE', '1'))  # Frames per AI request; 1 disables batching
+
+BATCH_DETECTION_PROMPT = (
+    "You are given {count} camera images, numbered 1 to {count} in the order they appear. "
+    "For each image: if the image is not totally dark, check if there is a human person clearly and unambiguously visible. "
+    "Only answer 'yes' if you are highly confident that there is a human being present. "
+    "Reply with exactly one line per image, in the form 'Image <number>: yes' or 'Image <number>: no'. "
+    "If yes, continue that line with [age=#: what is the person doing?] for each person, "
+    "for example 'Image 2: yes [age=25: walking] [age=50: sitting on the couch]'."
+)
+
+BATCH_ANSWER_PATTERN = re.compile(r'^[\s*#>-]*image\s*#?\s*(\d+)\s*\**\s*[:.)-]\s*\**\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+
+def parse_batch_answers(response_text, count):
+    """Split a batched model answer into {image number: answer text} for images 1..count."""
+    answers = {}
+    for match in BATCH_ANSWER_PATTERN.finditer(response_text or ''):
+        index = int(match.group(1))
+        if 1 <= index <= count and index not in answers:
+            answers[index] = match.group(2).strip()
+    return answers
+
+def interpret_detection_answer(answer):
+    """Same yes/no reading the single-image backends apply to the model's answer."""
+    answer = answer.lower()
+    if 'yes' in answer:
+        return True
+    return False
+
+def query_gemini_images(images, prompt):
+    """Ask Gemini a prompt about one or more images in one request. Returns the raw answer text; raises on failure."""
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY not set")
+    client = get_gemini_client(api_key)
+    contents = [prompt]
+    contents.extend(types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg') for image_bytes in images)
+    response = client.models.generate_content(model=GEMINI_MODEL_NAME, contents=contents)
+    return response.text or ''
+
+def query_local_gemma3_images(images, prompt):
+    """Ask the OpenWebUI Gemma3 server a prompt about one or more images in one chat message. Raises on failure."""
+    import base64
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    if not LOCAL_GEMMA3_URL:
+        raise RuntimeError("LOCAL_GEMMA3_URL not set")
+
+    content = [{"type": "text", "text": prompt}]
+    for image_bytes in images:
+        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}})
+    payload = {
+        "model": "gemma3:latest",
+        "messages": [{"role": "user", "content": content}],
+        "stream": False,
+        "temperature": 0.1,
+        "max_tokens": 200 * len(images)
+    }
+    headers = {'Content-Type': 'application/json'}
+    if LOCAL_GEMMA3_API_KEY:
+        headers['Authorization'] = f'Bearer {LOCAL_GEMMA3_API_KEY}'
+
+    # WARNING: verify=False disables SSL certificate validation (see detect_persons_local_gemma3)
+    resp = http_pool.post(f"{LOCAL_GEMMA3_URL}/api/chat/completions", json=payload, headers=headers,
+                         timeout=(LOCAL_GEMMA3_CONNECT_TIMEOUT, 30 + 10 * len(images)), verify=False)
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code} error from local Gemma3 server: {resp.text}")
+    return resp.json()['choices'][0]['message']['content'].strip()
+
+# --- Inference client: circuit breakers, bounded concurrency, hedging and failover ---
+INFERENCE_FAILURE_THRESHOLD = int(os.environ.get('INFERENCE_FAILURE_THRESHOLD', '3'))  # Consecutive failures that open a breaker
+INFERENCE_RESET_TIMEOUT = float(os.environ.get('INFERENCE_RESET_TIMEOUT', '60'))  # Seconds a breaker stays open before a probe
+INFERENCE_MAX_CONCURRENCY = int(os.environ.get('INFERENCE_MAX_CONCURRENCY', '2'))  # In-flight requests per backend
+INFERENCE_QUEUE_TIMEOUT = float(os.environ.get('INFERENCE_QUEUE_TIMEOUT', '30'))  # Max wait for a free backend slot
+INFERENCE_HEDGE_DELAY = float(os.environ.get('INFERENCE_HEDGE_DELAY', '0'))  # Start a request on the fallback after this long; 0 disables
+# Fall back to another configured backend when the selected one fails. Off by default: frames
+# should only go to a backend the user chose.
+AI_FAILOVER = os.environ.get('AI_FAILOVER', 'false').lower() == 'true'
+
+class CircuitBreaker:
+    """
+    Closed: requests flow. After failure_threshold consecutive failures it opens and
+    rejects requests for reset_timeout seconds, then lets a single half-open probe
+    through; the probe's outcome closes or re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=INFERENCE_FAILURE_THRESHOLD, reset_timeout=INFERENCE_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self.probe_in_flight = False
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                person_logger.info(f"🔌 {self.name} circuit half-open, sending a probe request")
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                person_logger.info(f"🔌 {self.name} circuit closed again")
+            self.state = 'closed'
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def cancel_probe(self):
+        with self.lock:
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state = 'open'
+                self.opened_at = time.time()
+                self.times_opened += 1
+                person_logger.warning(f"🔌 {self.name} circuit opened after {self.failures} failures, "
+                                      f"retrying in {self.reset_timeout:.0f}s")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'retry_in': round(max(0, self.opened_at + self.reset_timeout - time.time()), 1) if self.state == 'open' else None
+            }
+
+class BackendBusy(Exception):
+    """No free concurrency slot for a backend within INFERENCE_QUEUE_TIMEOUT."""
+
+class InferenceClient:
+    """
+    Runs detection requests against the AI backends. The selected backend (AI_MODEL_TYPE)
+    goes first; with AI_FAILOVER the other one is used when the first fails, its breaker is
+    open, or (hedging) it has not answered within INFERENCE_HEDGE_DELAY seconds.
+    """
+
+    BACKEND_LABELS = {'gemini': 'Google Gemini', 'local_gemma3': 'Local Gemma3', 'local_dnn': 'Local DNN'}
+
+    def __init__(self, max_concurrency=INFERENCE_MAX_CONCURRENCY):
+        self.backends = {
+            'gemini': detect_persons_google_ai,
+            'local_gemma3': detect_persons_local_gemma3,
+            'local_dnn': detect_persons_local_dnn
+        }
+        # Free-form prompts over several images (batches, captions); the local detector can't answer those
+        self.query_backends = {
+            'gemini': query_gemini_images,
+            'local_gemma3': query_local_gemma3_images
+        }
+        self.breakers = {name: CircuitBreaker(self.BACKEND_LABELS[name]) for name in self.backends}
+        self.slots = {name: threading.BoundedSemaphore(max_concurrency) for name in self.backends}
+        self.executor = ThreadPoolExecutor(max_workers=2 * max_concurrency * len(self.backends),
+                                           thread_name_prefix='inference')
+        self.counters = {name: {'requests': 0, 'failures': 0, 'busy': 0, 'in_flight': 0, 'bytes_sent': 0} for name in self.backends}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.lock = threading.Lock()
+
+    def backend_order(self):
+        primary = AI_MODEL_TYPE if AI_MODEL_TYPE in self.backends else 'gemini'
+        order = [primary]
+        if AI_FAILOVER:
+            for name in self.backends:
+                if name != primary and self.is_configured(name):
+                    order.append(name)
+        return order
+
+    @staticmethod
+    def is_configured(name):
+        if name == 'gemini':
+            return bool(os.environ.get('GEMINI_API_KEY'))
+        if name == 'local_gemma3':
+            return LOCAL_GEMMA3_CONFIGURED and bool(LOCAL_GEMMA3_URL)
+        if name == 'local_dnn':
+            return local_person_detector.available()
+        return False
+
+    def _count(self, name, key, delta=1):
+        with self.lock:
+            self.counters[name][key] += delta
+
+    def _call(self, name, func, *args):
+        """Run one backend call inside its concurrency slot and feed the outcome to its breaker."""
+        slot = self.slots[name]
+        if not slot.acquire(timeout=INFERENCE_QUEUE_TIMEOUT):
+            self._count(name, 'busy')
+            # A half-open probe that never ran must not block the breaker
+            self.breakers[name].cancel_probe()
+            raise BackendBusy(f"{self.BACKEND_LABELS[name]} has {INFERENCE_MAX_CONCURRENCY} requests in flight")
+        self._count(name, 'requests')
+        self._count(name, 'in_flight')
+        try:
+            result = func(*args)
+        except Exception:
+            self._count(name, 'failures')
+            self.breakers[name].record_failure()
+            raise
+        finally:
+            self._count(name, 'in_flight', -1)
+            slot.release()
+        return result
+
+    def _detect_on(self, name, image_bytes):
+        person_logger.info(f"Using {self.BACKEND_LABELS[name]} for person detection")
+        if name in self.query_backends:
+            self._count(name, 'bytes_sent', len(image_bytes))
+        result = self._call(name, self.backends[name], image_bytes)
+        if is_detection_error(result[2]):
+            self._count(name, 'failures')
+            self.breakers[name].record_failure()
+        else:
+            self.breakers[name].record_success()
+        return result
+
+    def _next_backend(self, candidates):
+        """Pop candidates until one whose breaker admits a request; None if none do."""
+        while candidates:
+            name = candidates.pop(0)
+            if self.breakers[name].allow_request():
+                return name
+            person_logger.debug(f"Skipping {self.BACKEND_LABELS[name]}: circuit open")
+        return None
+
+    def detect(self, image_bytes):
+        """
+        Returns:
+            Tuple: (is_person_detected: bool, annotated_image_bytes: bytes, response_text: str)
+        """
+        candidates = self.backend_order()
+        first = candidates[0]
+        last_result = (False, image_bytes, "ERROR: no AI backend available (circuit open)")
+        pending = {}
+        hedge_name = None
+
+        name = self._next_backend(candidates)
+        if name is None:
+            person_logger.warning("⚡ All AI backends are unavailable, skipping detection")
+            return last_result
+        if name != first:
+            with self.lock:
+                self.failovers += 1
+        pending[self.executor.submit(self._detect_on, name, image_bytes)] = name
+
+        while pending:
+            hedge_delay = INFERENCE_HEDGE_DELAY if candidates and INFERENCE_HEDGE_DELAY > 0 else None
+            done, _ = wait(list(pending), timeout=hedge_delay, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Slow answer: hedge with the next backend and take whichever succeeds first
+                name = self._next_backend(candidates)
+                if name is not None:
+                    person_logger.info(f"⏱️ No answer after {INFERENCE_HEDGE_DELAY:.0f}s, hedging with {self.BACKEND_LABELS[name]}")
+                    with self.lock:
+                        self.hedges += 1
+                    hedge_name = name
+                    pending[self.executor.submit(self._detect_on, name, image_bytes)] = name
+                continue
+
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    person_logger.error(f"{self.BACKEND_LABELS[name]} detection failed: {e}")
+                    result = (False, image_bytes, f"ERROR: {self.BACKEND_LABELS[name]} unavailable: {e}")
+                if not is_detection_error(result[2]):
+                    if name == hedge_name:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    return result
+                last_result = result
+
+            if not pending:
+                # Every request so far failed: fail over to the next healthy backend
+                name = self._next_backend(candidates)
+                if name is not None:
+                    person_logger.warning(f"🔀 Failing over to {self.BACKEND_LABELS[name]}")
+                    with self.lock:
+                        self.failovers += 1
+                    pending[self.executor.submit(self._detect_on, name, image_bytes)] = name
+
+        return last_result
+
+    def detect_batch(self, images):
+        """Run a batched presence request. Returns the raw answer text; raises if all backends fail."""
+        return self.query(images, BATCH_DETECTION_PROMPT.format(count=len(images)))
+
+    def query(self, images, prompt):
+        """Send a prompt with images to the LLM backends, failing over between them. Raises if all fail."""
+        order = self.backend_order()
+        if AI_MODEL_TYPE == 'local_dnn':
+            # Captions and batches still need an LLM: use any configured one
+            order += [name for name in self.query_backends if name not in order and self.is_configured(name)]
+        candidates = [name for name in order if name in self.query_backends]
+        errors = []
+        while True:
+            name = self._next_backend(candidates)
+            if name is None:
+                break
+            try:
+                self._count(name, 'bytes_sent', sum(len(image_bytes) for image_bytes in images))
+                response_text = self._call(name, self.query_backends[name], images, prompt)
+                self.breakers[name].record_success()
+                return response_text
+            except Exception as e:
+                errors.append(f"{self.BACKEND_LABELS[name]}: {e}")
+        raise RuntimeError("; ".join(errors) or "no AI backend available (circuit open)")
+
+    def stats(self):
+        with self.lock:
+            backends = {name: dict(counters) for name, counters in self.counters.items()}
+            summary = {'hedges': self.hedges, 'hedge_wins': self.hedge_wins, 'failovers': self.failovers}
+        for name in backends:
+            backends[name]['circuit'] = self.breakers[name].stats()
+            backends[name]['configured'] = self.is_configured(name)
+        summary.update({'order': self.backend_order(), 'failover_enabled': AI_FAILOVER, 'backends': backends})
+        return summary
+
+inference_client = InferenceClient()
+
+def detect_persons_batch(items):
+    """
+    Detect persons in frames from several cameras with one AI request.
+
+    Cached results are reused for cameras whose frame allows it; frames the model did
+    not answer for are retried one by one.
+
+    Args:
+        items: List of (camera_id, image_bytes, use_cache).
+
+    Returns:
+        dict: camera_id -> (is_person_detected: bool, annotated_image_bytes: bytes, response_text: str)
+    """
+    results = {}
+    pending = []
+    for camera_id, image_bytes, use_cache in items:
+        dhash = None
+        if use_cache:
+            dhash, cached = lookup_cached_detection(camera_id, image_bytes)
+            if cached:
+                results[camera_id] = cached
+                continue
+        local_result = run_local_stage(image_bytes)
+        if local_result is not None:
+            results[camera_id] = local_result
+            remember_detection(camera_id, image_bytes, local_result, dhash)
+        else:
+            pending.append((camera_id, image_bytes, dhash))
+
+    answers = {}
+    if len(pending) > 1 and AI_MODEL_TYPE != 'local_dnn':
+        try:
+            images = [image_bytes for _, image_bytes, _ in pending]
+            response_text = inference_client.detect_batch(images)
+            person_logger.info(f"Batched AI response for {len(images)} images: {response_text}")
+            answers = parse_batch_answers(response_text, len(images))
+        except Exception as e:
+            person_logger.error(f"Batched detection failed, falling back to one request per camera: {e}")
+
+    for index, (camera_id, image_bytes, dhash) in enumerate(pending, 1):
+        answer = answers.get(index)
+        if answer is None:
+            if len(pending) > 1:
+                person_logger.warning(f"No batched answer for {camera_id}, checking it on its own")
+            results[camera_id] = run_detection_backend(image_bytes)
+        else:
+            results[camera_id] = (interpret_detection_answer(answer), annotate_timestamp(image_bytes), answer)
+        remember_detection(camera_id, image_bytes, results[camera_id], dhash)
+
+    return results
+
+def prepare_detection_check(camera_id):
+    """
+    First stage of a detection check: fetch, rotate and motion-gate a snapshot.
+
+    Must be called with the camera's detection lock held.
+
+    Returns:
+        dict: Context for apply_detection_result(), or None if the AI should not be called this time.
+    """
+    global person_detection_state
+
+    current_time = time.time()
+    current_datetime = datetime.datetime.now()
+
+    person_logger.info(f"Starting person detection check for {camera_id}")
+
+    # Ensure camera config is available
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
+        person_logger.warning(f"Camera {camera_id} not connected. Skipping detection check.")
+        return None
+
+    capture_url = camera_config.get('capture_url')
+
+    if not capture_url:
+        person_logger.error(f"Capture URL not configured for {camera_id}. Skipping detection check.")
+        return None
+
+    # Initialize state if not present
+    if camera_id not in person_detection_state:
+        person_detection_state[camera_id] = {
+            'person_present': False,
+            'last_detection': None,
+            'first_detection': None,
+            'detection_count': 0,
+            'session_start': None,
+            'total_detection_time': 0,
+            'last_check_time': current_time,
+            'last_image_save_time': None  # Track when we last saved an image
+        }
+        person_logger.info(f"Initialized detection state for {camera_id}")
+
+    state = person_detection_state[camera_id]
+    was_present = state['person_present']
+    image_bytes = None
+
+    # Log check attempt
+    person_logger.debug(f"Fetching snapshot from {camera_id} at {capture_url}")
+
+    # Fetch the snapshot
+    snapshot_start_time = time.time()
+    try:
+        resp = http_pool.get(capture_url, timeout=5)
+        snapshot_duration = time.time() - snapshot_start_time
+
+        if resp.status_code == 200:
+            image_bytes = resp.content
+            person_logger.debug(f"Successfully fetched snapshot from {camera_id} ({len(image_bytes)} bytes in {snapshot_duration:.2f}s)")
+        else:
+            person_logger.error(f"HTTP {resp.status_code} error getting snapshot from {camera_id} ({capture_url})")
+            return None # Cannot proceed without image
+    except requests.exceptions.RequestException as e:
+        snapshot_duration = time.time() - snapshot_start_time
+        person_logger.error(f"Network error fetching snapshot for {camera_id} after {snapshot_duration:.2f}s: {e}")
+        return None # Cannot proceed without image
+
+    if not image_bytes:
+        return None
+
+    # Apply per-camera rotation to the raw snapshot before AI detection to keep orientation consistent
+    rotation = camera_settings.get(camera_id, {}).get('rotation', 'none')
+    image_bytes = rotate_jpeg(image_bytes, rotation)
+    snapshot_cache.put(camera_id, image_bytes)
+
+    region_mask = get_region_mask(camera_id, *REGION_CHECK_SIZE)
+    if region_mask is not None and not np.count_nonzero(region_mask):
+        person_logger.warning(f"Detection regions for {camera_id} exclude the whole frame - skipping detection")
+        state['last_check_time'] = current_time
+        return None
+
+    # Only call the AI when the scene changed. While a person is present every check
+    # goes through, so a departure is noticed even if the person was standing still.
+    escalate, change_ratio, gate_reason = motion_gate.check(camera_id, image_bytes, force=was_present)
+    if not escalate:
+        person_logger.info(f"🟰 No significant change on {camera_id} ({change_ratio:.2%} of pixels) - skipping AI detection")
+        state['last_check_time'] = current_time
+        return None
+
+    # Mask / crop / downscale / re-encode once for every backend; the saved evidence image
+    # is made from the full rotated frame
+    ai_image_bytes = preprocess_for_ai(camera_id, image_bytes)
+
+    return {
+        'camera_id': camera_id,
+        'image_bytes': image_bytes,
+        'ai_image_bytes': ai_image_bytes,
+        'current_time': current_time,
+        'current_datetime': current_datetime,
+        'snapshot_duration': snapshot_duration,
+        'was_present': was_present,
+        'gate_reason': gate_reason,
+        'change_ratio': change_ratio
+    }
+
+detection_store = DetectionStore(DETECTION_DB_FILE)
+
+def thumbnail_path(rel_path, size_name):
+    return os.path.join(THUMBNAIL_DIR, size_name, rel_path)
+
+def create_thumbnails(rel_path, image_bytes):
+    """Write every THUMBNAIL_SIZES variant of a saved detection image."""
+    for size_name in THUMBNAIL_SIZES:
+        write_thumbnail(rel_path, size_name, image_bytes)
+
+def write_thumbnail(rel_path, size_name, image_bytes):
+    """Downscale and write one thumbnail atomically. Returns its path, or None on failure."""
+    path = thumbnail_path(rel_path, size_name)
+    thumbnail = resize_jpeg(image_bytes, THUMBNAIL_SIZES[size_name], quality=THUMBNAIL_JPEG_QUALITY)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so a concurrent request never serves a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(thumbnail)
+        os.replace(temp_path, path)
+        return path
+    except OSError as e:
+        person_logger.error(f"Failed to write thumbnail {path}: {e}")
+        return None
+
+def get_thumbnail(rel_path, size_name):
+    """Path of a thumbnail, generating it from the original on first request. None if the original is missing."""
+    path = thumbnail_path(rel_path, size_name)
+    if os.path.isfile(path):
+        return path
+    try:
+        with open(os.path.join(PERSON_IMAGE_DIR, rel_path), 'rb') as f:
+            image_bytes = f.read()
+    except OSError:
+        return None
+    return write_thumbnail(rel_path, size_name, image_bytes)
+
+def detection_image_etag(file_path, file_stat):
+    """
+    Strong ETag for a saved image or thumbnail. Files are never modified in place (names are
+    unique and thumbnails are replaced atomically), so path, size and mtime identify the bytes.
+    """
+    key = f"{file_path}:{file_stat.st_size}:{file_stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()[:32]
+
+def delete_thumbnails(rel_path):
+    for size_name in THUMBNAIL_SIZES:
+        try:
+            os.remove(thumbnail_path(rel_path, size_name))
+        except FileNotFoundError:
+            pass
+
+def move_thumbnails(old_rel_path, new_rel_path):
+    for size_name in THUMBNAIL_SIZES:
+        new_path = thumbnail_path(new_rel_path, size_name)
+        try:
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.replace(thumbnail_path(old_rel_path, size_name), new_path)
+        except FileNotFoundError:
+            pass
+
+def resolve_detection_image(filename):
+    """Path of a saved image relative to PERSON_IMAGE_DIR (images saved before sharding may still be flat)."""
+    row = detection_store.get(filename)
+    if row is None:
+        return filename
+    rel_path = image_rel_path(row)
+    if not os.path.exists(os.path.join(PERSON_IMAGE_DIR, rel_path)):
+        # Compaction may have moved the file a moment before updating the index
+        sharded = shard_path(row['camera_id'], row['timestamp'], filename)
+        if os.path.exists(os.path.join(PERSON_IMAGE_DIR, sharded)):
+            return sharded
+    return rel_path
+
+def prune_empty_dirs(root, rel_dirs):
+    """Remove now-empty shard directories (day, then camera) below root."""
+    for rel_dir in sorted(rel_dirs, key=len, reverse=True):
+        while rel_dir:
+            try:
+                os.rmdir(os.path.join(root, rel_dir))
+            except OSError:
+                break  # Not empty (or already gone)
+            rel_dir = os.path.dirname(rel_dir)
+
+def delete_detection_images(rows):
+    """
+    Delete saved images with their AI response, thumbnails and index rows.
+
+    Returns:
+        Tuple: (files_deleted, bytes_freed, errors)
+    """
+    files_deleted = 0
+    bytes_freed = 0
+    errors = []
+    deleted = []
+    rel_dirs = set()
+    for row in rows:
+        rel_path = image_rel_path(row)
+        try:
+            for path in (os.path.join(PERSON_IMAGE_DIR, rel_path), os.path.join(PERSON_IMAGE_DIR, response_rel_path(rel_path))):
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    files_deleted += 1
+                    bytes_freed += size
+                except FileNotFoundError:
+                    pass
+        except OSError as e:
+            errors.append(f"Failed to delete {row['filename']}: {e}")
+            continue
+        delete_thumbnails(rel_path)
+        deleted.append(row['filename'])
+        rel_dirs.add(os.path.dirname(rel_path))
+
+    detection_store.delete_many(deleted)
+    prune_empty_dirs(PERSON_IMAGE_DIR, rel_dirs)
+    for size_name in THUMBNAIL_SIZES:
+        prune_empty_dirs(os.path.join(THUMBNAIL_DIR, size_name), rel_dirs)
+    return files_deleted, bytes_freed, errors
+
+class DetectionRetention:
+    """
+    Keeps PERSON_IMAGE_DIR within the retention limits and moves images saved before
+    sharding out of the flat directory.
+
+    Runs on its own thread and works in small batches (oldest images first) with a pause
+    between them, so a large cleanup never holds up the detection threads or the index.
+    """
+
+    def __init__(self, max_age_days, max_mb_per_camera, max_images_per_camera, batch_size, batch_pause):
+        self.max_age = max_age_days * 24 * 3600
+        self.max_bytes = int(max_mb_per_camera * 1024 * 1024)
+        self.max_count = max_images_per_camera
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.lock = threading.Lock()
+        self.passes = 0
+        self.last_pass = None
+        self.last_duration = None
+        self.last_error = None
+        self.deleted_images = 0
+        self.deleted_bytes = 0
+        self.compacted = 0
+        self.camera_deleted = collections.Counter()
+
+    def enabled(self):
+        return bool(self.max_age or self.max_bytes or self.max_count)
+
+    def compact(self):
+        """Move flat images into their camera/day shard. Returns the number moved."""
+        total = 0
+        while True:
+            moved, dropped = detection_store.compact(PERSON_IMAGE_DIR, limit=self.batch_size)
+            for filename, old_rel_path, new_rel_path in moved:
+                move_thumbnails(old_rel_path, new_rel_path)
+            total += len(moved)
+            with self.lock:
+                self.compacted += len(moved)
+            if len(moved) + dropped < self.batch_size:
+                return total
+            time.sleep(self.batch_pause)
+
+    def enforce(self):
+        """Delete images outside the retention limits. Returns (images, bytes) deleted."""
+        total_images = 0
+        total_bytes = 0
+        for camera_id in detection_store.usage():
+            while True:
+                rows = detection_store.expired(camera_id, max_age=self.max_age, max_count=self.max_count,
+                                               max_bytes=self.max_bytes, limit=self.batch_size)
+                if not rows:
+                    break
+                files_deleted, bytes_freed, errors = delete_detection_images(rows)
+                for error in errors:
+                    person_logger.error(error)
+                deleted = len(rows) - len(errors)
+                total_images += deleted
+                total_bytes += bytes_freed
+                with self.lock:
+                    self.deleted_images += deleted
+                    self.deleted_bytes += bytes_freed
+                    self.camera_deleted[camera_id] += deleted
+                if errors or len(rows) < self.batch_size:
+                    break  # Don't spin on files that can't be deleted; retry next pass
+                time.sleep(self.batch_pause)
+        return total_images, total_bytes
+
+    def run_once(self):
+        start_time = time.time()
+        try:
+            compacted = self.compact()
+            if compacted:
+                person_logger.info(f"🗄️ Moved {compacted} detection images into camera/day directories")
+            if self.enabled():
+                images, freed = self.enforce()
+                if images:
+                    person_logger.info(f"🧹 Retention deleted {images} detection images ({freed / (1024 * 1024):.1f} MB)")
+            error = None
+        except Exception as e:
+            error = str(e)
+            person_logger.error(f"Detection image retention pass failed: {e}")
+        with self.lock:
+            self.passes += 1
+            self.last_pass = start_time
+            self.last_duration = round(time.time() - start_time, 2)
+            self.last_error = error
+
+    def run_forever(self):
+        while True:
+            self.run_once()
+            time.sleep(RETENTION_INTERVAL)
+
+    def stats(self):
+        cameras = {}
+        for camera_id, usage in detection_store.usage().items():
+            cameras[camera_id] = {
+                'images': usage['count'],
+                'mb': round(usage['bytes'] / (1024 * 1024), 1),
+                'oldest': datetime.datetime.fromtimestamp(usage['oldest']).isoformat() if usage['oldest'] else None,
+                'newest': datetime.datetime.fromtimestamp(usage['newest']).isoformat() if usage['newest'] else None,
+                'deleted': self.camera_deleted.get(camera_id, 0)
+            }
+        try:
+            disk = shutil.disk_usage(PERSON_IMAGE_DIR)
+            disk = {'total_gb': round(disk.total / 1024 ** 3, 1), 'used_gb': round(disk.used / 1024 ** 3, 1),
+                    'free_gb': round(disk.free / 1024 ** 3, 1), 'used_percent': round(disk.used / disk.total * 100, 1)}
+        except OSError:
+            disk = None
+        with self.lock:
+            return {
+                'policy': {
+                    'max_age_days': self.max_age / (24 * 3600) or None,
+                    'max_mb_per_camera': self.max_bytes / (1024 * 1024) or None,
+                    'max_images_per_camera': self.max_count or None
+                },
+                'passes': self.passes,
+                'last_pass': datetime.datetime.fromtimestamp(self.last_pass).isoformat() if self.last_pass else None,
+                'last_duration': self.last_duration,
+                'last_error': self.last_error,
+                'deleted_images': self.deleted_images,
+                'deleted_mb': round(self.deleted_bytes / (1024 * 1024), 1),
+                'compacted': self.compacted,
+                'total_images': sum(camera['images'] for camera in cameras.values()),
+                'total_mb': round(sum(camera['mb'] for camera in cameras.values()), 1),
+                'cameras': cameras,
+                'disk': disk
+            }
+
+detection_retention = DetectionRetention(RETENTION_MAX_AGE_DAYS, RETENTION_MAX_MB_PER_CAMERA, RETENTION_MAX_IMAGES_PER_CAMERA,
+                                         RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE)
+
+def backfill_detection_index():
+    """Index images saved before the detection index existed (or while it was unavailable)."""
+    try:
+        start_time = time.time()
+        added, removed = detection_store.reindex(PERSON_IMAGE_DIR)
+        if added or removed:
+            person_logger.info(f"🗂️ Detection index updated in {time.time() - start_time:.1f}s: {added} added, {removed} removed")
+    except Exception as e:
+        person_logger.error(f"Failed to reindex {PERSON_IMAGE_DIR}: {e}")
+
+def maintain_detection_images():
+    """Catch up the index with the files on disk, then keep applying retention in the background."""
+    backfill_detection_index()
+    detection_retention.run_forever()
+
+def save_detection_files(image_path, image_bytes, response_path, response_text):
+    """Write a detection image and its AI response into their shard directory."""
+    for attempt in range(2):
+        try:
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            with open(image_path, 'wb') as f:
+                f.write(image_bytes)
+            with open(response_path, 'w', encoding='utf-8') as f:
+                f.write(response_text)
+            return
+        except FileNotFoundError:
+            # Retention or delete-all pruned the (then empty) directory right after makedirs
+            if attempt:
+                raise
+
+def apply_detection_result(context, is_present, annotated_image_bytes, response_text, detection_duration):
+    """Second stage of a detection check: update the camera's presence state and save images on change."""
+    camera_id = context['camera_id']
+    current_time = context['current_time']
+    current_datetime = context['current_datetime']
+    snapshot_duration = context['snapshot_duration']
+    was_present = context['was_present']
+    state = person_detection_state[camera_id]
+
+    person_logger.info(f"AI detection completed for {camera_id} in {detection_duration:.2f}s - Result: {'PERSON DETECTED' if is_present else 'NO PERSON'}")
+    
+    if is_present:
+        person_logger.info(f"Detected person(s)")
+
+    # Update statistics
+    time_since_last_check = current_time - state['last_check_time']
+    state['last_check_time'] = current_time
+
+    # Compare with previous state and handle state changes
+    if is_present and not was_present:
+        # Person just appeared
+        state['person_present'] = True
+        state['first_detection'] = current_time
+        state['last_detection'] = current_time
+        state['detection_count'] += 1
+        state['session_start'] = current_time
+
+        person_logger.info(f"a PERSON DETECTED on {camera_id} - Session #{state['detection_count']} started")
+        person_logger.info(f"Detection timing - Snapshot: {snapshot_duration:.2f}s, AI: {detection_duration:.2f}s, Total: {snapshot_duration + detection_duration:.2f}s")
+
+        # Always save image when person first appears
+        should_save_image = True
+        save_reason = "Person first detected"
+
+    elif not is_present and was_present:
+        # Person just disappeared
+        if state['session_start']:
+            session_duration = current_time - state['session_start']
+            state['total_detection_time'] += session_duration
+
+            person_logger.info(f"🚶‍♂️ PERSON LEFT {camera_id} - Session duration: {session_duration:.1f}s ({session_duration/60:.1f} minutes)")
+            person_logger.info(f"📊 Camera {camera_id} stats - Total sessions: {state['detection_count']}, Total time: {state['total_detection_time']:.1f}s ({state['total_detection_time']/60:.1f} minutes)")
+
+        state['person_present'] = False
+        state['session_start'] = None
+        should_save_image = False  # Don't save when person leaves
+
+    elif is_present and was_present:
+        # Person still present - update last detection time
+        state['last_detection'] = current_time
+        if state['session_start']:
+            current_session_duration = current_time - state['session_start']
+            person_logger.debug(f"👁️ Person still present on {camera_id} - Current session: {current_session_duration:.1f}s")
+
+        # Check if we should save another image (rate limited)
+        last_save_time = state.get('last_image_save_time', 0)
+        time_since_last_save = current_time - (last_save_time or 0)
+
+        if time_since_last_save >= MIN_IMAGE_SAVE_INTERVAL:
+            should_save_image = True
+            save_reason = f"Continuous presence - {time_since_last_save:.0f}s since last save"
+        else:
+            should_save_image = False
+
     else:
-        person_logger.info("Using Google Gemini for person detection")
-        return detect_persons_google_ai(image_bytes)
+        # No person detected and none was present before
+        person_logger.debug(f"👀 No person detected on {camera_id} - Status unchanged")
+        should_save_image = False
+
+    # Save image if needed (when person is present and conditions are met)
+    if should_save_image and is_present:
+        # Create directory if it doesn't exist
+        if not os.path.exists(PERSON_IMAGE_DIR):
+            try:
+                os.makedirs(PERSON_IMAGE_DIR)
+                person_logger.info(f"Created detection images directory: {PERSON_IMAGE_DIR}")
+            except OSError as e:
+                person_logger.error(f"Failed to create directory {PERSON_IMAGE_DIR}: {e}")
+                return
+
+        # Generate unique filename, stored under the camera's directory for the day
+        unique_id = uuid.uuid4()
+        timestamp = current_datetime.strftime("%Y%m%d_%H%M%S")
+        rel_path = shard_path(camera_id, current_datetime, f"{camera_id}_{timestamp}_{unique_id}.jpg")
+        filename = os.path.join(PERSON_IMAGE_DIR, rel_path)
+        response_filename = os.path.join(PERSON_IMAGE_DIR, response_rel_path(rel_path))
+
+        # Save the annotated image (with AI response overlay). When the AI got a masked, cropped
+        # or downscaled copy, save the full frame instead, stamped with the time; the AI's
+        # answer (including any local detector boxes) is kept in the response file.
+        if context['ai_image_bytes'] is context['image_bytes']:
+            image_to_save = annotated_image_bytes
+        else:
+            image_to_save = annotate_timestamp(context['image_bytes'])
+        try:
+            save_detection_files(filename, image_to_save, response_filename, response_text)
+
+            try:
+                detection_store.add(camera_id, current_datetime.replace(microsecond=0), os.path.basename(filename),
+                                    response_text, len(image_to_save), rel_path=rel_path)
+            except Exception as e:
+                # The file is on disk; a reindex picks it up later
+                person_logger.error(f"Failed to index detection image {filename}: {e}")
+
+            # Thumbnails for the gallery grid (missing ones are also generated on first request)
+            create_thumbnails(rel_path, image_to_save)
+
+            state['last_image_save_time'] = current_time  # Update last save time
+
+            person_logger.info(f"💾 Saved detection image: {filename} ({len(image_to_save)} bytes) - {save_reason}")
+            person_logger.info(f"💾 Saved AI response: {response_filename} - {response_text[:100]}{'...' if len(response_text) > 100 else ''}")
+        except IOError as e:
+            person_logger.error(f"Failed to save detection files {filename}: {e}")
+
+    # FIXED: Log statistics with correct calculations - always show current totals when person is present
+    if is_present:
+        # When person is present, always show current statistics
+        if state['detection_count'] > 0:
+            avg_session_time = state['total_detection_time'] / state['detection_count'] if state['detection_count'] > 0 else 0
+            current_session_time = current_time - state['session_start'] if state['session_start'] else 0
+            total_time_including_current = state['total_detection_time'] + current_session_time
+            person_logger.info(f"📈 {camera_id} Statistics - Sessions: {state['detection_count']}, Current session: {current_session_time:.1f}s, Total time: {total_time_including_current:.1f}s")
+    elif state['detection_count'] % 10 == 0 and state['detection_count'] > 0:
+        # When no person present, log stats every 10th check
+        avg_session_time = state['total_detection_time'] / state['detection_count'] if state['detection_count'] > 0 else 0
+        person_logger.info(f"📈 {camera_id} Statistics - Sessions: {state['detection_count']}, Avg session: {avg_session_time:.1f}s, Total time: {state['total_detection_time']:.1f}s")
+
 
 def check_camera_for_persons(camera_id):
     """Checks camera snapshot for persons and logs/saves image on change with comprehensive logging."""
@@ -1848,202 +3963,345 @@ def check_camera_for_persons(camera_id):
     with camera_lock:
         person_logger.debug(f"Acquired detection lock for {camera_id}")
         
-        global cameras, person_detection_state
-        
-        current_time = time.time()
-        current_datetime = datetime.datetime.now()
-        
-        person_logger.info(f"Starting person detection check for {camera_id}")
-
-        # Ensure camera config is available
-        if camera_id not in cameras:
-            person_logger.warning(f"Camera {camera_id} not found in current camera list. Attempting rescan...")
-            # Attempt a quick rescan, maybe it just connected
-            cameras = scan_for_cameras()
-            if camera_id not in cameras:
-                person_logger.error(f"Camera {camera_id} still not found after rescan. Skipping detection check.")
-                return
+        context = prepare_detection_check(camera_id)
+        if context is not None:
+            # Call detection function
+            detection_start_time = time.time()
+            person_logger.info(f"Running AI person detection for {camera_id} ({context['gate_reason']}, {context['change_ratio']:.2%} changed)")
+
+            is_present, annotated_image_bytes, response_text = detect_persons(context['ai_image_bytes'], camera_id=camera_id,
+                                                                              use_cache=detection_cache_allowed(context))
+            apply_detection_result(context, is_present, annotated_image_bytes, response_text, time.time() - detection_start_time)
+
+        person_logger.debug(f"Completed person detection check for {camera_id} - releasing lock")
 
-        camera_config = cameras[camera_id]
-        capture_url = camera_config.get('capture_url')
+def check_cameras_for_persons_batch(camera_ids):
+    """Run one detection check for several cameras, sending all their frames in a single AI request."""
+    locked = []
+    try:
+        for camera_id in camera_ids:
+            camera_lock = get_camera_lock(camera_id)
+            if camera_lock.acquire(blocking=False):
+                locked.append(camera_id)
+            else:
+                person_logger.warning(f"⏭️ {camera_id} is already being checked - leaving it out of this batch")
 
-        if not capture_url:
-            person_logger.error(f"Capture URL not configured for {camera_id}. Skipping detection check.")
+        # Snapshots are fetched concurrently; each camera's lock is held by this thread throughout
+        futures = {camera_id: detection_snapshot_executor.submit(prepare_detection_check, camera_id) for camera_id in locked}
+        contexts = []
+        for camera_id, future in futures.items():
+            try:
+                context = future.result()
+                if context is not None:
+                    contexts.append(context)
+            except Exception as e:
+                person_logger.error(f"❌ Error preparing detection for {camera_id}: {e}")
+
+        if not contexts:
             return
 
-        # Initialize state if not present
-        if camera_id not in person_detection_state:
-            person_detection_state[camera_id] = {
-                'person_present': False,
-                'last_detection': None,
-                'first_detection': None,
-                'detection_count': 0,
-                'session_start': None,
-                'total_detection_time': 0,
-                'last_check_time': current_time,
-                'last_image_save_time': None  # Track when we last saved an image
-            }
-            person_logger.info(f"Initialized detection state for {camera_id}")
+        detection_start_time = time.time()
+        person_logger.info(f"Running batched AI person detection for {len(contexts)} cameras: {', '.join(c['camera_id'] for c in contexts)}")
+        results = detect_persons_batch([(c['camera_id'], c['ai_image_bytes'], detection_cache_allowed(c)) for c in contexts])
+        detection_duration = time.time() - detection_start_time
+
+        for context in contexts:
+            try:
+                is_present, annotated_image_bytes, response_text = results[context['camera_id']]
+                apply_detection_result(context, is_present, annotated_image_bytes, response_text, detection_duration)
+            except Exception as e:
+                person_logger.error(f"❌ Error applying detection result for {context['camera_id']}: {e}")
+    finally:
+        for camera_id in locked:
+            get_camera_lock(camera_id).release()
+
+# --- Motion pre-filter ---
+# A cheap frame-differencing gate in front of the AI: each camera keeps a running-average
+# background of a small blurred grayscale frame, and the AI is only called when enough
+# pixels differ from it (or a forced re-check is due).
+MOTION_GATE_ENABLED = os.environ.get('MOTION_GATE_ENABLED', 'true').lower() == 'true'
+MOTION_GATE_WIDTH = 160            # Width of the analysed frame in pixels
+MOTION_PIXEL_THRESHOLD = int(os.environ.get('MOTION_PIXEL_THRESHOLD', '25'))        # Grey-level difference that counts as changed
+MOTION_CHANGE_THRESHOLD = float(os.environ.get('MOTION_CHANGE_THRESHOLD', '0.01'))  # Fraction of changed pixels that triggers the AI
+MOTION_FORCE_RECHECK_SECONDS = float(os.environ.get('MOTION_FORCE_RECHECK_SECONDS', '600'))  # Call the AI at least this often
+# The background adapts with time constant MOTION_BACKGROUND_TIME_CONSTANT seconds, whatever the check
+# cadence: each check blends in 1 - exp(-elapsed / time constant) of the new frame
+MOTION_BACKGROUND_TIME_CONSTANT = float(os.environ.get('MOTION_BACKGROUND_TIME_CONSTANT', '180'))
+# After this many checks in a row above MOTION_CHANGE_THRESHOLD the frame becomes the new background,
+# so a lighting change or a moved object stops escalating every check
+MOTION_BACKGROUND_RESET_CHECKS = int(os.environ.get('MOTION_BACKGROUND_RESET_CHECKS', '3'))
+
+class MotionGate:
+    """Per-camera background model deciding whether a frame is worth sending to detect_persons()."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}  # camera_id -> {'background': float32 array, 'last_escalation', 'last_update': float, 'changed_checks': int}
+        self.counters = {}  # camera_id -> {'escalated': int, 'suppressed': int}
+
+    def _prepare(self, image_bytes):
+        """Decode straight to a reduced grayscale frame, resize to MOTION_GATE_WIDTH and blur."""
+        geometry = get_jpeg_geometry(image_bytes)
+        flag = cv2.IMREAD_GRAYSCALE
+        if geometry is not None:
+            for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+                if geometry[0] // factor >= MOTION_GATE_WIDTH:
+                    flag = reduced_flag
+                    break
+        gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+        if gray is None:
+            return None
+        height = max(1, int(round(gray.shape[0] * MOTION_GATE_WIDTH / gray.shape[1])))
+        gray = cv2.resize(gray, (MOTION_GATE_WIDTH, height), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def check(self, camera_id, image_bytes, force=False):
+        """
+        Update the camera's background model with this frame and decide whether to escalate.
+
+        Returns:
+            Tuple: (escalate: bool, change_ratio: float, reason: str)
+        """
+        if not MOTION_GATE_ENABLED:
+            return True, 1.0, "motion gate disabled"
+
+        gray = self._prepare(image_bytes)
+        if gray is None:
+            return True, 1.0, "frame could not be analysed"
+
+        now = time.time()
+        with self.lock:
+            counters = self.counters.setdefault(camera_id, {'escalated': 0, 'suppressed': 0})
+            model = self.models.get(camera_id)
+            if model is None or model['background'].shape != gray.shape:
+                self.models[camera_id] = {'background': gray.astype(np.float32), 'last_escalation': now,
+                                          'last_update': now, 'changed_checks': 0}
+                counters['escalated'] += 1
+                return True, 1.0, "new background model"
+
+            background = model['background']
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(background))
+            mask = get_region_mask(camera_id, gray.shape[1], gray.shape[0])
+            if mask is None:
+                change_ratio = float(np.count_nonzero(diff > MOTION_PIXEL_THRESHOLD)) / diff.size
+            else:
+                # Only changes inside the camera's detection regions count
+                changed = np.count_nonzero((diff > MOTION_PIXEL_THRESHOLD) & (mask > 0))
+                change_ratio = float(changed) / max(1, np.count_nonzero(mask))
+            if change_ratio >= MOTION_CHANGE_THRESHOLD:
+                model['changed_checks'] += 1
+            else:
+                model['changed_checks'] = 0
+            if MOTION_BACKGROUND_RESET_CHECKS > 0 and model['changed_checks'] >= MOTION_BACKGROUND_RESET_CHECKS:
+                # The scene changed for good (or someone is standing still); start over from this frame
+                background[:] = gray
+                model['changed_checks'] = 0
+            else:
+                elapsed = now - model['last_update']
+                alpha = 1.0 - float(np.exp(-elapsed / MOTION_BACKGROUND_TIME_CONSTANT)) if MOTION_BACKGROUND_TIME_CONSTANT > 0 else 1.0
+                cv2.accumulateWeighted(gray.astype(np.float32), background, min(1.0, max(0.0, alpha)))
+            model['last_update'] = now
+
+            if force:
+                reason = "person present"
+            elif change_ratio >= MOTION_CHANGE_THRESHOLD:
+                reason = "motion"
+            elif now - model['last_escalation'] >= MOTION_FORCE_RECHECK_SECONDS:
+                reason = "periodic re-check"
+            else:
+                counters['suppressed'] += 1
+                return False, change_ratio, "no change"
+
+            model['last_escalation'] = now
+            counters['escalated'] += 1
+            return True, change_ratio, reason
 
-        state = person_detection_state[camera_id]
-        was_present = state['person_present']
-        is_present = False
-        image_bytes = None
+    def stats(self):
+        with self.lock:
+            return {camera_id: dict(counters) for camera_id, counters in self.counters.items()}
 
-        # Log check attempt
-        person_logger.debug(f"Fetching snapshot from {camera_id} at {capture_url}")
+motion_gate = MotionGate()
 
-        # Fetch the snapshot
-        snapshot_start_time = time.time()
+# --- Detection scheduling ---
+DETECTION_INTERVAL = float(os.environ.get('DETECTION_INTERVAL', '60'))  # Seconds between checks of one camera
+DETECTION_MAX_WORKERS = int(os.environ.get('DETECTION_MAX_WORKERS', '4'))  # Cameras checked concurrently
+DETECTION_DEADLINE = float(os.environ.get('DETECTION_DEADLINE', '45'))  # Seconds before a running check is reported as overdue
+DETECTION_SCHEDULER_TICK = 1  # Seconds between scheduler passes
+DETECTION_SUMMARY_INTERVAL = 3600  # Seconds between summary log entries
+
+# Snapshot fetches of batched checks (check_cameras_for_persons_batch); kept apart from the
+# camera discovery pool so detection load never delays a scan, and from the scheduler's pool,
+# whose workers wait on these
+detection_snapshot_executor = ThreadPoolExecutor(max_workers=DETECTION_MAX_WORKERS * max(1, DETECTION_BATCH_SIZE),
+                                                 thread_name_prefix='detection-snapshot')
+
+class DetectionScheduler:
+    """
+    Runs check_camera_for_persons for every registered camera on its own cadence.
+
+    Checks run on a bounded worker pool, so a slow camera or AI call only delays that camera.
+    A camera whose previous check is still running skips its tick instead of queueing another one.
+    """
+
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='person-detect')
+        self.lock = threading.Lock()
+        self.next_due = {}   # camera_id -> time the next check is due
+        self.running = {}    # camera_id -> {'future': Future, 'started': float or None while queued, 'overdue': bool}
+        self.camera_stats = {}
+
+    def interval_for(self, camera_id):
+        """Per-camera cadence from camera_settings, falling back to DETECTION_INTERVAL."""
         try:
-            resp = requests.get(capture_url, timeout=5)
-            snapshot_duration = time.time() - snapshot_start_time
-            
-            if resp.status_code == 200:
-                image_bytes = resp.content
-                person_logger.debug(f"Successfully fetched snapshot from {camera_id} ({len(image_bytes)} bytes in {snapshot_duration:.2f}s)")
-            else:
-                person_logger.error(f"HTTP {resp.status_code} error getting snapshot from {camera_id} ({capture_url})")
-                return # Cannot proceed without image
-        except requests.exceptions.RequestException as e:
-            snapshot_duration = time.time() - snapshot_start_time
-            person_logger.error(f"Network error fetching snapshot for {camera_id} after {snapshot_duration:.2f}s: {e}")
-            return # Cannot proceed without image
-
-        if image_bytes:
-            # Call detection function
-            detection_start_time = time.time()
-            person_logger.info(f"Running AI person detection for {camera_id}")
-            
-            # Apply per-camera rotation to the raw snapshot before AI detection to keep orientation consistent
-            try:
-                np_arr = np.frombuffer(image_bytes, np.uint8)
-                snapshot_image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-                if snapshot_image is not None:
-                    rotation = camera_settings.get(camera_id, {}).get('rotation', 'none')
-                    if rotation == '180':
-                        snapshot_image = cv2.rotate(snapshot_image, cv2.ROTATE_180)
-                    elif rotation == '90_right':
-                        snapshot_image = cv2.rotate(snapshot_image, cv2.ROTATE_90_CLOCKWISE)
-                    elif rotation == '90_left':
-                        snapshot_image = cv2.rotate(snapshot_image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-                    ret, buffer = cv2.imencode('.jpg', snapshot_image)
-                    if ret:
-                        image_bytes = buffer.tobytes()
-            except Exception:
-                pass
-
-            is_present, annotated_image_bytes, response_text = detect_persons(image_bytes)
-            
-            detection_duration = time.time() - detection_start_time
-            person_logger.info(f"AI detection completed for {camera_id} in {detection_duration:.2f}s - Result: {'PERSON DETECTED' if is_present else 'NO PERSON'}")
-            
-            if is_present:
-                person_logger.info(f"Detected person(s)")
-
-            # Update statistics
-            time_since_last_check = current_time - state['last_check_time']
-            state['last_check_time'] = current_time
-
-            # Compare with previous state and handle state changes
-            if is_present and not was_present:
-                # Person just appeared
-                state['person_present'] = True
-                state['first_detection'] = current_time
-                state['last_detection'] = current_time
-                state['detection_count'] += 1
-                state['session_start'] = current_time
-                
-                person_logger.info(f"a PERSON DETECTED on {camera_id} - Session #{state['detection_count']} started")
-                person_logger.info(f"Detection timing - Snapshot: {snapshot_duration:.2f}s, AI: {detection_duration:.2f}s, Total: {snapshot_duration + detection_duration:.2f}s")
-                
-                # Always save image when person first appears
-                should_save_image = True
-                save_reason = "Person first detected"
-                
-            elif not is_present and was_present:
-                # Person just disappeared
-                if state['session_start']:
-                    session_duration = current_time - state['session_start']
-                    state['total_detection_time'] += session_duration
-                    
-                    person_logger.info(f"🚶‍♂️ PERSON LEFT {camera_id} - Session duration: {session_duration:.1f}s ({session_duration/60:.1f} minutes)")
-                    person_logger.info(f"📊 Camera {camera_id} stats - Total sessions: {state['detection_count']}, Total time: {state['total_detection_time']:.1f}s ({state['total_detection_time']/60:.1f} minutes)")
-                
-                state['person_present'] = False
-                state['session_start'] = None
-                should_save_image = False  # Don't save when person leaves
-                
-            elif is_present and was_present:
-                # Person still present - update last detection time
-                state['last_detection'] = current_time
-                if state['session_start']:
-                    current_session_duration = current_time - state['session_start']
-                    person_logger.debug(f"👁️ Person still present on {camera_id} - Current session: {current_session_duration:.1f}s")
-                
-                # Check if we should save another image (rate limited)
-                last_save_time = state.get('last_image_save_time', 0)
-                time_since_last_save = current_time - (last_save_time or 0)
-                
-                if time_since_last_save >= MIN_IMAGE_SAVE_INTERVAL:
-                    should_save_image = True
-                    save_reason = f"Continuous presence - {time_since_last_save:.0f}s since last save"
+            return float(camera_settings.get(camera_id, {}).get('detection_interval', DETECTION_INTERVAL))
+        except (TypeError, ValueError):
+            return DETECTION_INTERVAL
+
+    def _stats(self, camera_id):
+        """A camera's counters. Call with self.lock held; workers update them while tick() and stats() read."""
+        return self.camera_stats.setdefault(camera_id, {
+            'checks': 0, 'skipped': 0, 'overruns': 0, 'errors': 0,
+            'last_duration': None, 'last_lag': 0.0, 'max_lag': 0.0, 'last_started': None
+        })
+
+    def tick(self, now=None):
+        """Dispatch every camera whose check is due. Returns the number of checks started."""
+        now = now or time.time()
+        camera_ids = list(camera_registry.cameras().keys())
+        due_cameras = {}  # camera_id -> time its check was due
+        with self.lock:
+            for camera_id in list(self.next_due):
+                if camera_id not in camera_ids and camera_id not in self.running:
+                    del self.next_due[camera_id]
+
+            for camera_id in camera_ids:
+                due = self.next_due.setdefault(camera_id, now)
+                if now < due:
+                    continue
+                stats = self._stats(camera_id)
+                interval = self.interval_for(camera_id)
+                # Keep the cadence anchored to the schedule, but never try to "catch up" missed ticks
+                self.next_due[camera_id] = due + interval if due + interval > now else now + interval
+
+                running = self.running.get(camera_id)
+                if (running and not running['future'].done()) or get_camera_lock(camera_id).locked():
+                    stats['skipped'] += 1
+                    person_logger.warning(f"⏭️ Skipping {camera_id} tick - previous check still running")
+                    continue
+
+                due_cameras[camera_id] = due
+
+            # With batching, cameras due in the same tick share one AI request
+            batch_size = max(1, DETECTION_BATCH_SIZE)
+            due_ids = list(due_cameras)
+            for i in range(0, len(due_ids), batch_size):
+                batch = {camera_id: due_cameras[camera_id] for camera_id in due_ids[i:i + batch_size]}
+                if len(batch) == 1:
+                    camera_id, due = next(iter(batch.items()))
+                    future = self.executor.submit(self._run_check, camera_id, due)
                 else:
-                    should_save_image = False
-                    
-            else:
-                # No person detected and none was present before
-                person_logger.debug(f"👀 No person detected on {camera_id} - Status unchanged")
-                should_save_image = False
-
-            # Save image if needed (when person is present and conditions are met)
-            if should_save_image and is_present:
-                # Create directory if it doesn't exist
-                if not os.path.exists(PERSON_IMAGE_DIR):
-                    try:
-                        os.makedirs(PERSON_IMAGE_DIR)
-                        person_logger.info(f"Created detection images directory: {PERSON_IMAGE_DIR}")
-                    except OSError as e:
-                        person_logger.error(f"Failed to create directory {PERSON_IMAGE_DIR}: {e}")
-                        return
-                
-                # Generate unique filename
-                unique_id = uuid.uuid4()
-                timestamp = current_datetime.strftime("%Y%m%d_%H%M%S")
-                filename = f"{PERSON_IMAGE_DIR}/{camera_id}_{timestamp}_{unique_id}.jpg"
-                response_filename = f"{PERSON_IMAGE_DIR}/{camera_id}_{timestamp}_{unique_id}.txt"
-
-                # Save the annotated image (with AI response overlay)
-                image_to_save = annotated_image_bytes
-                try:
-                    with open(filename, 'wb') as f:
-                        f.write(image_to_save)
-                    
-                    # Save the Gemini response text
-                    with open(response_filename, 'w', encoding='utf-8') as f:
-                        f.write(response_text)
-                    
-                    state['last_image_save_time'] = current_time  # Update last save time
-                    
-                    person_logger.info(f"💾 Saved detection image: {filename} ({len(image_to_save)} bytes) - {save_reason}")
-                    person_logger.info(f"💾 Saved AI response: {response_filename} - {response_text[:100]}{'...' if len(response_text) > 100 else ''}")
-                except IOError as e:
-                    person_logger.error(f"Failed to save detection files {filename}: {e}")
-
-            # FIXED: Log statistics with correct calculations - always show current totals when person is present
-            if is_present:
-                # When person is present, always show current statistics
-                if state['detection_count'] > 0:
-                    avg_session_time = state['total_detection_time'] / state['detection_count'] if state['detection_count'] > 0 else 0
-                    current_session_time = current_time - state['session_start'] if state['session_start'] else 0
-                    total_time_including_current = state['total_detection_time'] + current_session_time
-                    person_logger.info(f"📈 {camera_id} Statistics - Sessions: {state['detection_count']}, Current session: {current_session_time:.1f}s, Total time: {total_time_including_current:.1f}s")
-            elif state['detection_count'] % 10 == 0 and state['detection_count'] > 0:
-                # When no person present, log stats every 10th check
-                avg_session_time = state['total_detection_time'] / state['detection_count'] if state['detection_count'] > 0 else 0
-                person_logger.info(f"📈 {camera_id} Statistics - Sessions: {state['detection_count']}, Avg session: {avg_session_time:.1f}s, Total time: {state['total_detection_time']:.1f}s")
+                    future = self.executor.submit(self._run_batch, batch)
+                for camera_id in batch:
+                    # 'started' is set by the worker, so time spent queued doesn't count toward the deadline
+                    self.running[camera_id] = {'future': future, 'started': None, 'overdue': False}
+
+            # Report checks running past their deadline
+            for camera_id, running in self.running.items():
+                if (not running['future'].done() and not running['overdue'] and running['started'] is not None
+                        and now - running['started'] > DETECTION_DEADLINE):
+                    running['overdue'] = True
+                    self._stats(camera_id)['overruns'] += 1
+                    person_logger.warning(f"⌛ {camera_id} check exceeded its {DETECTION_DEADLINE:.0f}s deadline")
+        return len(due_cameras)
+
+    def _record_start(self, due_times, start_time):
+        """Record when a worker actually started checking; lag is measured from the due time, so queueing counts."""
+        with self.lock:
+            for camera_id, due in due_times.items():
+                stats = self._stats(camera_id)
+                stats['last_started'] = start_time
+                lag = start_time - due
+                stats['last_lag'] = round(lag, 2)
+                stats['max_lag'] = round(max(stats['max_lag'], lag), 2)
+                if lag > DETECTION_SCHEDULER_TICK * 2:
+                    person_logger.warning(f"⏰ {camera_id} check started {lag:.1f}s late (worker pool saturated?)")
+                running = self.running.get(camera_id)
+                if running is not None:
+                    running['started'] = start_time
+
+    def _record_finish(self, camera_ids, duration, failed):
+        with self.lock:
+            for camera_id in camera_ids:
+                stats = self._stats(camera_id)
+                stats['checks'] += 1
+                stats['last_duration'] = duration
+                if failed:
+                    stats['errors'] += 1
+
+    def _run_check(self, camera_id, due):
+        start_time = time.time()
+        self._record_start({camera_id: due}, start_time)
+        failed = False
+        try:
+            check_camera_for_persons(camera_id)
+        except Exception as camera_error:
+            failed = True
+            person_logger.error(f"❌ Error checking {camera_id}: {camera_error}")
+            # Log full traceback for debugging
+            import traceback
+            person_logger.error(f"📋 Full traceback: {traceback.format_exc()}")
+        finally:
+            duration = round(time.time() - start_time, 2)
+            self._record_finish([camera_id], duration, failed)
+            person_logger.debug(f"✅ {camera_id} check finished in {duration}s")
+
+    def _run_batch(self, due_times):
+        camera_ids = list(due_times)
+        start_time = time.time()
+        self._record_start(due_times, start_time)
+        failed = False
+        try:
+            check_cameras_for_persons_batch(camera_ids)
+        except Exception as batch_error:
+            failed = True
+            person_logger.error(f"❌ Error in batched check of {', '.join(camera_ids)}: {batch_error}")
+            # Log full traceback for debugging
+            import traceback
+            person_logger.error(f"📋 Full traceback: {traceback.format_exc()}")
+        finally:
+            duration = round(time.time() - start_time, 2)
+            self._record_finish(camera_ids, duration, failed)
+            person_logger.debug(f"✅ Batched check of {len(camera_ids)} cameras finished in {duration}s")
+
+    def stats(self):
+        with self.lock:
+            result = {}
+            for camera_id, stats in self.camera_stats.items():
+                running = self.running.get(camera_id)
+                result[camera_id] = dict(
+                    stats,
+                    interval=self.interval_for(camera_id),
+                    running=bool(running and not running['future'].done()),
+                    next_due_in=round(self.next_due[camera_id] - time.time(), 1) if camera_id in self.next_due else None
+                )
+            return result
+
+    def run_forever(self):
+        last_summary = time.time()
+        while True:
+            try:
+                self.tick()
+                if time.time() - last_summary >= DETECTION_SUMMARY_INTERVAL:
+                    last_summary = time.time()
+                    log_detection_summary()
+            except Exception as e:
+                person_logger.error(f"💥 Critical error in detection scheduler: {e}")
+                # Log full traceback for debugging
+                import traceback
+                person_logger.error(f"📋 Full traceback: {traceback.format_exc()}")
+            time.sleep(DETECTION_SCHEDULER_TICK)
 
-        person_logger.debug(f"Completed person detection check for {camera_id} - releasing lock")
+detection_scheduler = DetectionScheduler(DETECTION_MAX_WORKERS)
 
 def periodic_person_check():
     """Background task to periodically check cameras for persons with comprehensive logging."""
@@ -2088,147 +4346,227 @@ def periodic_person_check():
         person_logger.info(f"🔄 Starting periodic person detection service - PID: {current_pid}")
         person_logger.info("📋 Process monitoring disabled (psutil not available)")
     
-    check_count = 0
-    
-    while True:
-        try:
-            check_count += 1
-            person_logger.info(f"🔍 Starting detection cycle #{check_count} for all cameras (PID: {current_pid})")
-            
-            start_time = time.time()
-            
-            # Check each camera
-            cameras_checked = 0
-            for camera_id in ["camera1", "camera2"]:
-                try:
-                    check_camera_for_persons(camera_id)
-                    cameras_checked += 1
-                except Exception as camera_error:
-                    person_logger.error(f"❌ Error checking {camera_id} in cycle #{check_count}: {camera_error}")
-                    # Log full traceback for debugging
-                    import traceback
-                    person_logger.error(f"📋 Full traceback: {traceback.format_exc()}")
-                    
-            cycle_duration = time.time() - start_time
-            person_logger.info(f"✅ Completed detection cycle #{check_count} - Checked {cameras_checked}/2 cameras in {cycle_duration:.2f}s (PID: {current_pid})")
-            
-            # Log system stats every 12 cycles (1 hour)
-            if check_count % 12 == 0:
-                person_logger.info("📊 === HOURLY DETECTION SUMMARY ===")
-                for camera_id, state in person_detection_state.items():
-                    if state['detection_count'] > 0:
-                        avg_session = state['total_detection_time'] / state['detection_count']
-                        current_session_time = time.time() - state['session_start'] if state.get('session_start') else 0
-                        total_including_current = state['total_detection_time'] + current_session_time
-                        person_logger.info(f"📈 {camera_id}: {state['detection_count']} sessions, {total_including_current:.1f}s total, {avg_session:.1f}s avg")
-                    else:
-                        person_logger.info(f"📈 {camera_id}: No detections recorded")
-                person_logger.info("=================================")
-                        
-        except Exception as e:
-            person_logger.error(f"💥 Critical error in periodic person check cycle #{check_count}: {e}")
-            # Log full traceback for debugging
-            import traceback
-            person_logger.error(f"📋 Full traceback: {traceback.format_exc()}")
-            
-        # Wait 5 minutes (300 seconds) before next check
-        person_logger.info(f"💤 Sleeping for 1 minute before next detection cycle... (PID: {current_pid})")
-        time.sleep(60)
+    person_logger.info(f"🗓️ Detection scheduler: every {DETECTION_INTERVAL:.0f}s per camera, {DETECTION_MAX_WORKERS} workers, "
+                       f"{DETECTION_DEADLINE:.0f}s deadline, batches of {max(1, DETECTION_BATCH_SIZE)}")
+    detection_scheduler.run_forever()
+
+def log_detection_summary():
+    """Log per-camera session totals and scheduler statistics."""
+    person_logger.info("📊 === HOURLY DETECTION SUMMARY ===")
+    for camera_id, state in person_detection_state.items():
+        if state['detection_count'] > 0:
+            avg_session = state['total_detection_time'] / state['detection_count']
+            current_session_time = time.time() - state['session_start'] if state.get('session_start') else 0
+            total_including_current = state['total_detection_time'] + current_session_time
+            person_logger.info(f"📈 {camera_id}: {state['detection_count']} sessions, {total_including_current:.1f}s total, {avg_session:.1f}s avg")
+        else:
+            person_logger.info(f"📈 {camera_id}: No detections recorded")
+    for camera_id, counters in motion_gate.stats().items():
+        total = counters['escalated'] + counters['suppressed']
+        person_logger.info(f"🟰 {camera_id}: motion gate sent {counters['escalated']}/{total} frames to the AI")
+    cache_stats = detection_cache.stats()
+    person_logger.info(f"♻️ Detection cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    storage = detection_retention.stats()
+    person_logger.info(f"🗄️ Detection images: {storage['total_images']} images, {storage['total_mb']} MB, "
+                       f"{storage['deleted_images']} deleted by retention")
+    for camera_id, stats in detection_scheduler.stats().items():
+        person_logger.info(f"⏱️ {camera_id}: {stats['checks']} checks, {stats['skipped']} skipped, {stats['overruns']} overruns, "
+                           f"last {stats['last_duration']}s, max lag {stats['max_lag']}s")
+    person_logger.info("=================================")
+
+# Catch up the detection index with images already on disk, then apply retention
+detection_storage_thread = threading.Thread(target=maintain_detection_images, daemon=True)
+detection_storage_thread.start()
 
 # Start the background thread for person detection
 person_checker_thread = threading.Thread(target=periodic_person_check, daemon=True)
 person_checker_thread.start()
 
+def parse_time_param(value, end_of_day=False):
+    """
+    Parse a time filter: Unix seconds, YYYY-MM-DD, or YYYY-MM-DDTHH:MM[:SS] in server local time.
+
+    Returns:
+        float: Unix time, or None for an empty value. A bare date with end_of_day=True means 23:59:59.
+
+    Raises:
+        ValueError: If the value can't be parsed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            return datetime.datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    day = datetime.datetime.strptime(value, '%Y-%m-%d')
+    if end_of_day:
+        day += datetime.timedelta(days=1, seconds=-1)
+    return day.timestamp()
+
+def detection_filters_from_request():
+    """since/until/q query parameters as DetectionStore.query() filters. Raises ValueError on bad times."""
+    return {
+        'since': parse_time_param(request.args.get('since')),
+        'until': parse_time_param(request.args.get('until'), end_of_day=True),
+        'text': request.args.get('q', '').strip() or None
+    }
+
+def detection_for_display(row):
+    timestamp = datetime.datetime.fromtimestamp(row['timestamp'])
+    return {
+        'filename': row['filename'],
+        'timestamp': timestamp,
+        'unix_timestamp': int(row['timestamp']),  # Add Unix timestamp for JS
+        'formatted_time': timestamp.strftime("%Y-%m-%d %H:%M:%S"),  # Keep for fallback
+        'response_text': row['response_text'] if row['response_text'] is not None else "Response not available"
+    }
+
 @app.route('/detected-persons/<camera_id>')
 @login_required
 def person_gallery(camera_id):
-    """Display gallery of detected persons for a specific camera"""
-    global cameras
-    
+    """Display gallery of detected persons for a specific camera, one page at a time"""
     # Verify camera exists
-    if camera_id not in cameras:
-        cameras = scan_for_cameras()
-        if camera_id not in cameras:
-            flash(f"Camera {camera_id} not found.")
-            return redirect(url_for('home'))
+    camera_config = camera_registry.get(camera_id)
+    if camera_config is None:
+        flash(f"Camera {camera_id} not found.")
+        return redirect(url_for('home'))
     
-    camera_config = cameras[camera_id]
+    cursor = request.args.get('cursor') or None
+    if cursor is not None and decode_cursor(cursor) is None:
+        flash("Invalid page link - showing the newest detections.")
+        cursor = None
+    try:
+        filters = detection_filters_from_request()
+    except ValueError:
+        flash("Invalid date filter - use YYYY-MM-DD or YYYY-MM-DDTHH:MM.")
+        filters = {'since': None, 'until': None, 'text': None}
     
-    # Get all detected person images for this camera
+    # Newest first from the index; one extra row tells us whether there is an older page
+    is_filtered = any(value is not None for value in filters.values())
     images = []
-    if os.path.exists(PERSON_IMAGE_DIR):
-        try:
-            all_files = os.listdir(PERSON_IMAGE_DIR)
-            # Filter files for this camera and sort by timestamp (newest first)
-            camera_files = [f for f in all_files if f.startswith(f"{camera_id}_") and f.endswith('.jpg')]
-            camera_files.sort(reverse=True)  # Newest first
-            
-            for filename in camera_files:
-                # Parse timestamp from filename
-                try:
-                    parts = filename.split('_')
-                    if len(parts) >= 3:
-                        date_str = parts[1]
-                        time_str = parts[2]
-                        # Parse timestamp: YYYYMMDD_HHMMSS
-                        timestamp = datetime.datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
-                        
-                        # Try to read the corresponding response text file
-                        response_text = "Response not available"
-                        response_filename = filename.replace('.jpg', '.txt')
-                        response_file_path = os.path.join(PERSON_IMAGE_DIR, response_filename)
-                        
-                        try:
-                            if os.path.exists(response_file_path):
-                                with open(response_file_path, 'r', encoding='utf-8') as f:
-                                    response_text = f.read().strip()
-                        except Exception as e:
-                            print(f"Error reading response file {response_filename}: {e}")
-                            response_text = "Error reading response"
-                        
-                        images.append({
-                            'filename': filename,
-                            'timestamp': timestamp,
-                            'unix_timestamp': int(timestamp.timestamp()),  # Add Unix timestamp for JS
-                            'formatted_time': timestamp.strftime("%Y-%m-%d %H:%M:%S"),  # Keep for fallback
-                            'response_text': response_text
-                        })
-                except (ValueError, IndexError) as e:
-                    print(f"Error parsing timestamp from {filename}: {e}")
-                    # Still include the file but without parsed timestamp
-                    images.append({
-                        'filename': filename,
-                        'timestamp': None,
-                        'unix_timestamp': None,
-                        'formatted_time': 'Unknown',
-                        'response_text': 'Response not available'
-                    })
-        except OSError as e:
-            print(f"Error reading detected persons directory: {e}")
-            flash("Error reading detected persons directory.")
+    next_cursor = None
+    image_count = 0
+    match_count = 0
+    try:
+        rows = detection_store.query(camera_id, cursor=cursor, limit=GALLERY_PAGE_SIZE + 1, **filters)
+        if len(rows) > GALLERY_PAGE_SIZE:
+            rows = rows[:GALLERY_PAGE_SIZE]
+            next_cursor = encode_cursor(rows[-1])
+        images = [detection_for_display(row) for row in rows]
+        # The total drives "Delete All"; filtered pages also show how many detections match
+        image_count = detection_store.count(camera_id)
+        match_count = detection_store.count(camera_id, **filters) if is_filtered else image_count
+    except Exception as e:
+        print(f"Error reading detection index: {e}")
+        flash("Error reading detection index.")
     
     return render_template('person_gallery.html', 
                          camera_id=camera_id, 
                          camera_name=camera_config.get('name', camera_id),
                          images=images,
-                         image_count=len(images))
+                         image_count=image_count,
+                         match_count=match_count,
+                         next_cursor=next_cursor,
+                         is_first_page=cursor is None,
+                         filter_since=request.args.get('since', ''),
+                         filter_until=request.args.get('until', ''),
+                         filter_text=request.args.get('q', ''),
+                         is_filtered=is_filtered)
+
+@app.route('/api/detections')
+@login_required
+def api_detections():
+    """
+    Detections as JSON, newest first, streamed as they are read from the index.
+
+    Query parameters: camera_id, since, until, q (text in the AI response), cursor, limit.
+    The response's next_cursor continues the listing when more results may exist.
+    """
+    camera_id = request.args.get('camera_id') or None
+    cursor = request.args.get('cursor') or None
+    if cursor is not None and decode_cursor(cursor) is None:
+        return {"error": "Invalid parameter: malformed cursor"}, 400
+    try:
+        filters = detection_filters_from_request()
+        limit = int(request.args.get('limit', GALLERY_PAGE_SIZE))
+    except ValueError as e:
+        return {"error": f"Invalid parameter: {e}"}, 400
+    limit = max(1, min(limit, API_DETECTIONS_MAX_LIMIT))
+
+    def generate():
+        yield '{"detections": ['
+        count = 0
+        last_row = None
+        for row in detection_store.iter_query(limit=limit, camera_id=camera_id, cursor=cursor, **filters):
+            item = {
+                'id': row['id'],
+                'camera_id': row['camera_id'],
+                'timestamp': row['timestamp'],
+                'time': datetime.datetime.fromtimestamp(row['timestamp']).isoformat(),
+                'filename': row['filename'],
+                'image_url': url_for('serve_detected_person_image', filename=row['filename']),
+                'thumbnail_url': url_for('serve_detected_person_image', filename=row['filename'], size='small'),
+                'response_text': row['response_text'],
+                'file_size': row['file_size']
+            }
+            yield (',' if count else '') + json.dumps(item)
+            count += 1
+            last_row = row
+        next_cursor = encode_cursor(last_row) if count == limit and last_row is not None else None
+        yield f'], "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/detected-persons/image/<filename>')
 @login_required
 def serve_detected_person_image(filename):
-    """Serve a specific detected person image"""
+    """Serve a specific detected person image; ?size=small|medium returns a cached thumbnail"""
     # Security check - ensure filename doesn't contain path traversal
     if '..' in filename or '/' in filename or '\\' in filename:
         return "Invalid filename", 400
     
-    file_path = os.path.join(PERSON_IMAGE_DIR, filename)
+    rel_path = resolve_detection_image(filename)
+    file_path = os.path.join(PERSON_IMAGE_DIR, rel_path)
+    
+    size_name = request.args.get('size')
+    cacheable = True
+    if size_name:
+        if size_name not in THUMBNAIL_SIZES:
+            return {"error": "Invalid size", "allowed": list(THUMBNAIL_SIZES)}, 400
+        thumbnail = get_thumbnail(rel_path, size_name)
+        if thumbnail is not None:
+            file_path = thumbnail
+        else:
+            # Thumbnail couldn't be written: serve the original, but don't let the browser keep it as the thumbnail
+            cacheable = False
     
-    # Check if file exists and is actually a file
-    if not os.path.exists(file_path) or not os.path.isfile(file_path):
+    # Check if file exists and is actually a file (one stat call, reused for the validators)
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return "Image not found", 404
+    if not stat.S_ISREG(file_stat.st_mode):
         return "Image not found", 404
     
     try:
-        return send_file(file_path, mimetype='image/jpeg')
+        # conditional=True answers If-None-Match / If-Modified-Since with 304 and Range with 206;
+        # without X-Sendfile the file goes through wsgi.file_wrapper (sendfile() on servers that support it)
+        response = send_file(file_path, mimetype='image/jpeg', conditional=True,
+                             etag=detection_image_etag(file_path, file_stat),
+                             last_modified=file_stat.st_mtime,
+                             max_age=DETECTION_IMAGE_MAX_AGE if cacheable else 0)
+        response.cache_control.private = True
+        if cacheable:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
     except Exception as e:
         print(f"Error serving image {filename}: {e}")
         return "Error serving image", 500
@@ -2284,6 +4622,31 @@ def person_detection_logs():
                          ai_model_type=AI_MODEL_TYPE,
                          local_gemma3_url=LOCAL_GEMMA3_URL)
 
+@app.route('/detected-persons/stats')
+@login_required
+def detection_stats():
+    """Detection pipeline statistics: scheduler cadence/lag, motion gate and result cache"""
+    return {
+        'scheduler': detection_scheduler.stats(),
+        'motion_gate': motion_gate.stats(),
+        'detection_cache': detection_cache.stats(),
+        'inference': inference_client.stats(),
+        'local_detector': local_person_detector.stats(),
+        'preprocessing': get_ai_preprocess_stats()
+    }
+
+@app.route('/detected-persons/storage')
+@login_required
+def detection_storage_stats():
+    """Disk usage of the saved detection images per camera, plus retention activity"""
+    return detection_retention.stats()
+
+@app.route('/http-stats')
+@login_required
+def http_stats():
+    """Per-host connection pool timing for camera and AI traffic"""
+    return http_pool.stats()
+
 @app.route('/ai-config')
 @login_required
 def ai_config():
@@ -2291,6 +4654,10 @@ def ai_config():
     return render_template('ai_config.html',
                          ai_model_type=AI_MODEL_TYPE,
                          local_gemma3_url=LOCAL_GEMMA3_URL,
+                         gemini_model_name=GEMINI_MODEL_NAME,
+                         local_dnn_available=local_person_detector.available(),
+                         local_dnn_model=LOCAL_DNN_MODEL,
+                         local_dnn_stage=LOCAL_DNN_STAGE,
                          gemini_api_key_set=bool(os.environ.get('GEMINI_API_KEY')),
                          local_gemma3_api_key_set=bool(LOCAL_GEMMA3_API_KEY))
 
@@ -2298,14 +4665,16 @@ def ai_config():
 @login_required
 def update_ai_config():
     """Update AI model configuration"""
-    global AI_MODEL_TYPE, LOCAL_GEMMA3_URL, LOCAL_GEMMA3_API_KEY
+    global AI_MODEL_TYPE, LOCAL_GEMMA3_URL, LOCAL_GEMMA3_API_KEY, GEMINI_MODEL_NAME, LOCAL_DNN_STAGE, LOCAL_GEMMA3_CONFIGURED
     
     new_model_type = request.form.get('ai_model_type', 'gemini')
     new_local_url = request.form.get('local_gemma3_url', 'https://geospotx.com')
     new_api_key = request.form.get('local_gemma3_api_key', '')
+    new_gemini_model = request.form.get('gemini_model_name', GEMINI_MODEL_NAME).strip()
+    new_stage = request.form.get('local_dnn_stage', 'off')
     
     # Validate model type
-    if new_model_type not in ['gemini', 'local_gemma3']:
+    if new_model_type not in ['gemini', 'local_gemma3', 'local_dnn']:
         flash('Invalid AI model type selected.')
         return redirect(url_for('ai_config'))
     
@@ -2315,16 +4684,35 @@ def update_ai_config():
             flash('Local Gemma3 URL must start with http:// or https://')
             return redirect(url_for('ai_config'))
     
+    if new_stage not in LOCAL_DNN_STAGES:
+        flash('Invalid local detector mode selected.')
+        return redirect(url_for('ai_config'))
+    
+    if (new_model_type == 'local_dnn' or new_stage != 'off') and not local_person_detector.available():
+        flash(f'Local detector model not found at {LOCAL_DNN_MODEL}.')
+        return redirect(url_for('ai_config'))
+    
+    if not re.match(r'^[A-Za-z0-9._/-]+$', new_gemini_model):
+        flash('Invalid Gemini model name.')
+        return redirect(url_for('ai_config'))
+    
     # Update configuration
+    if new_model_type == 'local_gemma3' or new_local_url != LOCAL_GEMMA3_URL:
+        LOCAL_GEMMA3_CONFIGURED = True
     AI_MODEL_TYPE = new_model_type
     LOCAL_GEMMA3_URL = new_local_url
     LOCAL_GEMMA3_API_KEY = new_api_key
+    GEMINI_MODEL_NAME = new_gemini_model
+    LOCAL_DNN_STAGE = new_stage
     
     # Save configuration to file
     save_ai_config()
     
+    # Results from the previous model shouldn't be reused
+    detection_cache.invalidate()
+    
     # Log the configuration change
-    person_logger.info(f"AI configuration updated by {session['username']}: Model={AI_MODEL_TYPE}, URL={LOCAL_GEMMA3_URL}")
+    person_logger.info(f"AI configuration updated by {session['username']}: Model={AI_MODEL_TYPE}, URL={LOCAL_GEMMA3_URL}, Gemini model={GEMINI_MODEL_NAME}")
     
     flash(f'AI configuration updated successfully. Now using {AI_MODEL_TYPE.upper()} model.')
     return redirect(url_for('ai_config'))
@@ -2333,37 +4721,46 @@ def update_ai_config():
 @login_required
 def delete_all_person_images(camera_id):
     """Delete all detected person images for a specific camera"""
-    global cameras
-    
     # Verify camera exists
-    if camera_id not in cameras:
-        cameras = scan_for_cameras()
-        if camera_id not in cameras:
-            return {"error": "Camera not found"}, 404
+    if camera_registry.get(camera_id) is None:
+        return {"error": "Camera not found"}, 404
     
     if not os.path.exists(PERSON_IMAGE_DIR):
         return {"success": True, "message": "No images to delete", "deleted_count": 0}
     
     try:
-        all_files = os.listdir(PERSON_IMAGE_DIR)
-        # Filter files for this camera (both .jpg and .txt files)
-        camera_files = [f for f in all_files if f.startswith(f"{camera_id}_")]
-        
         deleted_count = 0
         errors = []
         
+        # Oldest first in batches, straight from the index (no directory listing)
+        while True:
+            rows = detection_store.oldest(camera_id, limit=RETENTION_BATCH_SIZE)
+            if not rows:
+                break
+            files_deleted, bytes_freed, batch_errors = delete_detection_images(rows)
+            deleted_count += files_deleted
+            for error_msg in batch_errors:
+                errors.append(error_msg)
+                person_logger.error(error_msg)
+            if batch_errors:
+                break
+        
+        # Files left in the flat directory that never made it into the index
+        with os.scandir(PERSON_IMAGE_DIR) as entries:
+            camera_files = [entry.name for entry in entries if entry.name.startswith(f"{camera_id}_") and entry.is_file()]
         for filename in camera_files:
-            file_path = os.path.join(PERSON_IMAGE_DIR, filename)
             try:
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                    deleted_count += 1
-                    person_logger.info(f"Deleted detection file: {filename} (requested by {session['username']})")
+                os.remove(os.path.join(PERSON_IMAGE_DIR, filename))
+                deleted_count += 1
+                if filename.endswith('.jpg'):
+                    delete_thumbnails(filename)
             except OSError as e:
                 error_msg = f"Failed to delete {filename}: {str(e)}"
                 errors.append(error_msg)
                 person_logger.error(error_msg)
         
+        person_logger.info(f"Deleted {deleted_count} detection files for {camera_id} (requested by {session['username']})")
+        
         if errors:
             return {
                 "success": False, 
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the detection result cache
+"""
+
+from detection_cache import DetectionResultCache, cache_allowed
+
+# server.py defaults: DETECTION_INTERVAL and MOTION_CHANGE_THRESHOLD
+CHECK_INTERVAL = 60
+CHANGE_THRESHOLD = 0.01
+
+FRAME_HASH = 0b1011 << 200
+
+def test_person_standing_still_hits_with_default_settings():
+    cache = DetectionResultCache()
+    # Arrival: the frame changed, so the model is asked and its answer cached
+    assert not cache_allowed("motion", 0.2, CHANGE_THRESHOLD)
+    cache.store('camera1', FRAME_HASH, True, 'yes [age=30: standing]', now=1000)
+
+    # Next check: nothing moved, but the gate forces a check because a person is present
+    assert cache_allowed("person present", 0.002, CHANGE_THRESHOLD)
+    cached = cache.lookup('camera1', FRAME_HASH ^ 1, now=1000 + CHECK_INTERVAL)
+    assert cached is not None, "expected a cache hit one check interval later"
+    assert cached['is_present'] and cached['distance'] == 1
+    assert cache.stats()['hits'] == 1
+
+def test_changed_frames_and_periodic_rechecks_go_to_the_model():
+    assert not cache_allowed("person present", 0.05, CHANGE_THRESHOLD)
+    assert not cache_allowed("periodic re-check", 0.0, CHANGE_THRESHOLD)
+    assert not cache_allowed("new background model", 1.0, CHANGE_THRESHOLD)
+
+def test_negative_answers_are_not_cached():
+    cache = DetectionResultCache()
+    cache.store('camera1', FRAME_HASH, False, 'no', now=1000)
+    assert cache.lookup('camera1', FRAME_HASH, now=1001) is None
+    assert cache.stats()['entries'] == {}
+
+def test_entries_expire_and_distant_hashes_miss():
+    cache = DetectionResultCache(max_distance=2, ttl=300)
+    cache.store('camera1', FRAME_HASH, True, 'yes', now=1000)
+    assert cache.lookup('camera1', FRAME_HASH ^ 0b111, now=1010) is None
+    assert cache.lookup('camera2', FRAME_HASH, now=1010) is None
+    assert cache.lookup('camera1', FRAME_HASH, now=1301) is None
+    assert cache.stats()['misses'] == 3
+
+if __name__ == "__main__":
+    tests = [obj for name, obj in sorted(globals().items()) if name.startswith('test_') and callable(obj)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        exit(1)
+    print(f"\n🎉 All {len(tests)} detection cache tests passed!")
+    exit(0)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the SQLite detection index
+"""
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from detection_store import DetectionStore, encode_cursor, parse_detection_filename, shard_path
+
+UUID = '123e4567-e89b-12d3-a456-426614174000'
+
+def make_store():
+    directory = tempfile.mkdtemp()
+    return DetectionStore(os.path.join(directory, 'detections.db')), directory
+
+def save_image(directory, name, response_text=None):
+    with open(os.path.join(directory, name), 'wb') as f:
+        f.write(b'\xff\xd8jpeg\xff\xd9')
+    if response_text is not None:
+        with open(os.path.join(directory, name[:-4] + '.txt'), 'w', encoding='utf-8') as f:
+            f.write(response_text)
+
+def test_parse_detection_filename():
+    camera_id, timestamp = parse_detection_filename(f'camera1_20240115_103000_{UUID}.jpg')
+    assert camera_id == 'camera1'
+    assert timestamp == datetime.datetime(2024, 1, 15, 10, 30, 0)
+    assert parse_detection_filename(f'front_door_20240115_103000_{UUID}.jpg')[0] == 'front_door'
+    assert parse_detection_filename(f'camera1_20240115_103000_{UUID}.txt') is None
+    assert parse_detection_filename('notes.jpg') is None
+
+def test_add_and_list_newest_first():
+    store, directory = make_store()
+    try:
+        base = datetime.datetime(2024, 1, 15, 10, 0, 0)
+        for minute in (5, 1, 3):
+            store.add('camera1', base + datetime.timedelta(minutes=minute), f'camera1_{minute}.jpg', f'yes {minute}', 100)
+        store.add('camera2', base, 'camera2_0.jpg', 'yes', 100)
+        rows = store.list('camera1')
+        assert [row['filename'] for row in rows] == ['camera1_5.jpg', 'camera1_3.jpg', 'camera1_1.jpg']
+        assert rows[0]['response_text'] == 'yes 5'
+        assert store.count('camera1') == 3
+        assert store.count() == 4
+        assert len(store.list('camera1', limit=2)) == 2
+    finally:
+        shutil.rmtree(directory)
+
+def test_query_cursor_pagination():
+    store, directory = make_store()
+    try:
+        # Several rows share a timestamp so the cursor has to break ties by id
+        for i in range(23):
+            store.add('camera1', 1000.0 + i // 3, f'camera1_{i:02d}.jpg', 'yes')
+        store.add('camera2', 5000.0, 'camera2.jpg', 'yes')
+
+        seen = []
+        cursor = None
+        while True:
+            rows = store.query('camera1', cursor=cursor, limit=5)
+            seen.extend(row['filename'] for row in rows)
+            if len(rows) < 5:
+                break
+            cursor = encode_cursor(rows[-1])
+        assert len(seen) == 23 and len(set(seen)) == 23
+        assert seen == [row['filename'] for row in store.list('camera1')]
+        assert [row['filename'] for row in store.iter_query(batch_size=4, camera_id='camera1')] == seen
+        assert len(list(store.iter_query(batch_size=4, limit=10, camera_id='camera1'))) == 10
+    finally:
+        shutil.rmtree(directory)
+
+def test_query_filters():
+    store, directory = make_store()
+    try:
+        store.add('camera1', 1000.0, 'a.jpg', 'yes [age=30: walking]')
+        store.add('camera1', 2000.0, 'b.jpg', 'yes [age=40: Sitting]')
+        store.add('camera1', 3000.0, 'c.jpg', 'yes [age=50: walking_dog 100%]')
+        assert [r['filename'] for r in store.query('camera1', text='WALKING')] == ['c.jpg', 'a.jpg']
+        assert [r['filename'] for r in store.query('camera1', text='100%')] == ['c.jpg']
+        assert [r['filename'] for r in store.query('camera1', text='g_d')] == ['c.jpg']
+        assert [r['filename'] for r in store.query('camera1', since=1500, until=3000)] == ['c.jpg', 'b.jpg']
+        assert [r['filename'] for r in store.query(text='sitting')] == ['b.jpg']
+        assert store.count('camera1', text='walking') == 2
+        assert store.count('camera1', since=1500, until=3000) == 2
+        assert store.count('camera1') == 3
+    finally:
+        shutil.rmtree(directory)
+
+def test_delete():
+    store, directory = make_store()
+    try:
+        store.add('camera1', 1000.0, 'a.jpg', 'yes')
+        store.add('camera1', 1001.0, 'b.jpg', 'yes')
+        store.add('camera2', 1002.0, 'c.jpg', 'yes')
+        assert store.delete('a.jpg') == 1
+        assert store.delete_camera('camera1') == 1
+        assert store.count() == 1
+    finally:
+        shutil.rmtree(directory)
+
+def test_reindex_adds_missing_and_drops_stale():
+    store, directory = make_store()
+    image_dir = os.path.join(directory, 'detected_persons')
+    os.makedirs(image_dir)
+    try:
+        save_image(image_dir, f'camera1_20240115_103000_{UUID}.jpg', 'yes [age=30: walking]')
+        save_image(image_dir, f'camera2_20240116_080000_{UUID}.jpg')
+        save_image(image_dir, 'unrelated.jpg')
+        store.add('camera1', 1000.0, 'deleted_elsewhere.jpg', 'yes')
+
+        assert store.reindex(image_dir) == (2, 1)
+        rows = store.list('camera1')
+        assert len(rows) == 1
+        assert rows[0]['response_text'] == 'yes [age=30: walking]'
+        assert rows[0]['timestamp'] == datetime.datetime(2024, 1, 15, 10, 30, 0).timestamp()
+        assert store.list('camera2')[0]['response_text'] is None
+
+        # Nothing changes on a second pass
+        assert store.reindex(image_dir) == (0, 0)
+    finally:
+        shutil.rmtree(directory)
+
+def test_reindex_keeps_rows_saved_during_the_walk():
+    store, directory = make_store()
+    image_dir = os.path.join(directory, 'detected_persons')
+    os.makedirs(image_dir)
+    try:
+        name = f'camera1_20240115_103000_{UUID}.jpg'
+        late = f'camera1_20240115_103100_{UUID}.jpg'
+        save_image(image_dir, name)
+        real_walk = os.walk
+
+        def walk_then_save(top):
+            # The server saves an image after the directory was listed
+            entries = list(real_walk(top))
+            save_image(image_dir, late, 'yes')
+            store.add('camera1', 2000.0, late, 'yes', rel_path=late)
+            return iter(entries)
+
+        os.walk = walk_then_save
+        try:
+            assert store.reindex(image_dir) == (1, 0)
+        finally:
+            os.walk = real_walk
+        assert store.get(late)['response_text'] == 'yes'
+        assert store.count() == 2
+    finally:
+        shutil.rmtree(directory)
+
+def test_expired_applies_age_count_and_size_limits():
+    store, directory = make_store()
+    try:
+        for i in range(10):
+            store.add('camera1', 1000.0 + i, f'camera1_{i}.jpg', 'yes', 100)
+        store.add('camera2', 1000.0, 'camera2_0.jpg', 'yes', 100)
+
+        names = lambda rows: [row['filename'] for row in rows]
+        assert store.expired('camera1') == []
+        assert names(store.expired('camera1', max_count=7)) == ['camera1_0.jpg', 'camera1_1.jpg', 'camera1_2.jpg']
+        assert names(store.expired('camera1', max_bytes=850)) == ['camera1_0.jpg', 'camera1_1.jpg']
+        assert names(store.expired('camera1', max_age=10, now=1013.5)) == ['camera1_0.jpg', 'camera1_1.jpg', 'camera1_2.jpg', 'camera1_3.jpg']
+        # The strictest limit wins, and batches are capped
+        assert len(store.expired('camera1', max_count=8, max_age=10, now=1015.5, limit=3)) == 3
+        assert store.expired('camera2', max_count=1) == []
+
+        usage = store.usage()
+        assert usage['camera1']['count'] == 10 and usage['camera1']['bytes'] == 1000
+        assert usage['camera1']['oldest'] == 1000.0 and usage['camera1']['newest'] == 1009.0
+        assert store.delete_many(['camera1_0.jpg', 'camera1_1.jpg']) == 2
+        assert store.usage('camera1')['camera1']['count'] == 8
+    finally:
+        shutil.rmtree(directory)
+
+def test_compact_moves_flat_images_into_shards():
+    store, directory = make_store()
+    image_dir = os.path.join(directory, 'detected_persons')
+    os.makedirs(image_dir)
+    try:
+        flat = [f'camera1_20240115_1030{i:02d}_{UUID}.jpg' for i in range(3)]
+        for name in flat:
+            save_image(image_dir, name, 'yes')
+        assert store.reindex(image_dir) == (3, 0)
+        assert len(store.unsharded()) == 3
+
+        moved, dropped = store.compact(image_dir, limit=2)
+        assert len(moved) == 2 and dropped == 0
+        moved += store.compact(image_dir, limit=2)[0]
+        assert len(moved) == 3 and store.compact(image_dir) == ([], 0)
+
+        rel_path = store.get(flat[0])['rel_path']
+        assert rel_path == f'camera1/20240115/{flat[0]}'
+        assert os.path.isfile(os.path.join(image_dir, rel_path))
+        assert os.path.isfile(os.path.join(image_dir, rel_path[:-4] + '.txt'))
+        assert not os.path.exists(os.path.join(image_dir, flat[0]))
+        assert sorted(os.listdir(image_dir)) == ['camera1']
+
+        # Reindex finds the sharded files where compact() left them
+        assert store.reindex(image_dir) == (0, 0)
+
+        # Rows whose image vanished are dropped instead of blocking later batches
+        store.add('camera1', 1000.0, 'gone_1.jpg', 'yes')
+        store.add('camera1', 1000.0, 'gone_2.jpg', 'yes')
+        name = f'camera1_20240116_080000_{UUID}.jpg'
+        save_image(image_dir, name)
+        store.add('camera1', datetime.datetime(2024, 1, 16, 8, 0), name, 'yes')
+        assert store.compact(image_dir, limit=2) == ([], 2)
+        assert len(store.compact(image_dir, limit=2)[0]) == 1
+        assert store.unsharded() == []
+    finally:
+        shutil.rmtree(directory)
+
+def test_reindex_scans_shards_and_skips_thumbnails():
+    store, directory = make_store()
+    image_dir = os.path.join(directory, 'detected_persons')
+    name = f'camera1_20240115_103000_{UUID}.jpg'
+    rel_path = shard_path('camera1', datetime.datetime(2024, 1, 15, 10, 30), name)
+    os.makedirs(os.path.join(image_dir, os.path.dirname(rel_path)))
+    os.makedirs(os.path.join(image_dir, 'thumbnails', 'small', 'camera1', '20240115'))
+    try:
+        save_image(os.path.join(image_dir, 'camera1', '20240115'), name, 'yes [age=30: walking]')
+        save_image(os.path.join(image_dir, 'thumbnails', 'small', 'camera1', '20240115'), name)
+
+        assert store.reindex(image_dir) == (1, 0)
+        row = store.get(name)
+        assert row['rel_path'] == rel_path
+        assert row['response_text'] == 'yes [age=30: walking]'
+
+        # A file moved by hand is picked up at its new location
+        os.replace(os.path.join(image_dir, rel_path), os.path.join(image_dir, name))
+        assert store.reindex(image_dir) == (0, 0)
+        assert store.get(name)['rel_path'] == name
+    finally:
+        shutil.rmtree(directory)
+
+def test_existing_database_gains_rel_path_column():
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'detections.db')
+    try:
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE detections (id INTEGER PRIMARY KEY, camera_id TEXT NOT NULL, timestamp REAL NOT NULL, '
+                     'filename TEXT NOT NULL UNIQUE, response_text TEXT, file_size INTEGER)')
+        conn.execute("INSERT INTO detections (camera_id, timestamp, filename) VALUES ('camera1', 1000.0, 'a.jpg')")
+        conn.commit()
+        conn.close()
+
+        store = DetectionStore(db_path)
+        assert store.get('a.jpg')['rel_path'] is None
+        assert [row['filename'] for row in store.unsharded()] == ['a.jpg']
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    tests = [obj for name, obj in sorted(globals().items()) if name.startswith('test_') and callable(obj)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        exit(1)
+    print(f"\n🎉 All {len(tests)} detection store tests passed!")
+    exit(0)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the incremental MJPEG parser
+"""
+
+from mjpeg_parser import MJPEGParser, parse_boundary
+
+BOUNDARY = '123456789000000000000987654321'
+
+def make_part(payload, content_length=True, boundary=BOUNDARY):
+    """Build one multipart section the way ESP32 camera firmware sends it"""
+    headers = b'Content-Type: image/jpeg\r\n'
+    if content_length:
+        headers += b'Content-Length: ' + str(len(payload)).encode() + b'\r\n'
+    return b'--' + boundary.encode() + b'\r\n' + headers + b'\r\n' + payload + b'\r\n'
+
+def fake_jpeg(n, size=2000):
+    body = bytes((n + i) % 251 for i in range(size))
+    return b'\xff\xd8' + body + b'\xff\xd9'
+
+def feed_in_chunks(parser, data, chunk_size):
+    frames = []
+    for i in range(0, len(data), chunk_size):
+        frames.extend(parser.feed(data[i:i + chunk_size]))
+    return frames
+
+def test_parse_boundary():
+    assert parse_boundary(f'multipart/x-mixed-replace;boundary={BOUNDARY}') == BOUNDARY
+    assert parse_boundary('multipart/x-mixed-replace; boundary="frame"') == 'frame'
+    assert parse_boundary('image/jpeg') is None
+    assert parse_boundary('') is None
+
+def test_frames_with_content_length():
+    payloads = [fake_jpeg(n) for n in range(5)]
+    stream = b''.join(make_part(p) for p in payloads)
+    for chunk_size in (1, 7, 100, 4096, len(stream)):
+        parser = MJPEGParser(BOUNDARY)
+        # The last frame is complete as soon as Content-Length bytes have arrived
+        assert feed_in_chunks(parser, stream, chunk_size) == payloads, chunk_size
+
+def test_frames_without_content_length():
+    payloads = [fake_jpeg(n) for n in range(5)]
+    stream = b''.join(make_part(p, content_length=False) for p in payloads)
+    for chunk_size in (1, 13, 4096):
+        parser = MJPEGParser(BOUNDARY)
+        # Without Content-Length a frame ends at the next boundary, so the last one is still pending
+        assert feed_in_chunks(parser, stream, chunk_size) == payloads[:-1], chunk_size
+
+def test_content_length_allows_boundary_inside_payload():
+    payload = b'\xff\xd8--' + BOUNDARY.encode() + b'\r\nnot a boundary\xff\xd9'
+    stream = make_part(payload) + make_part(fake_jpeg(1))
+    parser = MJPEGParser(BOUNDARY)
+    assert feed_in_chunks(parser, stream, 3) == [payload, fake_jpeg(1)]
+
+def test_leading_garbage_and_empty_headers():
+    payload = fake_jpeg(2)
+    stream = b'garbage before the first part' + b'--frame\r\n\r\n' + payload + b'\r\n--frame\r\n'
+    parser = MJPEGParser('frame')
+    assert feed_in_chunks(parser, stream, 5) == [payload]
+
+def test_buffer_is_compacted():
+    payloads = [fake_jpeg(n, size=50000) for n in range(20)]
+    stream = b''.join(make_part(p) for p in payloads)
+    parser = MJPEGParser(BOUNDARY)
+    assert len(feed_in_chunks(parser, stream, 4096)) == 20
+    assert len(parser._buffer) < 2 * 4096 + 200
+    assert parser.frames_parsed == 20
+
+def test_resync_after_oversized_frame():
+    parser = MJPEGParser(BOUNDARY, max_frame_size=10000)
+    broken = b'--' + BOUNDARY.encode() + b'\r\nContent-Type: image/jpeg\r\n\r\n' + b'x' * 20000
+    assert feed_in_chunks(parser, broken, 4096) == []
+    assert parser.resyncs >= 1
+    payload = fake_jpeg(3)
+    assert feed_in_chunks(parser, make_part(payload), 4096) == [payload]
+
+if __name__ == "__main__":
+    tests = [obj for name, obj in sorted(globals().items()) if name.startswith('test_') and callable(obj)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        exit(1)
+    print(f"\n🎉 All {len(tests)} MJPEG parser tests passed!")
+    exit(0)